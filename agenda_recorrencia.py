@@ -0,0 +1,237 @@
+"""
+Calendário de ocorrências de transações recorrentes.
+
+A ocorrência de índice k de uma recorrência é sempre calculada a partir da
+data de início (data_inicio + k * passo), e não a partir da ocorrência
+anterior. Assim uma janela [inicio, fim] é convertida diretamente em um
+intervalo de índices, e o custo de projetar um período depende apenas do
+tamanho da janela, não da idade da recorrência.
+"""
+from array import array
+from itertools import count
+from datetime import date, datetime, timedelta
+from dateutil.relativedelta import relativedelta
+
+# Passo de cada tipo de recorrência em (dias, meses).
+# A chave é o valor do enum TipoRecorrencia para manter o módulo sem dependência dos modelos.
+PASSOS = {
+    'semanal': (7, 0),
+    'quinzenal': (15, 0),
+    'mensal': (0, 1),
+    'trimestral': (0, 3),
+    'semestral': (0, 6),
+    'anual': (0, 12),
+}
+
+
+def _passo(tipo):
+    """Retorna (dias, meses) do tipo de recorrência, ou None para recorrência única"""
+    return PASSOS.get(getattr(tipo, 'value', tipo))
+
+
+def _meses_entre(a, b):
+    return (b.year - a.year) * 12 + (b.month - a.month)
+
+
+def data_ocorrencia(tipo, data_inicio, indice):
+    """Retorna a data da ocorrência de índice `indice` (0 = data_inicio)"""
+    passo = _passo(tipo)
+    if passo is None or indice == 0:
+        return data_inicio
+    dias, meses = passo
+    if dias:
+        return data_inicio + timedelta(days=dias * indice)
+    return data_inicio + relativedelta(months=meses * indice)
+
+
+def primeiro_indice(tipo, data_inicio, data):
+    """Menor índice (>= 0) cuja ocorrência é igual ou posterior a `data`"""
+    if data <= data_inicio:
+        return 0
+    passo = _passo(tipo)
+    if passo is None:
+        # Recorrência única: não há ocorrência depois da data de início
+        return 1
+    dias, meses = passo
+    if dias:
+        return -((data_inicio - data) // timedelta(days=dias))
+
+    # Estimativa pelo número de meses e ajuste fino (o dia pode ser truncado no fim do mês)
+    indice = max(0, -(-_meses_entre(data_inicio, data) // meses))
+    while indice > 0 and data_ocorrencia(tipo, data_inicio, indice - 1) >= data:
+        indice -= 1
+    while data_ocorrencia(tipo, data_inicio, indice) < data:
+        indice += 1
+    return indice
+
+
+def ultimo_indice(tipo, data_inicio, data):
+    """Maior índice cuja ocorrência é igual ou anterior a `data` (-1 se nenhuma)"""
+    if data < data_inicio:
+        return -1
+    passo = _passo(tipo)
+    if passo is None:
+        return 0
+    dias, meses = passo
+    if dias:
+        return (data - data_inicio) // timedelta(days=dias)
+
+    indice = _meses_entre(data_inicio, data) // meses
+    while data_ocorrencia(tipo, data_inicio, indice + 1) <= data:
+        indice += 1
+    while indice >= 0 and data_ocorrencia(tipo, data_inicio, indice) > data:
+        indice -= 1
+    return indice
+
+
+def indice_do_periodo(tipo, data_inicio, data):
+    """
+    Índice da ocorrência cujo período contém `data` (-1 se anterior ao início).
+
+    Com passo em meses, é o índice do mês de `data`, qualquer que seja o dia:
+    as linhas gravadas pelo cálculo antigo, que avançava a partir da ocorrência
+    anterior (31/01 -> 28/02 -> 28/03 -> 28/04), ficam com o índice do seu mês, e
+    não com o da ocorrência anterior no calendário atual (28/04 -> 31/03). Fora
+    dos meses do calendário, e com passo em dias, equivale a `ultimo_indice`.
+    """
+    if data < data_inicio:
+        return -1
+    passo = _passo(tipo)
+    if passo is None or passo[0]:
+        return ultimo_indice(tipo, data_inicio, data)
+    meses = _meses_entre(data_inicio, data)
+    if meses % passo[1]:
+        return ultimo_indice(tipo, data_inicio, data)
+    return meses // passo[1]
+
+
+def indice_da_data(tipo, data_inicio, data):
+    """Retorna o índice da ocorrência que cai no mesmo dia de `data`, ou None se a data não pertence ao calendário"""
+    indice = ultimo_indice(tipo, data_inicio, datetime.combine(data.date(), datetime.max.time()))
+    if indice < 0:
+        return None
+    if data_ocorrencia(tipo, data_inicio, indice).date() != data.date():
+        return None
+    return indice
+
+
+class Ocorrencias:
+    """Sequência compacta de ocorrências consecutivas de uma recorrência.
+
+    As datas são armazenadas como ordinais em um `array`, e o horário (comum a
+    todas as ocorrências, herdado de data_inicio) é guardado uma única vez.
+    A iteração devolve pares (indice, datetime).
+    """
+    __slots__ = ('indice_inicial', 'ordinais', 'horario')
+
+    def __init__(self, indice_inicial, ordinais, horario):
+        self.indice_inicial = indice_inicial
+        self.ordinais = ordinais
+        self.horario = horario
+
+    def __len__(self):
+        return len(self.ordinais)
+
+    def __bool__(self):
+        return len(self.ordinais) > 0
+
+    def __iter__(self):
+        horario = self.horario
+        for deslocamento, ordinal in enumerate(self.ordinais):
+            yield self.indice_inicial + deslocamento, datetime.fromordinal(ordinal) + horario
+
+    def datas(self):
+        """Lista das datas (datetime) das ocorrências"""
+        return [data for _, data in self]
+
+    def por_mes(self):
+        """
+        Agrupa as ocorrências por mês, sem criar um datetime por ocorrência.
+
+        Returns:
+            Lista de ((ano, mes), indice da primeira ocorrência do mês, quantidade), em ordem
+        """
+        meses = []
+        atual = None
+        for deslocamento, ordinal in enumerate(self.ordinais):
+            dia = date.fromordinal(ordinal)
+            chave = (dia.year, dia.month)
+            if chave != atual:
+                atual = chave
+                meses.append([chave, self.indice_inicial + deslocamento, 0])
+            meses[-1][2] += 1
+        return [tuple(mes) for mes in meses]
+
+    @property
+    def indice_final(self):
+        """Índice da última ocorrência (ou indice_inicial - 1 quando vazia)"""
+        return self.indice_inicial + len(self.ordinais) - 1
+
+
+def calcular_ocorrencias(tipo, data_inicio, inicio, fim, data_fim=None, total_parcelas=None,
+                         indice_minimo=0, limite=None):
+    """
+    Calcula as ocorrências de uma recorrência dentro da janela [inicio, fim].
+
+    Args:
+        tipo: TipoRecorrencia (ou seu valor em texto)
+        data_inicio (datetime): data da primeira ocorrência (índice 0)
+        inicio, fim (datetime): limites inclusivos da janela
+        data_fim (datetime): data final da recorrência, se houver
+        total_parcelas (int): número total de parcelas, se for parcelada
+        indice_minimo (int): ignora ocorrências com índice menor que este
+        limite (int): número máximo de ocorrências retornadas
+
+    Returns:
+        Ocorrencias com o intervalo de índices que cai dentro da janela
+    """
+    if data_fim is not None and data_fim < fim:
+        fim = data_fim
+
+    primeiro = max(indice_minimo, primeiro_indice(tipo, data_inicio, inicio))
+    ultimo = ultimo_indice(tipo, data_inicio, fim)
+    if _passo(tipo) is None:
+        ultimo = min(ultimo, 0)
+    if total_parcelas is not None:
+        ultimo = min(ultimo, total_parcelas - 1)
+    if limite is not None:
+        ultimo = min(ultimo, primeiro + limite - 1)
+
+    horario = data_inicio - datetime.combine(data_inicio.date(), datetime.min.time())
+    ordinais = array('l')
+    if ultimo >= primeiro:
+        passo = _passo(tipo)
+        if passo is not None and passo[0]:
+            base = data_inicio.toordinal()
+            ordinais.extend(range(base + passo[0] * primeiro, base + passo[0] * ultimo + 1, passo[0]))
+        else:
+            ordinais.extend(data_ocorrencia(tipo, data_inicio, k).toordinal() for k in range(primeiro, ultimo + 1))
+    return Ocorrencias(primeiro, ordinais, horario)
+
+
+def iterar_ocorrencias(tipo, data_inicio, inicio, fim=None, data_fim=None, total_parcelas=None,
+                       indice_minimo=0):
+    """
+    Gera preguiçosamente as ocorrências (indice, data) a partir de `inicio`, em ordem de data.
+
+    Ao contrário de calcular_ocorrencias nada é pré-calculado: cada data só é
+    calculada quando pedida, então o chamador pode parar a iteração a qualquer
+    momento. Sem `fim`, `data_fim` nem `total_parcelas` a sequência não termina
+    (exceto para recorrência única).
+    """
+    if data_fim is not None and (fim is None or data_fim < fim):
+        fim = data_fim
+
+    ultimo = None
+    if _passo(tipo) is None:
+        ultimo = 0
+    if total_parcelas is not None:
+        ultimo = total_parcelas - 1 if ultimo is None else min(ultimo, total_parcelas - 1)
+
+    for indice in count(max(indice_minimo, primeiro_indice(tipo, data_inicio, inicio))):
+        if ultimo is not None and indice > ultimo:
+            return
+        data = data_ocorrencia(tipo, data_inicio, indice)
+        if fim is not None and data > fim:
+            return
+        yield indice, data
@@ -0,0 +1,296 @@
+"""
+Agregação dos dados da página de relatórios.
+
+As transações reais do período são somadas no banco, em uma única consulta
+agrupada por (ano_mes, tipo, categoria, descrição normalizada). As projeções
+das recorrências são somadas por mês diretamente dos lotes compactos do
+ProjectionEngine, sem criar um objeto por ocorrência. As duas fontes são
+mescladas em células com a parte real e a projetada lado a lado, e todos os
+quadros do relatório (totais mensais, totais por categoria, matriz categoria x
+mês e linhas por descrição) são derivados dessas células, cujo número depende
+da variedade dos dados e não da quantidade de transações.
+"""
+from sqlalchemy import func
+from models import Transacao, TipoTransacao
+from normalizacao_descricao import limpar_descricao, normalizar_descricao
+
+MESES_PT = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+
+
+def rotulo_mes(ano, mes):
+    """Rótulo do mês usado nas colunas do relatório (ex: 'Jan 2025')"""
+    return f"{MESES_PT[mes - 1]} {ano}"
+
+
+class Celula:
+    """
+    Transações reais e projeções somadas de um mês do período, tipo, categoria e
+    descrição normalizada.
+
+    Attributes:
+        mes (int): índice do mês em AgregacaoRelatorio.meses
+        real, projetado (float): soma dos valores reais e das projeções
+        quantidade (int): número de transações reais e de ocorrências projetadas
+        exibicao, exibicao_projecao (str): descrição mostrada vinda das transações
+            reais e das projeções
+        tem_real, tem_projecao (bool): se houve transações reais / projeções
+    """
+
+    __slots__ = ('mes', 'tipo', 'categoria_id', 'descricao', 'real', 'projetado', 'quantidade',
+                 'exibicao', 'exibicao_projecao', 'tem_real', 'tem_projecao')
+
+    def __init__(self, mes, tipo, categoria_id, descricao):
+        self.mes = mes
+        self.tipo = tipo
+        self.categoria_id = categoria_id
+        self.descricao = descricao
+        self.real = 0
+        self.projetado = 0
+        self.quantidade = 0
+        self.exibicao = ''
+        self.exibicao_projecao = ''
+        self.tem_real = False
+        self.tem_projecao = False
+
+    @property
+    def valor(self):
+        return self.real + self.projetado
+
+
+class AgregacaoRelatorio:
+    """
+    Células agregadas do relatório de um período.
+
+    As transações reais (somadas no banco) e as projeções (somadas por mês) são
+    mescladas, à medida que chegam, em uma única célula por (mês, tipo, categoria_id,
+    descrição normalizada); a chave e o índice do mês são calculados uma vez por linha
+    recebida e todos os quadros percorrem só as células. As projeções começam depois
+    da última ocorrência gravada de cada recorrência (marca d'água), então reais e
+    projeções de uma recorrência nunca se sobrepõem e todas são somadas.
+    """
+
+    def __init__(self, periodo_inicio, periodo_fim):
+        self.meses = []
+        atual = (periodo_inicio.year, periodo_inicio.month)
+        ultimo = (periodo_fim.year, periodo_fim.month)
+        while atual <= ultimo:
+            self.meses.append(atual)
+            atual = (atual[0] + 1, 1) if atual[1] == 12 else (atual[0], atual[1] + 1)
+        self.rotulos = [rotulo_mes(ano, mes) for ano, mes in self.meses]
+        self._indices = {mes: i for i, mes in enumerate(self.meses)}
+        self.celulas = {}
+
+    def _celula(self, ano, mes, tipo, categoria_id, descricao):
+        """Célula do mês, tipo, categoria e descrição normalizada (None se o mês está fora do período)"""
+        indice = self._indices.get((ano, mes))
+        if indice is None:
+            return None
+        chave = (indice, tipo, categoria_id, descricao)
+        celula = self.celulas.get(chave)
+        if celula is None:
+            celula = self.celulas[chave] = Celula(indice, tipo, categoria_id, descricao)
+        return celula
+
+    def adicionar_reais(self, query):
+        """
+        Soma no banco as transações selecionadas por `query` (uma consulta de Transacao
+        já filtrada por usuário, período, tipo, categoria e conta).
+        """
+        linhas = query.with_entities(
+            Transacao.ano_mes, Transacao.tipo, Transacao.categoria_id, Transacao.descricao_normalizada,
+            func.min(Transacao.descricao), func.sum(Transacao.valor), func.count(Transacao.id)
+        ).group_by(
+            Transacao.ano_mes, Transacao.tipo, Transacao.categoria_id, Transacao.descricao_normalizada
+        ).order_by(None)
+        for ano_mes, tipo, categoria_id, normalizada, descricao, valor, quantidade in linhas:
+            celula = self._celula(ano_mes // 100, ano_mes % 100, tipo, categoria_id, normalizada or '')
+            if celula is None:
+                continue
+            celula.real += valor or 0
+            celula.quantidade += quantidade
+            celula.exibicao = (descricao or '').strip()
+            celula.tem_real = True
+
+    def adicionar_projecoes(self, lotes, tipo=None, categoria_ids=None):
+        """
+        Soma as projeções de cada lote (ProjecoesRecorrencia) mês a mês.
+
+        Args:
+            lotes: lotes de projeções, como os devolvidos por ProjectionEngine.lotes
+            tipo (TipoTransacao): se informado, ignora recorrências de outro tipo
+            categoria_ids (set): se informado, ignora recorrências de outras categorias
+        """
+        normalizadas = {}
+        for lote in lotes:
+            recorrencia = lote.recorrencia
+            if not lote:
+                continue
+            if tipo is not None and recorrencia.tipo != tipo:
+                continue
+            if categoria_ids is not None and recorrencia.categoria_id not in categoria_ids:
+                continue
+            for (ano, mes), indice, quantidade in lote.por_mes():
+                if (ano, mes) not in self._indices:
+                    continue
+                descricao = recorrencia.descricao_ocorrencia(indice).strip()
+                if descricao not in normalizadas:
+                    normalizadas[descricao] = (normalizar_descricao(descricao), limpar_descricao(descricao) or descricao)
+                normalizada, exibicao = normalizadas[descricao]
+                celula = self._celula(ano, mes, recorrencia.tipo, recorrencia.categoria_id, normalizada)
+                celula.projetado += recorrencia.valor * quantidade
+                celula.quantidade += quantidade
+                celula.exibicao_projecao = exibicao
+                celula.tem_projecao = True
+
+    def totais_mensais(self):
+        """{rotulo do mês: {'receita': valor, 'despesa': valor}}"""
+        totais = [{'receita': 0, 'despesa': 0} for _ in self.meses]
+        for celula in self.celulas.values():
+            if celula.tipo == TipoTransacao.RECEITA:
+                totais[celula.mes]['receita'] += celula.valor
+            elif celula.tipo == TipoTransacao.DESPESA:
+                totais[celula.mes]['despesa'] += celula.valor
+        return dict(zip(self.rotulos, totais))
+
+    def secoes_mensais(self):
+        """
+        Valores mensais das seções do relatório, separados em reais e projetados.
+
+        Returns:
+            (receitas reais, receitas projetadas, despesas reais, despesas projetadas),
+            cada um como {rotulo do mês: valor}
+        """
+        secoes = {tipo: ([0] * len(self.meses), [0] * len(self.meses))
+                  for tipo in (TipoTransacao.RECEITA, TipoTransacao.DESPESA)}
+        for celula in self.celulas.values():
+            secao = secoes.get(celula.tipo)
+            if secao is not None:
+                secao[0][celula.mes] += abs(float(celula.real or 0))
+                secao[1][celula.mes] += abs(float(celula.projetado or 0))
+        return tuple(dict(zip(self.rotulos, valores)) for secao in secoes.values() for valores in secao)
+
+    def totais(self):
+        """(total de receitas, total de despesas, quantidade de transações) do período"""
+        receitas = despesas = 0
+        quantidade = 0
+        for celula in self.celulas.values():
+            if celula.tipo == TipoTransacao.RECEITA:
+                receitas += celula.valor
+            elif celula.tipo == TipoTransacao.DESPESA:
+                despesas += celula.valor
+            quantidade += celula.quantidade
+        return receitas, despesas, quantidade
+
+    @staticmethod
+    def _ancestrais(categoria_id, pais):
+        """A própria categoria seguida de todos os seus ancestrais"""
+        vistos = []
+        while categoria_id is not None and categoria_id not in vistos:
+            vistos.append(categoria_id)
+            categoria_id = pais.get(categoria_id)
+        return vistos
+
+    def totais_por_categoria(self, pais):
+        """
+        Totais de cada categoria incluindo suas subcategorias.
+
+        Args:
+            pais (dict): categoria_id -> parent_id de todas as categorias do usuário
+
+        Returns:
+            {categoria_id: {TipoTransacao: valor}}
+        """
+        totais = {}
+        ancestrais = {}
+        for celula in self.celulas.values():
+            if celula.categoria_id not in ancestrais:
+                ancestrais[celula.categoria_id] = self._ancestrais(celula.categoria_id, pais)
+            for ancestral in ancestrais[celula.categoria_id]:
+                por_tipo = totais.setdefault(ancestral, {})
+                por_tipo[celula.tipo] = por_tipo.get(celula.tipo, 0) + celula.valor
+        return totais
+
+    def matriz(self, categoria_ids, pais):
+        """
+        Valor de cada categoria (com suas subcategorias) em cada mês, somando todos os tipos.
+
+        Returns:
+            {categoria_id: {rotulo do mês: valor}} para as categorias pedidas
+        """
+        valores = {categoria_id: [0] * len(self.meses) for categoria_id in categoria_ids}
+        ancestrais = {}
+        for celula in self.celulas.values():
+            if celula.categoria_id not in ancestrais:
+                ancestrais[celula.categoria_id] = [a for a in self._ancestrais(celula.categoria_id, pais) if a in valores]
+            for ancestral in ancestrais[celula.categoria_id]:
+                valores[ancestral][celula.mes] += celula.valor
+        return {categoria_id: {rotulo: (v if v > 0 else 0) for rotulo, v in zip(self.rotulos, linha)}
+                for categoria_id, linha in valores.items()}
+
+    def linhas(self, categorias_map):
+        """
+        Linhas da tabela detalhada: uma por (descrição sem parcela, categoria raiz,
+        subcategoria, tipo), com os valores por mês (receitas positivas, despesas
+        negativas) separados em reais e projetados.
+
+        Args:
+            categorias_map (dict): categoria_id -> Categoria de todas as categorias do usuário
+
+        Returns:
+            Lista de dicts ordenada pela descrição
+        """
+        nomes_categoria = {}
+        grupos = {}
+        for celula in self.celulas.values():
+            if celula.categoria_id not in nomes_categoria:
+                nomes_categoria[celula.categoria_id] = self._nomes_categoria(celula.categoria_id, categorias_map)
+            categoria_raiz_nome, subcategoria_nome = nomes_categoria[celula.categoria_id]
+
+            # incluir tipo na chave para evitar misturar receitas e despesas com a mesma descrição
+            tipo_nome = celula.tipo.value if celula.tipo is not None else ''
+            chave = (celula.descricao, categoria_raiz_nome, subcategoria_nome, tipo_nome)
+
+            grupo = grupos.get(chave)
+            if grupo is None:
+                grupo = grupos[chave] = {
+                    # descrição exibida: das projeções vem a versão limpa (sem texto de parcela)
+                    'descricao': celula.exibicao if celula.tem_real else celula.exibicao_projecao,
+                    'categoria_raiz': categoria_raiz_nome,
+                    'subcategoria': subcategoria_nome,
+                    'tipo': tipo_nome,
+                    'monthly': dict.fromkeys(self.rotulos, 0),
+                    'monthly_real': dict.fromkeys(self.rotulos, 0),
+                    'monthly_proj': dict.fromkeys(self.rotulos, 0),
+                    'total': 0,
+                    'is_projetada': False,
+                }
+
+            # valores com sinal consistente: receitas positivas, despesas negativas
+            sinal = 1 if celula.tipo == TipoTransacao.RECEITA else -1
+            real = sinal * abs(float(celula.real or 0))
+            projetado = sinal * abs(float(celula.projetado or 0))
+            rotulo = self.rotulos[celula.mes]
+            grupo['monthly'][rotulo] += real + projetado
+            grupo['monthly_real'][rotulo] += real
+            grupo['monthly_proj'][rotulo] += projetado
+            grupo['total'] += real + projetado
+            if celula.tem_projecao:
+                grupo['is_projetada'] = True
+            # se houver transação real, preferi-la como descrição exibida
+            if celula.tem_real and celula.exibicao:
+                grupo['descricao'] = celula.exibicao
+
+        return sorted(grupos.values(), key=lambda g: (g.get('descricao') or '').lower())
+
+    @staticmethod
+    def _nomes_categoria(categoria_id, categorias_map):
+        """(nome da categoria raiz, nome da subcategoria ou '') de uma categoria"""
+        categoria = categorias_map.get(categoria_id)
+        if categoria is None:
+            return '', ''
+        if not categoria.parent_id:
+            return categoria.nome, ''
+        raiz = categoria
+        while raiz is not None and raiz.parent_id:
+            raiz = categorias_map.get(raiz.parent_id)
+        return (raiz.nome if raiz is not None else ''), categoria.nome
@@ -1,11 +1,11 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from urllib.parse import urlparse as url_parse
-from models import db, Transacao, Categoria, TipoTransacao, TransacaoRecorrente, TipoRecorrencia, StatusRecorrencia, Conta, TipoConta, Tag, Usuario, Tema, FormaPagamento
+from models import db, Transacao, TransacaoProjetada, Categoria, TipoTransacao, TransacaoRecorrente, TipoRecorrencia, StatusRecorrencia, Conta, TipoConta, Tag, Usuario, Tema, FormaPagamento, ResumoMensal
 from forms import TransacaoForm, CategoriaForm, TransacaoRecorrenteForm, ContaForm, LoginForm, MFAForm, BackupCodeForm, SetupMFAForm, RegisterForm, ChangePasswordForm, ForgotPasswordForm, ResetPasswordForm, TemaForm, UserThemeForm, CompletarCadastroForm
 from config import Config
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 import logging
 from sqlalchemy import func, or_
@@ -15,8 +15,18 @@ import io
 import base64
 import os
 from utils import criar_categorias_padrao
+from projection_engine import ProjectionEngine
+from materializacao import FilaMaterializacao
+from rastreio_recorrencia import rastreio
+from agregacao_relatorio import AgregacaoRelatorio
+from resumo_mensal import ano_mes
+import resumo_dashboard
+from cache_relatorios import cache_relatorios, ao_confirmar_alteracoes
+from precalculo_relatorios import PrecalculoRelatorios
+from exportacao import exportar, formatos_disponiveis, linhas_transacoes, linhas_relatorio, cabecalho_relatorio, CABECALHO_TRANSACOES
 import json
 from pathlib import Path
+from types import SimpleNamespace
 
 # Cache for cidades list
 _CIDADES_CACHE = None
@@ -108,6 +118,26 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, faça login para acessar esta página.'
 login_manager.login_message_category = 'info'
 
+# Fila de materialização das transações recorrentes (gravação fora das requisições de leitura)
+materializacao = FilaMaterializacao(app)
+
+# Rastreio amostrado da geração de recorrências (ver /admin/rastreio-recorrencias)
+rastreio.init_app(app)
+
+# Relatórios calculados em cache por worker, invalidados pela versão dos dados do usuário
+cache_relatorios.init_app(app)
+
+
+def _precalcular_relatorios(usuario):
+    """Relatório padrão (ano atual, sem filtros) e totais do dashboard do usuário, guardados no cache"""
+    _dados_relatorio(usuario, *_filtros_relatorio({}))
+    _totais_dashboard(usuario)
+
+
+# Pré-cálculo em segundo plano desses dados após escritas (ver /admin/precalculo-relatorios)
+precalculo_relatorios = PrecalculoRelatorios(app, _precalcular_relatorios)
+ao_confirmar_alteracoes(precalculo_relatorios.agendar)
+
 # Disponibiliza now() nos templates (usar {{ now().year }})
 @app.context_processor
 def inject_now():
@@ -985,6 +1015,12 @@ def make_session_permanent():
     """Torna a sessão permanente para evitar perdas durante o fluxo de autenticação"""
     session.permanent = True
 
+@app.before_request
+def materializar_recorrencias_do_dia():
+    """Na primeira requisição do dia de cada usuário, agenda a gravação das ocorrências vencidas das recorrências dele"""
+    if request.endpoint != 'static' and current_user.is_authenticated:
+        materializacao.enfileirar_do_dia(current_user.id)
+
 @app.route('/')
 def landing():
     # redireciona usuário autenticado para o dashboard
@@ -992,50 +1028,38 @@ def landing():
         return redirect(url_for('dashboard'))
     return render_template('landing.html')
 
+def _totais_dashboard(usuario):
+    """Totais do dashboard do usuário, calculados a partir do resumo mensal (com cache)"""
+    chave_cache = _chave_relatorio(usuario, 'dashboard')
+    totais = cache_relatorios.obter(chave_cache)
+    if totais is not None:
+        return totais
+
+    # Todos os totais em uma única consulta (ver resumo_dashboard)
+    totais = resumo_dashboard.totais(db.session, ResumoMensal, usuario.id, ano_mes(datetime.now()))
+    return cache_relatorios.guardar(chave_cache, dict(
+        receitas_total=totais['receitas_total'],
+        despesas_total=totais['despesas_total'],
+        saldo=totais['receitas_total'] - totais['despesas_total'],
+        # Dados do mês atual (e lançamentos futuros)
+        receitas_mes=totais['receitas_desde_mes'],
+        despesas_mes=totais['despesas_desde_mes'],
+    ))
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard principal com resumo financeiro"""
     try:
-        # Calculando totais - filtrar por usuário
-        receitas_total = db.session.query(func.sum(Transacao.valor)).filter(
-            Transacao.tipo == TipoTransacao.RECEITA,
-            Transacao.user_id == current_user.id
-        ).scalar() or 0
-        
-        despesas_total = db.session.query(func.sum(Transacao.valor)).filter(
-            Transacao.tipo == TipoTransacao.DESPESA,
-            Transacao.user_id == current_user.id
-        ).scalar() or 0
-        
-        saldo = receitas_total - despesas_total
-        
         # Últimas transações - filtrar por usuário
         transacoes_recentes = Transacao.query.filter_by(user_id=current_user.id).order_by(
             Transacao.data_transacao.desc()
         ).limit(5).all()
         
-        # Dados do mês atual - filtrar por usuário
-        inicio_mes = datetime.now().replace(day=1)
-        receitas_mes = db.session.query(func.sum(Transacao.valor)).filter(
-            Transacao.tipo == TipoTransacao.RECEITA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.user_id == current_user.id
-        ).scalar() or 0
-        
-        despesas_mes = db.session.query(func.sum(Transacao.valor)).filter(
-            Transacao.tipo == TipoTransacao.DESPESA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.user_id == current_user.id
-        ).scalar() or 0
-        
         return render_template('dashboard.html',
-                             receitas_total=receitas_total,
-                             despesas_total=despesas_total,
-                             saldo=saldo,
-                             receitas_mes=receitas_mes,
-                             despesas_mes=despesas_mes,
-                             transacoes_recentes=transacoes_recentes)
+                             transacoes_recentes=transacoes_recentes,
+                             **_totais_dashboard(current_user))
     except (ProgrammingError, OperationalError) as e:
         # DB schema mismatch (e.g. missing coluna forma_pagamento) - show degraded dashboard
         app.logger.exception('DB SCHEMA ERROR in dashboard: %s', e)
@@ -1103,8 +1127,7 @@ def transacoes():
         ultimo_dia = date(ano_atual, mes_atual + 1, 1) - relativedelta(days=1)
 
     # Aplicar filtro de período do mês visualizado
-    query = query.filter(Transacao.data_transacao >= datetime.combine(primeiro_dia, datetime.min.time()))
-    query = query.filter(Transacao.data_transacao <= datetime.combine(ultimo_dia, datetime.max.time()))
+    query = query.filter(Transacao.ano_mes == ano_atual * 100 + mes_atual)
     
     # Paginação
     query_final = query.order_by(Transacao.data_transacao.desc())
@@ -1125,35 +1148,17 @@ def transacoes():
     if mostrar_projecoes and data_visualizada_obj >= hoje.replace(day=1):
         app.logger.debug('Gerando projecoes para mes futuro: %s/%s', mes_atual, ano_atual)
         
-        # Obter projeções para este mês específico
-        primeiro_dia_mes = datetime(ano_atual, mes_atual, 1)
-        if mes_atual == 12:
-            ultimo_dia_mes = datetime(ano_atual + 1, 1, 1) - timedelta(days=1)
-        else:
-            ultimo_dia_mes = datetime(ano_atual, mes_atual + 1, 1) - timedelta(days=1)
-        
-        # Obter recorrências ativas
-        recorrentes_ativas = TransacaoRecorrente.query.filter_by(
-            status=StatusRecorrencia.ATIVA, 
-            user_id=current_user.id
-        ).all()
+        # Obter projeções apenas para o mês visualizado
+        primeiro_dia_mes = datetime.combine(primeiro_dia, datetime.min.time())
+        ultimo_dia_mes = datetime.combine(ultimo_dia, datetime.max.time())
         
-        # ID temporário para projeções (negativo para evitar conflitos)
-        next_temp_id = -1
+        # Projetar todas as recorrências ativas de uma vez, somente no mês visualizado
+        engine = ProjectionEngine.carregar(current_user.id)
+        app.logger.debug('Total de recorrencias ativas: %s', len(engine))
 
-        app.logger.debug('Total de recorrencias ativas: %s', len(recorrentes_ativas))
-
-        # usar configuração centralizada para horizonte de projeções
-        meses_padrao_projecoes = app.config.get('MESES_FUTUROS_DEFAULT', 36)
-        for recorrente in recorrentes_ativas:
-            app.logger.debug('Processando recorrencia: %s - %s', recorrente.id, recorrente.descricao)
-            # Gerar transações projetadas usando o método atualizado (apenas projeções)
-            transacoes_projetadas = recorrente.gerar_transacoes_pendentes(meses_futuros=meses_padrao_projecoes, apenas_projetar=True)
-            # Filtrar apenas as transações deste mês
-            for projecao in transacoes_projetadas:
-                if primeiro_dia_mes <= projecao.data_transacao <= ultimo_dia_mes:
-                    projecoes.append(projecao)
-                    app.logger.debug('Projecao adicionada: %s para %s', projecao.descricao, projecao.data_transacao)
+        for projecao in engine.projetar(primeiro_dia_mes, ultimo_dia_mes):
+            projecoes.append(projecao)
+            app.logger.debug('Projecao adicionada: %s para %s', projecao.descricao, projecao.data_transacao)
     
     # Paginar transações do banco de dados
     transacoes_pagination = query_final.paginate(
@@ -1188,120 +1193,8 @@ def transacoes():
     else:
         app.logger.debug('Nenhuma projecao gerada')
     
-    # Verificar se estamos próximos ao fim das transações recorrentes e gerar mais se necessário
-    # CRÍTICO: Esta é a parte que garante a geração contínua de transações
-    
-    app.logger.debug('INICIANDO VERIFICACAO DE TRANSACOES RECORRENTES; mes visualizado=%s/%s (%s)', mes_atual, ano_atual, mes_nome)
-    
-    # Definir data limite com base no mês visualizado
-    # SEMPRE considerar o mês visualizado como referência, não filtros
-    # Usar o mês visualizado como referência para decisões de geração
-    data_visualizada = datetime.combine(primeiro_dia, datetime.min.time())
-    app.logger.debug('Usando mes visualizado como referencia: %s', data_visualizada)
-    
-    # Calcular quantos meses no futuro estamos visualizando
-    hoje = datetime.utcnow()
-    diferenca_meses = ((data_visualizada.year - hoje.year) * 12 + data_visualizada.month - hoje.month)
-    app.logger.debug('Diferenca em meses entre hoje e mes visualizado: %s', diferenca_meses)
-    
-    # Definir horizonte de geração baseado na navegação
-    # SEMPRE gerar pelo menos X meses além do mês visualizado
-    meses_alem_visualizacao = 24  # Buffer de visualização futura aumentado para 24
-    
-    # Calcular quantos meses no total gerar a partir de hoje
-    if diferenca_meses <= 0:
-        # Para meses atuais ou passados, gerar pelo menos o padrão configurado à frente
-        meses_para_gerar = app.config.get('MESES_FUTUROS_DEFAULT', 36)
-    else:
-        # Para meses futuros, gerar até a data visualizada + buffer
-        meses_para_gerar = diferenca_meses + meses_alem_visualizacao
-    
-    app.logger.debug('Meses para gerar a partir de hoje: %s', meses_para_gerar)
-    
-    # Data limite para geração de transações
-    data_limite = hoje + relativedelta(months=meses_para_gerar)
-    app.logger.debug('Data limite para geracao: %s', data_limite)
-    
-    # Buscar todas as transações recorrentes ATIVAS do usuário
-    app.logger.debug('Buscando recorrencias ativas')
-    
-    # IMPORTANTE: Verifique se estamos usando o valor correto para o status ativo
-    app.logger.debug('Valor do status ativo na enumeracao: %s', StatusRecorrencia.ATIVA.value)
-    
-    # Buscar por todas as recorrências do usuário para diagnóstico
-    todas_recorrencias = TransacaoRecorrente.query.filter_by(
-        user_id=current_user.id
-    ).all()
-    
-    app.logger.debug('Encontradas %s recorrencias para o usuario (de qualquer status)', len(todas_recorrencias))
-    for r in todas_recorrencias:
-        app.logger.debug('  - ID: %s, Descricao: %s, Status: %s, Tipo: %s', r.id, r.descricao, r.status.value, r.tipo_recorrencia.value)
-    
-    # Buscar corretamente por status (usando a enumeração diretamente, não o valor)
-    recorrentes_ativas = TransacaoRecorrente.query.filter_by(
-        user_id=current_user.id, 
-        status=StatusRecorrencia.ATIVA
-    ).all()
-    
-    app.logger.debug('Recorrencias ATIVAS encontradas: %s de %s total', len(recorrentes_ativas), len(todas_recorrencias))
-    
-    # Se não encontrou nenhuma, tente buscar todas as recorrências do usuário para diagnóstico
-    if not recorrentes_ativas:
-        app.logger.debug('Nenhuma recorrencia com status ATIVA encontrada usando a enumeracao.')
-    else:
-        app.logger.debug('Encontradas %s recorrencias ativas:', len(recorrentes_ativas))
-        for r in recorrentes_ativas:
-            app.logger.debug('  - ID: %s, Descricao: %s, Tipo: %s, Status: %s', r.id, r.descricao, r.tipo_recorrencia.value, r.status.value)
-    
-    if not recorrentes_ativas:
-        app.logger.debug('Nenhuma recorrencia ativa encontrada para o usuario %s. Nao ha transacoes para gerar.', current_user.id)
-    else:
-        app.logger.debug('Processando %s recorrencias ativas encontradas', len(recorrentes_ativas))
-    
-    # Para cada recorrente ativa, SEMPRE verificar e gerar transações
-    transacoes_recorrentes_geradas = 0
-    recorrentes_atualizadas = []
-    
-    for recorrente in recorrentes_ativas:
-        try:
-            app.logger.debug('\nProcessando recorrencia %s: %s', recorrente.id, recorrente.descricao)
-            app.logger.debug('Gerando transacoes para %s meses', meses_para_gerar)
-
-            # Chamar diretamente o método de geração com o horizonte calculado
-            novas_transacoes = recorrente.gerar_transacoes_pendentes(meses_futuros=meses_para_gerar)
-
-            transacoes_recorrentes_geradas += len(novas_transacoes)
-            if len(novas_transacoes) > 0:
-                recorrentes_atualizadas.append(recorrente.id)
-                app.logger.debug('Geradas %s novas transacoes', len(novas_transacoes))
-            else:
-                app.logger.debug('Nenhuma nova transacao gerada')
-                
-        except Exception as e:
-            app.logger.error('ERRO ao gerar transacoes para recorrencia %s: %s', recorrente.id, str(e))
-            import traceback
-            traceback.print_exc()  # Exibir stack trace completo
-    
-    # Se foram geradas novas transações, refazer a consulta e a paginação
-    if transacoes_recorrentes_geradas > 0:
-        # Reconstruir a consulta completa — apenas pelo mês visualizado para manter comportamento
-        query = Transacao.query.filter_by(user_id=current_user.id)
-        query = query.filter(Transacao.data_transacao >= datetime.combine(primeiro_dia, datetime.min.time()))
-        query = query.filter(Transacao.data_transacao <= datetime.combine(ultimo_dia, datetime.max.time()))
-
-        # Refazer a paginação
-        transacoes_pagination = query.order_by(Transacao.data_transacao.desc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
-        
-        # Preparar mensagem para o usuário
-        recorrentes_texto = ", ".join([f"#{id}" for id in recorrentes_atualizadas[:3]])
-        if len(recorrentes_atualizadas) > 3:
-            recorrentes_texto += f" e mais {len(recorrentes_atualizadas) - 3}"
-        
-        # flash(f'Foram geradas automaticamente {transacoes_recorrentes_geradas} transações recorrentes ({recorrentes_texto}) para visualização futura.', 'info')
+    # A listagem é somente leitura: as ocorrências ainda não materializadas aparecem
+    # como projeções acima, e a gravação fica a cargo da fila de materialização
     
     # Opções de itens por página (mantidas)
     per_page_options = [10, 20, 50, 100]
@@ -1345,22 +1238,8 @@ def exibir_confirmacao_transacao(recorrencia_id, data_transacao):
         flash('Esta transação já foi confirmada anteriormente', 'warning')
         return redirect(url_for('transacoes'))
     
-    # Criar transação projetada (não salva no banco)
-    transacao = Transacao(
-        id=-1,  # ID temporário
-        descricao=recorrencia.descricao,
-        valor=recorrencia.valor,
-        tipo=recorrencia.tipo,
-        data_transacao=data,
-        categoria_id=recorrencia.categoria_id,
-        conta_id=recorrencia.conta_id,
-        recorrencia_id=recorrencia_id,
-        user_id=current_user.id
-    )
-    
-    # Carregar categoria e conta para exibição
-    transacao.categoria = recorrencia.categoria
-    transacao.conta = recorrencia.conta
+    # Criar transação projetada (não salva no banco nem ligada à sessão)
+    transacao = TransacaoProjetada(recorrencia, recorrencia.indice_de(data), data)
     
     # Salvar URL de redirecionamento para retornar após a confirmação
     redirect_url = request.args.get('redirect_url', url_for('transacoes'))
@@ -1397,51 +1276,15 @@ def confirmar_transacao():
         flash('Data inválida', 'danger')
         return redirect(redirect_url)
     
-    # Verificar se já existe uma transação para esta data
-    transacao_existente = Transacao.query.filter_by(
-        recorrencia_id=recorrencia_id,
-        data_transacao=data
-    ).first()
-    
-    if transacao_existente:
-        flash('Esta transação já foi confirmada anteriormente', 'warning')
-        return redirect(redirect_url)
-    
-    # Calcular número da parcela igual à lógica da projeção
-    descricao_final = recorrencia.descricao
-    if recorrencia.is_parcelada:
-        # Conta quantas transações (reais) já existem para esta recorrência antes desta data
-        total_existentes = len([
-            t for t in recorrencia.transacoes
-            if t.recorrencia_id == recorrencia_id and t.data_transacao < data
-        ])
-        numero_parcela = total_existentes + 1
-        descricao_final += f" - Parcela {numero_parcela}/{recorrencia.total_parcelas}"
-    nova_transacao = Transacao(
-        descricao=descricao_final,
-        valor=recorrencia.valor,
-        tipo=recorrencia.tipo,
-    forma_pagamento_id=recorrencia.forma_pagamento_id,
-        data_transacao=data,
-        categoria_id=recorrencia.categoria_id,
-        conta_id=recorrencia.conta_id,
-        recorrencia_id=recorrencia_id,
-        user_id=current_user.id
-    )
-    
-    # Salvar no banco de dados
+    # Salvar no banco de dados; o índice único (recorrencia_id, data_transacao)
+    # descarta a ocorrência se ela já tiver sido confirmada
     try:
-        db.session.add(nova_transacao)
-        
-        # Atualizar contador de parcelas geradas para recorrências parceladas
-        if recorrencia.is_parcelada:
-            recorrencia.parcelas_geradas += 1
-            # Verificar se atingiu o total de parcelas
-            if recorrencia.parcelas_geradas >= recorrencia.total_parcelas:
-                recorrencia.status = StatusRecorrencia.FINALIZADA
-        
+        inseridas = recorrencia.materializar([(recorrencia.indice_de(data), data)])
         db.session.commit()
-        flash('Transação confirmada com sucesso!', 'success')
+        if inseridas:
+            flash('Transação confirmada com sucesso!', 'success')
+        else:
+            flash('Esta transação já foi confirmada anteriormente', 'warning')
     except Exception as e:
         db.session.rollback()
         flash(f'Erro ao confirmar transação: {str(e)}', 'danger')
@@ -1463,11 +1306,11 @@ def api_consolidar_projecoes():
     if not projecoes_ids:
         return jsonify({'success': False, 'message': 'Nenhuma projeção selecionada'})
     
-    # Contador de transações processadas com sucesso
-    transacoes_confirmadas = 0
     erros = []
+    ocorrencias = []
+    recorrencias = {}
     
-    # Processar cada projeção
+    # Validar cada projeção e montar o lote de ocorrências a gravar
     for projecao_id in projecoes_ids:
         try:
             # Obter os dados da projeção
@@ -1479,11 +1322,14 @@ def api_consolidar_projecoes():
                 erros.append(f"Dados incompletos para projeção {projecao_id}")
                 continue
             
-            # Buscar a recorrência
-            recorrencia = TransacaoRecorrente.query.filter_by(
-                id=recorrencia_id, 
-                user_id=current_user.id
-            ).first()
+            # Buscar a recorrência (uma vez por recorrência)
+            recorrencia_id = int(recorrencia_id)
+            if recorrencia_id not in recorrencias:
+                recorrencias[recorrencia_id] = TransacaoRecorrente.query.filter_by(
+                    id=recorrencia_id, 
+                    user_id=current_user.id
+                ).first()
+            recorrencia = recorrencias[recorrencia_id]
             
             if not recorrencia:
                 erros.append(f"Recorrência {recorrencia_id} não encontrada")
@@ -1496,48 +1342,16 @@ def api_consolidar_projecoes():
                 erros.append(f"Data inválida: {data_transacao}")
                 continue
             
-            # Verificar se já existe uma transação para esta data
-            transacao_existente = Transacao.query.filter_by(
-                recorrencia_id=recorrencia_id,
-                data_transacao=data
-            ).first()
-            
-            if transacao_existente:
-                erros.append(f"Transação para {data_transacao} já existe")
-                continue
-            
-            # Criar nova transação real
-            nova_transacao = Transacao(
-                descricao=recorrencia.descricao,
-                valor=recorrencia.valor,
-                tipo=recorrencia.tipo,
-                forma_pagamento_id=recorrencia.forma_pagamento_id,
-                data_transacao=data,
-                categoria_id=recorrencia.categoria_id,
-                conta_id=recorrencia.conta_id,
-                recorrencia_id=recorrencia_id,
-                user_id=current_user.id
-            )
-            
-            # Salvar no banco de dados
-            db.session.add(nova_transacao)
-            
-            # Atualizar contador de parcelas geradas para recorrências parceladas
-            if recorrencia.is_parcelada:
-                recorrencia.parcelas_geradas += 1
-                # Verificar se atingiu o total de parcelas
-                if recorrencia.parcelas_geradas >= recorrencia.total_parcelas:
-                    recorrencia.status = StatusRecorrencia.FINALIZADA
-            
-            # Incrementar contador de sucesso
-            transacoes_confirmadas += 1
+            ocorrencias.append((recorrencia, recorrencia.indice_de(data), data))
             
         except Exception as e:
             erros.append(f"Erro ao processar projeção {projecao_id}: {str(e)}")
     
-    # Commit das alterações se houver transações confirmadas
-    if transacoes_confirmadas > 0:
+    # Gravar todas as ocorrências em uma única instrução; as que já existem são ignoradas
+    transacoes_confirmadas = 0
+    if ocorrencias:
         try:
+            inseridas = TransacaoRecorrente.materializar_em_lote(ocorrencias)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -1545,6 +1359,11 @@ def api_consolidar_projecoes():
                 'success': False, 
                 'message': f'Erro ao salvar as transações: {str(e)}'
             })
+        transacoes_confirmadas = len(inseridas)
+        gravadas = {(linha.recorrencia_id, linha.data_transacao) for linha in inseridas}
+        for recorrencia, _, data in ocorrencias:
+            if (recorrencia.id, data) not in gravadas:
+                erros.append(f"Transação para {data.strftime('%Y-%m-%d')} já existe")
     
     # Construir mensagem de resposta
     if transacoes_confirmadas == 0:
@@ -1710,7 +1529,11 @@ def editar_transacao(transacao_id):
             transacao.forma_pagamento_id = int(form.forma_pagamento.data) if form.forma_pagamento.data else None
             transacao.categoria_id = form.categoria_id.data
             transacao.conta_id = form.conta_id.data
+            data_anterior = transacao.data_transacao
             transacao.data_transacao = form.data_transacao.data
+            if transacao.recorrencia and transacao.data_transacao != data_anterior:
+                # A data movida pode ser (ou passar a ser) a última ocorrência gravada
+                transacao.recorrencia.recalcular_marca()
             
             # Atualizar tags
             transacao.set_tags_from_string(form.tags.data or '')
@@ -1740,7 +1563,11 @@ def excluir_transacao(transacao_id):
     # e continuará gerando futuras transações.
         
         descricao = transacao.descricao
+        recorrencia = transacao.recorrencia
         db.session.delete(transacao)
+        if recorrencia is not None:
+            # Manter marca d'água e contador de parcelas da recorrência consistentes
+            recorrencia.remover_transacao(transacao)
         db.session.commit()
         
         return jsonify({
@@ -1805,7 +1632,6 @@ def nova_categoria():
 def relatorios():
     """Página de relatórios com filtros funcionais"""
     from datetime import datetime
-    from sqlalchemy import extract, and_, or_
     
     # Valores padrão dos filtros
     ano_atual = datetime.now().year
@@ -1839,15 +1665,26 @@ def relatorios():
             params['data_fim'] = data_fim_str
 
         return redirect(url_for('relatorios', **params))
-    else:
-        ano = request.args.get('ano', ano_atual)
-        tipo = request.args.get('tipo', 'todos')
-        categoria_id = request.args.get('categoria')
-        conta_id = request.args.get('conta')
-        # Filtro por intervalo de datas (opcional)
-        data_inicio_str = request.args.get('data_inicio')
-        data_fim_str = request.args.get('data_fim')
-    
+
+    return render_template('relatorios.html', **_dados_relatorio(current_user, *_filtros_relatorio(request.args)))
+
+
+def _filtros_relatorio(valores):
+    """
+    Filtros do relatório lidos dos parâmetros da URL.
+
+    Returns:
+        (ano, tipo, categoria, conta, data de início, data de fim)
+    """
+    ano_atual = datetime.now().year
+    ano = valores.get('ano', ano_atual)
+    tipo = valores.get('tipo', 'todos')
+    categoria_id = valores.get('categoria') or None
+    conta_id = valores.get('conta') or None
+    # Filtro por intervalo de datas (opcional)
+    data_inicio_str = valores.get('data_inicio')
+    data_fim_str = valores.get('data_fim')
+
     try:
         ano = int(ano)
     except (ValueError, TypeError):
@@ -1864,52 +1701,55 @@ def relatorios():
     except Exception:
         start_dt = None
         end_dt = None
-    
-    # Obter anos disponíveis - FILTRAR POR USUÁRIO
-    # Anos disponíveis: incluir anos futuros até 5 anos à frente
-    anos_transacoes = db.session.query(
-        extract('year', Transacao.data_transacao).label('ano')
-    ).filter(
-        Transacao.user_id == current_user.id
-    ).distinct().order_by('ano').all()
-    anos_disponiveis = [int(a[0]) for a in anos_transacoes]
-    ano_max = max(anos_disponiveis) if anos_disponiveis else ano_atual
-    ano_limite = max(ano_max, ano_atual) + 5
-    anos_futuros = [a for a in range(ano_atual, ano_limite+1)]
-    # Unir anos do banco e futuros, sem duplicar
-    anos_disponiveis = sorted(set(anos_disponiveis + anos_futuros))
-    
-    # Todas as categorias para o filtro - FILTRAR POR USUÁRIO
-    todas_categorias = Categoria.query.filter_by(user_id=current_user.id).all()  # ← ADICIONAR FILTRO
-    
-    # Todas as contas para o filtro - FILTRAR POR USUÁRIO
-    todas_contas = Conta.query.filter_by(
-        ativa=True, 
-        user_id=current_user.id  # ← ADICIONAR FILTRO
-    ).order_by(Conta.nome).all()
-    
+    return ano, tipo, categoria_id, conta_id, start_dt, end_dt
+
+
+def _chave_relatorio(usuario, *filtros):
+    """
+    Chave do cache de relatórios: usuário, versão dos seus dados e filtros (ver
+    cache_relatorios). A data entra na chave porque as projeções dependem do dia.
+    """
+    return (usuario.id, usuario.dados_versao or 0, datetime.now().date()) + filtros
+
+
+def _nome_completo_categoria(categorias_map, categoria_id):
+    """Nome da categoria com os ancestrais (ex: 'Casa > Luz'), sem consultar o banco"""
+    categoria = categorias_map[categoria_id]
+    if categoria.parent_id in categorias_map:
+        return f"{_nome_completo_categoria(categorias_map, categoria.parent_id)} > {categoria.nome}"
+    return categoria.nome
+
+
+def _transacoes_relatorio(usuario, ano, tipo, categoria_id, conta_id, start_dt, end_dt):
+    """
+    Query das transações reais do usuário com os filtros do relatório.
+
+    Returns:
+        (query, categoria e conta validadas, ids da categoria filtrada e subcategorias,
+         início e fim do período)
+    """
     # Construir query base - FILTRAR POR USUÁRIO
     query = db.session.query(Transacao).filter(
-        Transacao.user_id == current_user.id
+        Transacao.user_id == usuario.id
     )
     
-    # ...resto do código permanece igual...
     if tipo != 'todos':
         query = query.filter(Transacao.tipo == TipoTransacao(tipo))
     
     # Aplicar filtro de categoria
+    filtro_categoria_ids = None
     if categoria_id:
         try:
             categoria_id = int(categoria_id)
             categoria_selecionada = Categoria.query.filter_by(
                 id=categoria_id,
-                user_id=current_user.id  # ← VERIFICAR PROPRIEDADE
+                user_id=usuario.id  # ← VERIFICAR PROPRIEDADE
             ).first()
             if categoria_selecionada:
                 # Incluir categoria e todas suas subcategorias
                 subcategorias = categoria_selecionada.get_all_subcategorias(include_self=True)
-                categoria_ids = [cat.id for cat in subcategorias]
-                query = query.filter(Transacao.categoria_id.in_(categoria_ids))
+                filtro_categoria_ids = set(cat.id for cat in subcategorias)
+                query = query.filter(Transacao.categoria_id.in_(filtro_categoria_ids))
         except (ValueError, TypeError):
             categoria_id = None
     
@@ -1920,7 +1760,7 @@ def relatorios():
             # Verificar se a conta pertence ao usuário
             conta_do_usuario = Conta.query.filter_by(
                 id=conta_id,
-                user_id=current_user.id
+                user_id=usuario.id
             ).first()
             if conta_do_usuario:
                 query = query.filter(Transacao.conta_id == conta_id)
@@ -1937,201 +1777,90 @@ def relatorios():
         periodo_inicio = start_dt
         periodo_fim = end_dt
     else:
-        # usar ano selecionado
+        # usar ano selecionado (pela coluna ano_mes, coberta pelo índice (user_id, ano_mes))
         periodo_inicio = datetime(ano, 1, 1)
         periodo_fim = datetime(ano, 12, 31, 23, 59, 59)
-        query = query.filter(Transacao.data_transacao >= periodo_inicio, Transacao.data_transacao <= periodo_fim)
+        query = query.filter(Transacao.ano_mes.between(ano * 100 + 1, ano * 100 + 12))
+    return query, categoria_id, conta_id, filtro_categoria_ids, periodo_inicio, periodo_fim
 
-    transacoes = query.all()
 
-    # Gerar projeções futuras para recorrências ativas do usuário
-    from models import TransacaoRecorrente
-    recorrentes_ativas = TransacaoRecorrente.query.filter_by(user_id=current_user.id, status=StatusRecorrencia.ATIVA).all()
-    transacoes_projetadas = []
-    # Calcular quantos meses projetar: até o fim do período filtrado
-    agora = datetime.utcnow()
-    try:
-        fim_periodo = periodo_fim
-    except NameError:
-        fim_periodo = datetime(ano, 12, 31, 23, 59, 59)
-
-    # meses entre agora (mes atual) e fim_periodo (incluir meses)
-    meses_futuros_relatorio = 0
-    if fim_periodo > agora:
-        meses_futuros_relatorio = (fim_periodo.year - agora.year) * 12 + (fim_periodo.month - agora.month)
-
-    for recorrente in recorrentes_ativas:
-        # Só gera se não tiver data_fim ou se data_fim for no futuro
-        if not recorrente.data_fim or recorrente.data_fim > agora:
-            # Gerar apenas o número de meses necessário para cobrir o ano filtrado
-            projecoes = recorrente.gerar_transacoes_pendentes(meses_futuros=meses_futuros_relatorio, apenas_projetar=True)
-            # Se houver filtro por conta, filtrar também as projeções para a mesma conta
-            if conta_id:
-                try:
-                    conta_filter_val = int(conta_id)
-                except Exception:
-                    conta_filter_val = None
-            else:
-                conta_filter_val = None
-
-            filtered_projecoes = []
-            for p in projecoes:
-                # p pode ter atributo conta_id; respeitar o filtro quando presente
-                if conta_filter_val is not None:
-                    if getattr(p, 'conta_id', None) != conta_filter_val:
-                        continue
-                # Não adicionar o objeto Transacao transient ao contexto do SQLAlchemy
-                # para evitar SAWarning. Em vez disso, criar um objeto simples com os
-                # atributos necessários para os cálculos e renderização.
-                from types import SimpleNamespace
-                proj_obj = SimpleNamespace(
-                    descricao=getattr(p, 'descricao', None),
-                    valor=getattr(p, 'valor', 0),
-                    tipo=getattr(p, 'tipo', None),
-                    data_transacao=getattr(p, 'data_transacao', None),
-                    categoria_id=getattr(p, 'categoria_id', None),
-                    conta_id=getattr(p, 'conta_id', None),
-                    recorrencia_id=getattr(p, 'recorrencia_id', None),
-                    is_projetada=True
-                )
-                # garantir que tipo seja Enum TipoTransacao quando possível
-                try:
-                    if isinstance(proj_obj.tipo, str):
-                        proj_obj.tipo = TipoTransacao(proj_obj.tipo)
-                except Exception:
-                    pass
-                filtered_projecoes.append(proj_obj)
-
-            transacoes_projetadas.extend(filtered_projecoes)
-
-    # Unir transações reais e projetadas, evitando duplicidade
-    # Para recorrentes: priorizar real sobre projetada por (ano, mês, recorrencia_id)
-    # Para não recorrentes: deduplicar por (ano, mês, categoria_id, tipo)
-    transacoes_unicas = {}
-    app.logger.debug('RELATORIO: TRANSACOES REAIS: %s itens', len(transacoes))
-    for t in transacoes:
-        if t.recorrencia_id:
-            chave = (t.data_transacao.year, t.data_transacao.month, t.recorrencia_id)
-        else:
-            chave = (t.data_transacao.year, t.data_transacao.month, t.categoria_id, t.tipo)
-        app.logger.debug('REAL: chave=%s valor=%s id=%s recorrencia_id=%s data=%s', chave, t.valor, getattr(t, 'id', None), t.recorrencia_id, t.data_transacao)
-        transacoes_unicas[chave] = t
-    app.logger.debug('RELATORIO: TRANSACOES PROJETADAS: %s itens', len(transacoes_projetadas))
-    for p in transacoes_projetadas:
-        if p.recorrencia_id:
-            chave = (p.data_transacao.year, p.data_transacao.month, p.recorrencia_id)
-        else:
-            chave = (p.data_transacao.year, p.data_transacao.month, p.categoria_id, p.tipo)
-        app.logger.debug('PROJETADA: chave=%s valor=%s recorrencia_id=%s data=%s', chave, p.valor, p.recorrencia_id, p.data_transacao)
-        if chave not in transacoes_unicas:
-            transacoes_unicas[chave] = p
-    app.logger.debug('RELATORIO: TOTAL TRANSACOES UNICAS: %s', len(transacoes_unicas))
-    transacoes = list(transacoes_unicas.values())
-    # Filtrar apenas transações do ano selecionado (evita somar projeções de outros anos)
-    try:
-        ano = int(ano)
-    except Exception:
-        ano = datetime.now().year
-
-    # Filtrar transações para o intervalo selecionado (periodo_inicio..periodo_fim)
-    # Antes era filtrado apenas pelo ano, o que incluía meses fora do intervalo quando
-    # o usuário aplicava um filtro de data mais específico.
-    transacoes = [t for t in transacoes if t.data_transacao >= periodo_inicio and t.data_transacao <= periodo_fim]
-    
-    # Gerar lista de meses baseada no período (rótulos em PT)
-    meses_pt = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-    meses = []
-    month_starts = []
-    cur = periodo_inicio.replace(day=1)
-    while cur <= periodo_fim:
-        month_starts.append(cur)
-        meses.append(f"{meses_pt[cur.month-1]} {cur.year}")
-        # avançar um mês
-        if cur.month == 12:
-            cur = cur.replace(year=cur.year+1, month=1)
-        else:
-            cur = cur.replace(month=cur.month+1)
-    
-    # Calcular totais mensais sem duplicidade por recorrencia/categoria/tipo
-    totais_mensais = {}
-    for idx, month_start in enumerate(month_starts):
-        # Agrupar por (categoria_id, tipo, recorrencia_id) para evitar duplicidade
-        vistos = set()
-        receita = 0
-        despesa = 0
-        for t in transacoes:
-            if t.data_transacao.year != month_start.year or t.data_transacao.month != month_start.month:
-                continue
-            if t.recorrencia_id:
-                chave = (t.data_transacao.year, t.data_transacao.month, t.recorrencia_id)
-            else:
-                chave = (t.data_transacao.year, t.data_transacao.month, t.categoria_id, t.tipo)
-            if chave in vistos:
-                continue
-            vistos.add(chave)
-            if t.tipo == TipoTransacao.RECEITA:
-                receita += t.valor
-            elif t.tipo == TipoTransacao.DESPESA:
-                despesa += t.valor
-        totais_mensais[meses[idx]] = {'receita': receita, 'despesa': despesa}
+def _dados_relatorio(usuario, ano, tipo, categoria_id, conta_id, start_dt, end_dt):
+    """Dados do relatório do usuário para os filtros, usados pela página, pela API e pelo pré-cálculo"""
+    ano_atual = datetime.now().year
+
+    # Relatório já calculado para estes filtros e esta versão dos dados do usuário
+    chave_cache = _chave_relatorio(usuario, ano, tipo, categoria_id, conta_id, start_dt, end_dt)
+    dados = cache_relatorios.obter(chave_cache)
+    if dados is not None:
+        return dados
+    
+    # Obter anos disponíveis - FILTRAR POR USUÁRIO
+    # Anos disponíveis: incluir anos futuros até 5 anos à frente
+    meses_com_transacoes = db.session.query(ResumoMensal.ano_mes).filter(
+        ResumoMensal.user_id == usuario.id
+    ).distinct().all()
+    anos_disponiveis = sorted({a[0] // 100 for a in meses_com_transacoes})
+    ano_max = max(anos_disponiveis) if anos_disponiveis else ano_atual
+    ano_limite = max(ano_max, ano_atual) + 5
+    anos_futuros = [a for a in range(ano_atual, ano_limite+1)]
+    # Unir anos do banco e futuros, sem duplicar
+    anos_disponiveis = sorted(set(anos_disponiveis + anos_futuros))
+    
+    # Todas as categorias para o filtro - FILTRAR POR USUÁRIO
+    todas_categorias = Categoria.query.filter_by(user_id=usuario.id).all()  # ← ADICIONAR FILTRO
+    
+    # Todas as contas para o filtro - FILTRAR POR USUÁRIO
+    todas_contas = Conta.query.filter_by(
+        ativa=True, 
+        user_id=usuario.id  # ← ADICIONAR FILTRO
+    ).order_by(Conta.nome).all()
+    
+    query, categoria_id, conta_id, filtro_categoria_ids, periodo_inicio, periodo_fim = _transacoes_relatorio(
+        usuario, ano, tipo, categoria_id, conta_id, start_dt, end_dt)
+
+    # Somar as transações reais no banco e as projeções das recorrências ativas por mês
+    # (ver agregacao_relatorio)
+    agregado = AgregacaoRelatorio(periodo_inicio, periodo_fim)
+    agregado.adicionar_reais(query)
+    # Se houver filtro por conta, projetar apenas as recorrências da mesma conta
+    engine = ProjectionEngine.carregar(usuario.id, conta_ids=[conta_id] if conta_id else None)
+    agregado.adicionar_projecoes(
+        engine.lotes(periodo_inicio, periodo_fim),
+        tipo=TipoTransacao(tipo) if tipo != 'todos' else None,
+        categoria_ids=filtro_categoria_ids
+    )
+    
+    meses = agregado.rotulos
+    totais_mensais = agregado.totais_mensais()
 
     # Calcular totais gerais
-    vistos = set()
-    total_receitas = 0
-    total_despesas = 0
-    for t in transacoes:
-        if t.recorrencia_id:
-            chave = (t.data_transacao.year, t.data_transacao.month, t.recorrencia_id)
-        else:
-            chave = (t.data_transacao.year, t.data_transacao.month, t.categoria_id, t.tipo)
-        if chave in vistos:
-            continue
-        vistos.add(chave)
-        if t.tipo == TipoTransacao.RECEITA:
-            total_receitas += t.valor
-        elif t.tipo == TipoTransacao.DESPESA:
-            total_despesas += t.valor
+    total_receitas, total_despesas, total_transacoes = agregado.totais()
     saldo_geral = total_receitas - total_despesas
-    total_transacoes = len(vistos)
     
-    # Organizar categorias por tipo (agregando por categorias primárias/raiz)
-    categorias_receitas = []
-    categorias_despesas = []
-
-    # Obter categorias raiz do usuário
-    categorias_raiz = Categoria.query.filter_by(parent_id=None, user_id=current_user.id).order_by(Categoria.nome).all()
-
-    # Se o usuário filtrou por uma categoria específica, obter seus ids (inclui subcategorias)
-    filtro_categoria_ids = None
-    if categoria_id:
-        categoria_selecionada = Categoria.query.get(categoria_id)
-        if categoria_selecionada:
-            subcategorias = categoria_selecionada.get_all_subcategorias(include_self=True)
-            filtro_categoria_ids = set(cat.id for cat in subcategorias)
-
-    # Map of root_id -> list of descendant ids (including self)
-    raiz_descendentes = {}
-
-    for raiz in categorias_raiz:
-        descendentes = raiz.get_all_subcategorias(include_self=True)
-        descendentes_ids = [c.id for c in descendentes]
-
-        # Se houve filtro por categoria, pular raízes que não contêm a categoria filtrada
-        if filtro_categoria_ids is not None and not (set(descendentes_ids) & filtro_categoria_ids):
-            continue
+    # Organizar categorias por tipo (agregando por categorias primárias/raiz), com os
+    # totais de cada categoria incluindo suas subcategorias
+    categorias_map = {c.id: c for c in todas_categorias}
+    pais = {c.id: c.parent_id for c in todas_categorias}
+    totais_categoria = agregado.totais_por_categoria(pais)
 
-        raiz_descendentes[raiz.id] = set(descendentes_ids)
+    # Cópias simples das categorias (sem sessão do banco), seguras para guardar no cache
+    def nome_completo(categoria_id):
+        return _nome_completo_categoria(categorias_map, categoria_id)
 
-        # Calcular totais a partir da lista de transações já filtrada (ano, conta, tipo, etc.)
-        total_receita = sum(t.valor for t in transacoes if t.categoria_id in raiz_descendentes[raiz.id] and t.tipo == TipoTransacao.RECEITA)
-        total_despesa = sum(t.valor for t in transacoes if t.categoria_id in raiz_descendentes[raiz.id] and t.tipo == TipoTransacao.DESPESA)
+    def resumo_categoria(categoria):
+        totais = totais_categoria.get(categoria.id, {})
+        return SimpleNamespace(id=categoria.id, nome=categoria.nome, nome_completo=nome_completo(categoria.id),
+                               total_receita=totais.get(TipoTransacao.RECEITA, 0),
+                               total_despesa=totais.get(TipoTransacao.DESPESA, 0))
 
-        if total_receita > 0:
-            raiz.total_receita = total_receita
+    categorias_ordenadas = sorted(todas_categorias, key=lambda c: c.nome)
+    categorias_receitas = []
+    categorias_despesas = []
+    for raiz in (c for c in categorias_ordenadas if c.parent_id is None):
+        raiz = resumo_categoria(raiz)
+        if raiz.total_receita > 0:
             categorias_receitas.append(raiz)
-
-        if total_despesa > 0:
-            raiz.total_despesa = total_despesa
+        if raiz.total_despesa > 0:
             categorias_despesas.append(raiz)
 
     # ----------------------
@@ -2139,187 +1868,20 @@ def relatorios():
     # ----------------------
     categorias_sub_receitas = []
     categorias_sub_despesas = []
-
-    categorias_sub = Categoria.query.filter(Categoria.user_id == current_user.id, Categoria.parent_id != None).order_by(Categoria.nome).all()
-    sub_descendentes = {}
-    for sub in categorias_sub:
-        descendentes = sub.get_all_subcategorias(include_self=True)
-        descendentes_ids = [c.id for c in descendentes]
-
-        # Respeitar filtro por categoria (se houver)
-        if filtro_categoria_ids is not None and not (set(descendentes_ids) & filtro_categoria_ids):
-            continue
-
-        sub_descendentes[sub.id] = set(descendentes_ids)
-
-        total_receita_sub = sum(t.valor for t in transacoes if t.categoria_id in sub_descendentes[sub.id] and t.tipo == TipoTransacao.RECEITA)
-        total_despesa_sub = sum(t.valor for t in transacoes if t.categoria_id in sub_descendentes[sub.id] and t.tipo == TipoTransacao.DESPESA)
-
-        if total_receita_sub > 0:
-            sub.total_receita = total_receita_sub
+    for sub in (c for c in categorias_ordenadas if c.parent_id is not None):
+        sub = resumo_categoria(sub)
+        if sub.total_receita > 0:
             categorias_sub_receitas.append(sub)
-
-        if total_despesa_sub > 0:
-            sub.total_despesa = total_despesa_sub
+        if sub.total_despesa > 0:
             categorias_sub_despesas.append(sub)
 
-    # Criar matriz de dados (categoria raiz x mês) sem duplicidade, usando os conjuntos de descendentes
-    matriz_dados = {}
+    # Criar matriz de dados (categoria raiz x mês)
     categorias_unicas = {c.id: c for c in (categorias_receitas + categorias_despesas)}
-    for categoria_id_key, categoria in categorias_unicas.items():
-        matriz_dados[categoria.id] = {}
-        descendentes_set = raiz_descendentes.get(categoria.id, {categoria.id})
-        for idx, month_start in enumerate(month_starts):
-            vistos = set()
-            valor_mes = 0
-            for t in transacoes:
-                if t.categoria_id not in descendentes_set or t.data_transacao.year != month_start.year or t.data_transacao.month != month_start.month:
-                    continue
-                if t.recorrencia_id:
-                    chave = (t.data_transacao.year, t.data_transacao.month, t.recorrencia_id)
-                else:
-                    chave = (t.data_transacao.year, t.data_transacao.month, t.categoria_id, t.tipo)
-                if chave in vistos:
-                    continue
-                vistos.add(chave)
-                valor_mes += t.valor
-            matriz_dados[categoria.id][meses[idx]] = valor_mes if valor_mes > 0 else 0
+    matriz_dados = agregado.matriz(categorias_unicas, pais)
     
-    # Debug: imprimir totais_mensais e matriz_dados para inspeção (logger)
-    try:
-        app.logger.debug('RELATORIO: TOTAIS_MENSAIS')
-        for m in meses:
-            app.logger.debug('%s: receita=%s, despesa=%s', m, totais_mensais[m]['receita'], totais_mensais[m]['despesa'])
-        app.logger.debug('RELATORIO: MATRIZ_DADOS')
-        for cat_id, row in matriz_dados.items():
-            app.logger.debug('Categoria %s: %s', cat_id, ', '.join([f"{mes}={row.get(mes,0)}" for mes in meses]))
-    except Exception as e:
-        app.logger.exception('RELATORIO ERROR: %s', e)
-
-    # Preparar linhas por transação para a tabela detalhada
-    # Agrupar informação de categoria raiz / subcategoria para exibição
-    categorias_map = {c.id: c for c in todas_categorias}
-    # Agrupar transações por (descrição normalizada, categoria_raiz, subcategoria) e somar por mês
-    grupos = {}
-    for t in transacoes:
-        # Month label compatível com lista `meses` (ex: 'Jan 2025')
-        try:
-            month_label = f"{meses_pt[t.data_transacao.month-1]} {t.data_transacao.year}"
-        except Exception:
-            month_label = None
-
-        # Categoria e subcategoria
-        cat = categorias_map.get(t.categoria_id) or (Categoria.query.get(t.categoria_id) if t.categoria_id else None)
-        subcategoria_nome = ''
-        categoria_raiz_nome = ''
-        try:
-            if cat:
-                if cat.parent_id:
-                    subcategoria_nome = cat.nome
-                    raiz_temp = cat
-                    while raiz_temp and raiz_temp.parent_id:
-                        raiz_temp = categorias_map.get(raiz_temp.parent_id) or Categoria.query.get(raiz_temp.parent_id)
-                    categoria_raiz_nome = raiz_temp.nome if raiz_temp else ''
-                else:
-                    categoria_raiz_nome = cat.nome
-        except Exception:
-            categoria_raiz_nome = getattr(cat, 'nome', '') if cat else ''
-        # Normalizar descrição para agrupar independentemente de caixa/espacos
-        raw_desc = (getattr(t, 'descricao', '') or '').strip()
-        # Remover sufixos comuns de parcela (ex: ' - Parcela 1/8', 'Parcela-1/8', 'Parcela 1 de 8')
-        import re
-        cleaned_desc = raw_desc
-        # padrão principal: 'parcela X/Y' possivelmente precedido por '-' ou similar
-        cleaned_desc = re.sub(r"(?i)\s*(?:[-–—])?\s*parcela\s*\d+\s*[\\/\-]\s*\d+", "", cleaned_desc)
-        # padrão alternativo: 'parcela X de Y' ou 'parcela X of Y'
-        cleaned_desc = re.sub(r"(?i)\s*(?:[-–—])?\s*parcela\s*\d+\s*(?:de|of)\s*\d+", "", cleaned_desc)
-        # remover termos isolados como 'parcela X' no final
-        cleaned_desc = re.sub(r"(?i)\s*(?:[-–—])?\s*parcela\s*\d+\s*$", "", cleaned_desc)
-        # limpar espaços redundantes e traços finais
-        cleaned_desc = cleaned_desc.strip().rstrip('-').strip()
-
-        norm_desc = ' '.join(cleaned_desc.split()).lower()
-
-        # incluir tipo na chave para evitar misturar receitas e despesas com a mesma descrição
-        tipo_nome = getattr(t, 'tipo', None)
-        tipo_nome = tipo_nome.value if tipo_nome is not None else ''
-        chave = (norm_desc, categoria_raiz_nome or '', subcategoria_nome or '', tipo_nome)
-
-        if chave not in grupos:
-            # inicializar mapas mensais (total, real e projetado) com zeros para todos os meses
-            monthly = {m: 0 for m in meses}
-            monthly_real = {m: 0 for m in meses}
-            monthly_proj = {m: 0 for m in meses}
-            grupos[chave] = {
-                # descrição exibida: usar a versão limpa (sem texto de parcela) para agrupar
-                'descricao': cleaned_desc or raw_desc,
-                'categoria_raiz': categoria_raiz_nome or '',
-                'subcategoria': subcategoria_nome or '',
-                'tipo': tipo_nome,
-                'monthly': monthly,
-                'monthly_real': monthly_real,
-                'monthly_proj': monthly_proj,
-                'total': 0,
-                'is_projetada': getattr(t, 'is_projetada', False)
-            }
-            # coletar variantes originais para fallback
-            grupos[chave].setdefault('_orig_variants', [])
-
-        # registrar variante original (para preservar capitalização quando não houver consolidada)
-        if raw_desc and raw_desc not in grupos[chave].get('_orig_variants', []):
-            grupos[chave]['_orig_variants'].append(raw_desc)
-
-        # somar valor no mês correto (se o mês estiver dentro do período)
-        if month_label and month_label in grupos[chave]['monthly']:
-            # determinar valor com sinal consistente: receitas positivas, despesas negativas
-            try:
-                is_receita = (t.tipo == TipoTransacao.RECEITA)
-            except Exception:
-                # fallback: se tipo não estiver disponível, inferir pelo sinal do valor
-                is_receita = (getattr(t, 'valor', 0) >= 0)
-
-            # Normalizar usando valor absoluto para evitar dupla-negação se dados vierem com sinal
-            raw_val = float(getattr(t, 'valor', 0) or 0)
-            if is_receita:
-                signed_val = abs(raw_val)
-            else:
-                signed_val = -abs(raw_val)
-
-            # sempre atualizar o total combinado (receitas positivas, despesas negativas)
-            grupos[chave]['monthly'][month_label] += signed_val
-            grupos[chave]['total'] += signed_val
-            # e também atualizar as partições real vs projetada (usar signed_val)
-            if getattr(t, 'is_projetada', False):
-                grupos[chave]['monthly_proj'][month_label] += signed_val
-            else:
-                grupos[chave]['monthly_real'][month_label] += signed_val
-        else:
-            # valores fora do período somam para o total geral (usar mesma normalização)
-            try:
-                is_receita = (t.tipo == TipoTransacao.RECEITA)
-            except Exception:
-                is_receita = (getattr(t, 'valor', 0) >= 0)
-            raw_val = float(getattr(t, 'valor', 0) or 0)
-            grupos[chave]['total'] += (abs(raw_val) if is_receita else -abs(raw_val))
-
-        # se encontrarmos uma transação real (não projetada), preferi-la como label exibido
-        if not getattr(t, 'is_projetada', False):
-            grupos[chave]['descricao'] = raw_desc
-
-        # qualquer transação projetada marca o grupo como projetado (mas não cria nova linha)
-        if getattr(t, 'is_projetada', False):
-            grupos[chave]['is_projetada'] = True
-
-    # Preparar lista final: usar a variante original mais legível como descrição exibida
-    for g in grupos.values():
-        if (not g.get('descricao')) and g.get('_orig_variants'):
-            g['descricao'] = g['_orig_variants'][0]
-        # remover campo auxiliar antes de enviar ao template
-        if '_orig_variants' in g:
-            del g['_orig_variants']
-
-    # Converter para lista ordenada por descrição (caso-insensitivo)
-    transacoes_linhas = sorted(list(grupos.values()), key=lambda g: (g.get('descricao') or '').lower())
+    # Linhas da tabela detalhada, agrupadas por (descrição sem parcela, categoria raiz,
+    # subcategoria, tipo) e somadas por mês
+    transacoes_linhas = agregado.linhas(categorias_map)
 
     # Garantir que valores usados no template para seleção sejam strings (ou vazio)
     categoria_for_template = str(categoria_id) if categoria_id is not None else ''
@@ -2335,32 +1897,7 @@ def relatorios():
         pass
 
     # --- Pré-computar agregados por seção (receitas / despesas) e saldo mensal ---
-    receitas_real_monthly = {m: 0 for m in meses}
-    receitas_proj_monthly = {m: 0 for m in meses}
-    despesas_real_monthly = {m: 0 for m in meses}
-    despesas_proj_monthly = {m: 0 for m in meses}
-
-    for g in transacoes_linhas:
-        for m in meses:
-            # partir dos mapas mensais já preparados (signed values)
-            try:
-                rv = float(g.get('monthly_real', {}).get(m, 0) or 0)
-                pv = float(g.get('monthly_proj', {}).get(m, 0) or 0)
-            except Exception:
-                rv = 0
-                pv = 0
-
-            # reais
-            if rv > 0:
-                receitas_real_monthly[m] += rv
-            elif rv < 0:
-                despesas_real_monthly[m] += -rv
-
-            # projetadas
-            if pv > 0:
-                receitas_proj_monthly[m] += pv
-            elif pv < 0:
-                despesas_proj_monthly[m] += -pv
+    receitas_real_monthly, receitas_proj_monthly, despesas_real_monthly, despesas_proj_monthly = agregado.secoes_mensais()
 
     total_receitas_real_calc = sum(receitas_real_monthly.values())
     total_receitas_proj_calc = sum(receitas_proj_monthly.values())
@@ -2376,14 +1913,15 @@ def relatorios():
     receitas_linhas = [g for g in transacoes_linhas if float(g.get('total', 0)) > 0]
     despesas_linhas = [g for g in transacoes_linhas if float(g.get('total', 0)) < 0]
 
-    return render_template('relatorios.html',
+    dados = cache_relatorios.guardar(chave_cache, dict(
                          anos_disponiveis=anos_disponiveis,
                          ano=ano,
                          tipo=tipo,
                          categoria=categoria_for_template,
                          conta=conta_for_template,
-                         todas_categorias=todas_categorias,
-                         todas_contas=todas_contas,
+                         todas_categorias=[SimpleNamespace(id=c.id, nome=c.nome, nome_completo=nome_completo(c.id))
+                                           for c in todas_categorias],
+                         todas_contas=[SimpleNamespace(id=c.id, nome=c.nome) for c in todas_contas],
                          meses=meses,
                          totais_mensais=totais_mensais,
                          total_receitas=total_receitas,
@@ -2409,7 +1947,172 @@ def relatorios():
                          total_despesas_real_calc=total_despesas_real_calc,
                          total_despesas_proj_calc=total_despesas_proj_calc,
                          saldo_total_real_calc=saldo_total_real_calc,
-                         saldo_total_proj_calc=saldo_total_proj_calc)
+                         saldo_total_proj_calc=saldo_total_proj_calc))
+    return dados
+
+
+def _relatorio_colunar(dados):
+    """Dados do relatório em colunas: listas paralelas e valores mensais alinhados com `meses`"""
+    meses = dados['meses']
+
+    def valor(v):
+        return round(float(v or 0), 2)
+
+    def por_mes(mensal):
+        return [valor(mensal.get(m, 0)) for m in meses]
+
+    def colunas_categorias(*grupos):
+        vistas = {}
+        for categoria in (c for grupo in grupos for c in grupo):
+            vistas.setdefault(categoria.id, categoria)
+        return {
+            'id': list(vistas),
+            'nome': [c.nome_completo for c in vistas.values()],
+            'receita': [valor(c.total_receita) for c in vistas.values()],
+            'despesa': [valor(c.total_despesa) for c in vistas.values()],
+        }
+
+    categorias = colunas_categorias(dados['categorias_receitas'], dados['categorias_despesas'])
+    categorias['valores'] = [por_mes(dados['matriz_dados'].get(categoria_id, {})) for categoria_id in categorias['id']]
+    linhas = dados['transacoes_linhas']
+    return {
+        'success': True,
+        'meses': meses,
+        'totais': {
+            'receitas': valor(dados['total_receitas']),
+            'despesas': valor(dados['total_despesas']),
+            'saldo': valor(dados['saldo_geral']),
+            'transacoes': dados['total_transacoes'],
+        },
+        'mensal': {
+            'receitas': [valor(dados['totais_mensais'][m]['receita']) for m in meses],
+            'despesas': [valor(dados['totais_mensais'][m]['despesa']) for m in meses],
+            'receitas_real': por_mes(dados['receitas_real_monthly']),
+            'receitas_proj': por_mes(dados['receitas_proj_monthly']),
+            'despesas_real': por_mes(dados['despesas_real_monthly']),
+            'despesas_proj': por_mes(dados['despesas_proj_monthly']),
+        },
+        'categorias': categorias,
+        'subcategorias': colunas_categorias(dados['categorias_sub_receitas'], dados['categorias_sub_despesas']),
+        'linhas': {
+            'descricao': [g['descricao'] for g in linhas],
+            'categoria_raiz': [g['categoria_raiz'] for g in linhas],
+            'subcategoria': [g['subcategoria'] for g in linhas],
+            'tipo': [g['tipo'] for g in linhas],
+            'projetada': [bool(g['is_projetada']) for g in linhas],
+            'total': [valor(g['total']) for g in linhas],
+            'real': [por_mes(g['monthly_real']) for g in linhas],
+            'projetado': [por_mes(g['monthly_proj']) for g in linhas],
+        },
+    }
+
+
+@app.route('/api/relatorios')
+@login_required
+def api_relatorios():
+    """Relatório em JSON colunar, com os mesmos filtros e dados da página /relatorios.
+
+    Query params: os mesmos de /relatorios (ano, tipo, categoria, conta, data_inicio, data_fim)
+
+    Response JSON (toda lista de valores mensais segue a ordem de `meses`):
+      {
+        'success': True,
+        'meses': ['Jan 2025', ...],
+        'totais': {'receitas': .., 'despesas': .., 'saldo': .., 'transacoes': ..},
+        'mensal': {'receitas': [..], 'despesas': [..], 'receitas_real': [..], 'receitas_proj': [..],
+                   'despesas_real': [..], 'despesas_proj': [..]},
+        'categorias': {'id': [..], 'nome': [..], 'receita': [..], 'despesa': [..], 'valores': [[..], ..]},
+        'subcategorias': {'id': [..], 'nome': [..], 'receita': [..], 'despesa': [..]},
+        'linhas': {'descricao': [..], 'categoria_raiz': [..], 'subcategoria': [..], 'tipo': [..],
+                   'projetada': [..], 'total': [..], 'real': [[..], ..], 'projetado': [[..], ..]}
+      }
+    """
+    filtros = _filtros_relatorio(request.args)
+    # O documento JSON já serializado também fica no cache, com a mesma chave do relatório
+    chave_cache = _chave_relatorio(current_user, *filtros) + ('json',)
+    corpo = cache_relatorios.obter(chave_cache)
+    if corpo is None:
+        corpo = cache_relatorios.guardar(
+            chave_cache, json.dumps(_relatorio_colunar(_dados_relatorio(current_user, *filtros)), separators=(',', ':'))
+        )
+    return app.response_class(corpo, mimetype='application/json')
+
+
+def _resposta_exportacao(formato, nome_arquivo, cabecalho, linhas, titulo):
+    """Resposta enviada em partes com o arquivo exportado (ver exportacao)"""
+    try:
+        partes, mimetype, extensao = exportar(formato, cabecalho, linhas, titulo)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e), 'formatos': formatos_disponiveis()}), 400
+    return app.response_class(
+        stream_with_context(partes),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}.{extensao}"'}
+    )
+
+
+def _exportar_transacoes(query, formato, nome_arquivo):
+    """Exporta as transações de `query`, lidas do banco em lotes"""
+    categorias_map = {c.id: c for c in Categoria.query.filter_by(user_id=current_user.id)}
+    nomes_categorias = {c: _nome_completo_categoria(categorias_map, c) for c in categorias_map}
+    nomes_contas = dict(db.session.query(Conta.id, Conta.nome).filter(Conta.user_id == current_user.id).all())
+    return _resposta_exportacao(formato, nome_arquivo, CABECALHO_TRANSACOES,
+                                linhas_transacoes(query, nomes_categorias, nomes_contas), 'Transações')
+
+
+@app.route('/relatorios/exportar')
+@login_required
+def exportar_relatorio():
+    """Exporta o relatório com os filtros de /relatorios.
+
+    Query params: os mesmos de /relatorios, mais
+      formato: 'csv' (padrão) ou 'xlsx' (se o openpyxl estiver instalado)
+      conteudo: 'quadro' (padrão; linhas por descrição com os valores de cada mês)
+                ou 'transacoes' (as transações reais filtradas, uma por linha)
+    """
+    filtros = _filtros_relatorio(request.args)
+    formato = request.args.get('formato', 'csv').lower()
+    nome_arquivo = f'relatorio_{filtros[0]}'
+    if request.args.get('conteudo') == 'transacoes':
+        query = _transacoes_relatorio(current_user, *filtros)[0]
+        return _exportar_transacoes(query, formato, nome_arquivo + '_transacoes')
+    dados = _dados_relatorio(current_user, *filtros)
+    return _resposta_exportacao(formato, nome_arquivo, cabecalho_relatorio(dados), linhas_relatorio(dados), 'Relatório')
+
+
+@app.route('/transacoes/exportar')
+@login_required
+def exportar_transacoes():
+    """Exporta as transações do usuário atual.
+
+    Query params:
+      formato: 'csv' (padrão) ou 'xlsx' (se o openpyxl estiver instalado)
+      data_inicio, data_fim: período (YYYY-MM-DD); sem eles, o mês de ano/mes_atual,
+                             como na listagem de /transacoes (mês fora de 1-12 é
+                             ajustado ao limite mais próximo)
+
+    Exporta todas as transações gravadas do mês ou período; as projeções exibidas
+    em /transacoes não entram no arquivo.
+    """
+    formato = request.args.get('formato', 'csv').lower()
+    hoje = datetime.now()
+    try:
+        inicio = datetime.strptime(request.args['data_inicio'], '%Y-%m-%d')
+        fim = datetime.strptime(request.args['data_fim'], '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+    except (KeyError, ValueError):
+        ano = request.args.get('ano', hoje.year, type=int)
+        mes = request.args.get('mes_atual', hoje.month, type=int)
+        # Valores fora do calendário fariam datetime() falhar
+        ano = min(max(ano, datetime.min.year), datetime.max.year - 1)
+        mes = min(max(mes, 1), 12)
+        inicio = datetime(ano, mes, 1)
+        fim = inicio + relativedelta(months=1) - timedelta(seconds=1)
+    query = Transacao.query.filter(
+        Transacao.user_id == current_user.id,
+        Transacao.data_transacao >= inicio,
+        Transacao.data_transacao <= fim
+    )
+    return _exportar_transacoes(query, formato, f'transacoes_{inicio:%Y-%m-%d}_{fim:%Y-%m-%d}')
 
 @app.route('/api/comparar-contas-ano')
 @login_required
@@ -2448,37 +2151,33 @@ def api_comparar_contas_ano():
         else:
             contas = Conta.query.filter_by(user_id=current_user.id).all()
 
-        # Fetch transactions for the year
+        # Monthly net per account (receita +, despesa -), read from the monthly rollup
         periodo_inicio = datetime(year, 1, 1)
         periodo_fim = datetime(year, 12, 31, 23, 59, 59)
-        transacoes = Transacao.query.filter(
-            Transacao.user_id == current_user.id,
-            Transacao.data_transacao >= periodo_inicio,
-            Transacao.data_transacao <= periodo_fim
-        ).all()
+        mensal = {conta.id: [0.0] * 12 for conta in contas}
+        linhas = db.session.query(
+            ResumoMensal.conta_id, ResumoMensal.ano_mes, ResumoMensal.tipo, func.sum(ResumoMensal.total)
+        ).filter(
+            ResumoMensal.user_id == current_user.id,
+            ResumoMensal.conta_id.in_(list(mensal)),
+            ResumoMensal.ano_mes.between(year * 100 + 1, year * 100 + 12)
+        ).group_by(ResumoMensal.conta_id, ResumoMensal.ano_mes, ResumoMensal.tipo).all()
+        for conta_id, ano_mes_valor, tipo, valor in linhas:
+            valor = valor or 0
+            mensal[conta_id][ano_mes_valor % 100 - 1] += valor if tipo == TipoTransacao.RECEITA else -valor
 
         # Also include projected transactions from recorrentes so the chart reflects projections
         try:
-            # determine months ahead needed from today to include the target year
-            hoje = datetime.utcnow()
-            meses_needed = max(0, (year - hoje.year) * 12 + (12 - hoje.month) + 1)
-
-            # fetch recorrentes (optionally filter by contas if provided)
-            recorrentes_q = TransacaoRecorrente.query.filter_by(user_id=current_user.id)
-            if contas_param and 'conta_ids' in locals():
-                recorrentes_q = recorrentes_q.filter(TransacaoRecorrente.conta_id.in_(conta_ids))
-            recorrentes = recorrentes_q.all()
-
-            for recorrente in recorrentes:
-                try:
-                    proj = recorrente.gerar_transacoes_pendentes(meses_futuros=meses_needed, apenas_projetar=True)
-                    # filtrar apenas as projeções que caem dentro do ano solicitado
-                    for p in proj:
-                        if p and hasattr(p, 'data_transacao') and periodo_inicio <= p.data_transacao <= periodo_fim:
-                            transacoes.append(p)
-                except Exception:
-                    # segurança: não falhar toda a API por problema em uma recorrência
-                    app.logger.exception('Erro ao gerar projeções para recorrente %s', getattr(recorrente, 'id', None))
+            # project all active recorrentes at once (optionally filtered by contas), only within the year,
+            # summed month by month from the compact batches
+            engine = ProjectionEngine.carregar(current_user.id, conta_ids=[c.id for c in contas] if contas_param else None)
+            for lote in engine.lotes(periodo_inicio, periodo_fim):
+                rec = lote.recorrencia
+                if rec.conta_id not in mensal:
+                    continue
+                sinal = 1 if rec.tipo == TipoTransacao.RECEITA else -1
+                for (_, mes), _, quantidade in lote.por_mes():
+                    mensal[rec.conta_id][mes - 1] += sinal * rec.valor * quantidade
         except Exception:
             app.logger.exception('Erro ao coletar projeções de recorrentes')
 
@@ -2486,25 +2185,15 @@ def api_comparar_contas_ano():
         meses_pt = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
         months = [f"{meses_pt[m-1]} {year}" for m in range(1,13)]
 
-        # Group transactions by conta and month (net: receita +, despesa -)
         accounts_data = []
         for conta in contas:
-            monthly = [0.0] * 12
-            for t in transacoes:
-                if t.conta_id != conta.id:
-                    continue
-                m = t.data_transacao.month - 1
-                if t.tipo == TipoTransacao.RECEITA:
-                    monthly[m] += t.valor
-                else:
-                    monthly[m] -= t.valor
-            total = sum(monthly)
+            monthly = mensal[conta.id]
             accounts_data.append({
                 'id': conta.id,
                 'nome': conta.nome,
                 'cor': getattr(conta, 'cor', None),
                 'monthly': monthly,
-                'total': total
+                'total': sum(monthly)
             })
 
         return jsonify({'success': True, 'year': year, 'months': months, 'accounts': accounts_data})
@@ -2521,23 +2210,18 @@ def dados_grafico():
         conta_id = request.args.get('conta')
         ano = request.args.get('ano')
 
-        # Base filter por usuário
-        base_filter = [Transacao.user_id == current_user.id]
+        # Base filter por usuário (totais lidos do resumo mensal)
+        base_filter = [ResumoMensal.user_id == current_user.id]
         if conta_id:
             try:
                 conta_id = int(conta_id)
-                base_filter.append(Transacao.conta_id == conta_id)
+                base_filter.append(ResumoMensal.conta_id == conta_id)
             except Exception:
                 pass
         if ano:
             try:
                 ano_int = int(ano)
-                # Ajustar expressão conforme o dialect do banco (SQLite usa strftime, Postgres usa date_part)
-                dialect = db.engine.dialect.name
-                if dialect and dialect.startswith('postgres'):
-                    base_filter.append(func.date_part('year', Transacao.data_transacao) == ano_int)
-                else:
-                    base_filter.append(func.strftime('%Y', Transacao.data_transacao) == str(ano_int))
+                base_filter.append(ResumoMensal.ano_mes.between(ano_int * 100 + 1, ano_int * 100 + 12))
             except Exception:
                 pass
 
@@ -2545,8 +2229,10 @@ def dados_grafico():
         resultado = db.session.query(
             Categoria.nome,
             Categoria.cor,
-            func.sum(Transacao.valor)
-        ).join(Transacao).filter(*base_filter, Transacao.tipo == TipoTransacao.DESPESA).group_by(Categoria.nome, Categoria.cor).all()
+            func.sum(ResumoMensal.total)
+        ).join(Categoria, Categoria.id == ResumoMensal.categoria_id).filter(
+            *base_filter, ResumoMensal.tipo == TipoTransacao.DESPESA
+        ).group_by(Categoria.nome, Categoria.cor).all()
         
         dados_categoria = {
             'labels': [r[0] for r in resultado],
@@ -2555,23 +2241,17 @@ def dados_grafico():
         }
         
         # Dados mensais (filtrados por usuário)
-        # Construir expressão de rótulo do mês compatível com o banco (SQLite x Postgres)
-        dialect = db.engine.dialect.name
-        if dialect and dialect.startswith('postgres'):
-            month_label = func.to_char(Transacao.data_transacao, 'YYYY-MM').label('mes')
-        else:
-            month_label = func.strftime('%Y-%m', Transacao.data_transacao).label('mes')
-
         dados_mensais = db.session.query(
-            month_label,
-            Transacao.tipo,
-            func.sum(Transacao.valor)
-        ).filter(*base_filter).group_by(month_label, Transacao.tipo).all()
+            ResumoMensal.ano_mes,
+            ResumoMensal.tipo,
+            func.sum(ResumoMensal.total)
+        ).filter(*base_filter).group_by(ResumoMensal.ano_mes, ResumoMensal.tipo).all()
         
-        # Organizando dados mensais
+        # Organizando dados mensais (rótulo 'AAAA-MM')
         meses = {}
         for registro in dados_mensais:
-            mes, tipo, valor = registro
+            ano_mes_valor, tipo, valor = registro
+            mes = f'{ano_mes_valor // 100:04d}-{ano_mes_valor % 100:02d}'
             if mes not in meses:
                 meses[mes] = {'receitas': 0, 'despesas': 0}
             # valor pode ser None dependendo do banco; tratar como 0.0
@@ -2955,6 +2635,9 @@ def nova_transacao_recorrente():
             db.session.add(recorrente)
             db.session.commit()
             
+            # Gravar as ocorrências vencidas em segundo plano
+            materializacao.enfileirar(recorrente.id)
+            
             # Definir horizonte de meses futuros (usar valor padrão da configuração)
             meses_futuros = app.config.get('MESES_FUTUROS_DEFAULT', 36)
             
@@ -3030,8 +2713,11 @@ def editar_transacao_recorrente(recorrente_id):
             recorrente.categoria_id = form.categoria_id.data
             recorrente.conta_id = form.conta_id.data
             recorrente.total_parcelas = form.total_parcelas.data if form.is_parcelada.data else None
+            # O índice da marca d'água depende de data_inicio e do tipo de recorrência
+            recorrente.recalcular_marca()
             
             db.session.commit()
+            materializacao.enfileirar(recorrente.id)
             flash('Transação recorrente atualizada com sucesso!', 'success')
             return redirect(url_for('transacoes_recorrentes'))
             
@@ -3093,6 +2779,8 @@ def pausar_transacao_recorrente(recorrente_id):
             return jsonify({'success': False, 'message': 'Transação já foi finalizada'}), 400
         
         db.session.commit()
+        if recorrente.status == StatusRecorrencia.ATIVA:
+            materializacao.enfileirar(recorrente.id)
         return jsonify({'success': True, 'message': message, 'status': recorrente.status.value})
         
     except Exception as e:
@@ -3129,89 +2817,37 @@ def projetar_transacoes_futuras():
         # Parâmetro para número de meses (usa helper que aplica limites/config)
         meses_futuros = obter_meses_futuros_from_request()
         
-        recorrentes_ativas = TransacaoRecorrente.query.filter_by(
-            status=StatusRecorrencia.ATIVA, 
-            user_id=current_user.id
-        ).all()
+        # Data atual para separar transações existentes de projeções
+        agora = datetime.utcnow()
+        hoje = datetime.combine(agora.date(), datetime.min.time())
+        data_limite = agora + relativedelta(months=meses_futuros)
+        
+        # Projetar todas as recorrências ativas em uma passada; recorrências com
+        # data_fim são projetadas até a própria data_fim
+        engine = ProjectionEngine.carregar(current_user.id)
         
         # Lista para armazenar todas as projeções
         projecoes = []
         # ID temporário para projeções (negativo para evitar conflitos)
         next_temp_id = -1
         
-        # Data atual para separar transações existentes de projeções
-        hoje = datetime.utcnow().date()
-        
-        for recorrente in recorrentes_ativas:
-            # Determinar a data limite de projeção
-            if recorrente.data_fim:
-                data_limite = recorrente.data_fim
-            else:
-                data_limite = datetime.utcnow() + relativedelta(months=meses_futuros)
-            
-            # Obter a última transação existente
-            ultima_transacao = Transacao.query.filter_by(
-                recorrencia_id=recorrente.id
-            ).order_by(Transacao.data_transacao.desc()).first()
-            
-            # Determinar a data da próxima projeção
-            if ultima_transacao:
-                proxima_data = recorrente.calcular_proxima_data(ultima_transacao.data_transacao)
-            else:
-                proxima_data = recorrente.data_inicio
-            
-            # Gerar projeções
-            while proxima_data and proxima_data <= data_limite:
-                # Verificar se já é uma transação consolidada
-                transacao_existente = Transacao.query.filter_by(
-                    recorrencia_id=recorrente.id,
-                    data_transacao=proxima_data
-                ).first()
-                
-                if transacao_existente:
-                    # Adicionar à lista como consolidada
-                    projecoes.append({
-                        'id': transacao_existente.id,
-                        'descricao': transacao_existente.descricao,
-                        'valor': transacao_existente.valor,
-                        'tipo': transacao_existente.tipo.value,
-                        'data': transacao_existente.data_transacao.strftime('%Y-%m-%d'),
-                        'forma_pagamento': transacao_existente.forma_pagamento.nome if transacao_existente.forma_pagamento else None,
-                        'categoria': transacao_existente.categoria.nome,
-                        'categoria_cor': transacao_existente.categoria.cor,
-                        'conta': transacao_existente.conta.nome,
-                        'conta_cor': transacao_existente.conta.cor,
-                        'recorrencia_id': recorrente.id,
-                        'status': 'consolidada'
-                    })
-                else:
-                    # Adicionar como projeção não consolidada
-                    # Apenas se a data for futura
-                    if proxima_data.date() >= hoje:
-                        projecoes.append({
-                            'id': next_temp_id,
-                            'descricao': recorrente.descricao,
-                            'valor': recorrente.valor,
-                            'tipo': recorrente.tipo.value,
-                            'data': proxima_data.strftime('%Y-%m-%d'),
-                            'categoria': recorrente.categoria.nome,
-                            'categoria_cor': recorrente.categoria.cor,
-                            'conta': recorrente.conta.nome,
-                            'conta_cor': recorrente.conta.cor,
-                            'forma_pagamento': recorrente.forma_pagamento.nome if recorrente.forma_pagamento else None,
-                            'recorrencia_id': recorrente.id,
-                            'status': 'projetada'
-                        })
-                        next_temp_id -= 1
-                
-                # Calcular próxima data
-                proxima_data = recorrente.calcular_proxima_data(proxima_data)
-                
-                # Verificar se atingimos o limite de parcelas para recorrências parceladas
-                if recorrente.is_parcelada:
-                    parcelas_projetadas = len([p for p in projecoes if p['recorrencia_id'] == recorrente.id])
-                    if recorrente.parcelas_geradas + parcelas_projetadas >= recorrente.total_parcelas:
-                        break
+        for projecao in engine.projetar(hoje, data_limite, ate_data_fim=True):
+            recorrente = engine.recorrentes[projecao.recorrencia_id]
+            projecoes.append({
+                'id': next_temp_id,
+                'descricao': recorrente.descricao,
+                'valor': recorrente.valor,
+                'tipo': recorrente.tipo.value,
+                'data': projecao.data_transacao.strftime('%Y-%m-%d'),
+                'categoria': recorrente.categoria.nome,
+                'categoria_cor': recorrente.categoria.cor,
+                'conta': recorrente.conta.nome,
+                'conta_cor': recorrente.conta.cor,
+                'forma_pagamento': recorrente.forma_pagamento.nome if recorrente.forma_pagamento else None,
+                'recorrencia_id': recorrente.id,
+                'status': 'projetada'
+            })
+            next_temp_id -= 1
         
         return jsonify({
             'success': True,
@@ -3257,8 +2893,9 @@ def consolidar_projecoes():
         if not projecoes_ids:
             return jsonify({'success': False, 'message': 'Todas as projeções selecionadas já estão consolidadas'}), 400
 
-        consolidadas = []
         erros = []
+        ocorrencias = []
+        recorrentes = {}
 
         for projecao_id in projecoes_ids:
             key_rec = f'recorrencia_{abs(projecao_id)}'
@@ -3271,50 +2908,40 @@ def consolidar_projecoes():
                 continue
 
             try:
-                recorrente = TransacaoRecorrente.query.filter_by(id=int(recorrencia_id), user_id=current_user.id).first()
+                recorrencia_id = int(recorrencia_id)
+                if recorrencia_id not in recorrentes:
+                    recorrentes[recorrencia_id] = TransacaoRecorrente.query.filter_by(id=recorrencia_id, user_id=current_user.id).first()
+                recorrente = recorrentes[recorrencia_id]
                 if not recorrente:
                     erros.append(f'Recorrência {recorrencia_id} não encontrada')
                     continue
 
-                data_dt = datetime.strptime(data_projecao, '%Y-%m-%d')
-
-                # Verificar se já existe transação para essa data
-                existente = Transacao.query.filter_by(recorrencia_id=recorrente.id, data_transacao=data_dt).first()
-                if existente:
-                    erros.append(f'Transação para {data_projecao} já existe')
-                    continue
-
-                nova_transacao = Transacao(
-                    descricao=recorrente.descricao,
-                    valor=recorrente.valor,
-                    tipo=recorrente.tipo,
-                    data_transacao=data_dt,
-                    categoria_id=recorrente.categoria_id,
-                    conta_id=recorrente.conta_id,
-                    recorrencia_id=recorrente.id,
-                    user_id=current_user.id
-                )
-
-                db.session.add(nova_transacao)
-
-                if recorrente.is_parcelada:
-                    recorrente.parcelas_geradas += 1
-                    if recorrente.parcelas_geradas >= recorrente.total_parcelas:
-                        recorrente.status = StatusRecorrencia.FINALIZADA
-
-                consolidadas.append(projecao_id)
-                app.logger.info(f"Projeção ID {projecao_id} consolidada para {data_projecao}")
+                indice, data_dt = recorrente.ocorrencia_do_dia(datetime.strptime(data_projecao, '%Y-%m-%d'))
+                ocorrencias.append((projecao_id, recorrente, indice, data_dt))
 
             except Exception as e:
                 erros.append(f'Erro ao processar projeção {projecao_id}: {str(e)}')
 
-        if consolidadas:
+        # Gravar o lote em uma única instrução; ocorrências já existentes são ignoradas
+        consolidadas = []
+        if ocorrencias:
             try:
+                inseridas = TransacaoRecorrente.materializar_em_lote(
+                    (recorrente, indice, data_dt) for _, recorrente, indice, data_dt in ocorrencias
+                )
                 db.session.commit()
             except Exception as e:
                 db.session.rollback()
                 return jsonify({'success': False, 'message': f'Erro ao salvar transações: {str(e)}'}), 500
 
+            gravadas = {(linha.recorrencia_id, linha.data_transacao.date()) for linha in inseridas}
+            for projecao_id, recorrente, _, data_dt in ocorrencias:
+                if (recorrente.id, data_dt.date()) in gravadas:
+                    consolidadas.append(projecao_id)
+                    app.logger.info(f"Projeção ID {projecao_id} consolidada para {data_dt.strftime('%Y-%m-%d')}")
+                else:
+                    erros.append(f"Transação para {data_dt.strftime('%Y-%m-%d')} já existe")
+
         if not consolidadas:
             return jsonify({'success': False, 'message': f'Nenhuma projeção consolidada. Erros: {"; ".join(erros)}'}), 400
 
@@ -3332,23 +2959,16 @@ def gerar_todas_transacoes_pendentes():
         # Parâmetro para número de meses (usa helper que aplica limites/config)
         meses_futuros = obter_meses_futuros_from_request()
         
-        recorrentes_ativas = TransacaoRecorrente.query.filter_by(
-            status=StatusRecorrencia.ATIVA, 
-            user_id=current_user.id
-        ).all()
-        total_transacoes_geradas = 0
-        recorrentes_com_data_fim = 0
+        # Projetar todas as recorrências ativas em uma passada: as que têm data_fim
+        # até essa data, as demais para os próximos meses
+        engine = ProjectionEngine.carregar(current_user.id)
+        recorrentes_ativas = list(engine.recorrentes.values())
+        recorrentes_com_data_fim = sum(1 for r in recorrentes_ativas if r.data_fim)
         
-        for recorrente in recorrentes_ativas:
-            # Se tem data_fim, usar isso como limite
-            if recorrente.data_fim:
-                transacoes_geradas = recorrente.gerar_transacoes_pendentes(apenas_projetar=True)
-                recorrentes_com_data_fim += 1
-            else:
-                # Gerar transações para os próximos meses
-                transacoes_geradas = recorrente.gerar_transacoes_pendentes(meses_futuros=meses_futuros, apenas_projetar=True)
-            
-            total_transacoes_geradas += len(transacoes_geradas)
+        data_limite = datetime.utcnow() + relativedelta(months=meses_futuros)
+        inicio = min((r.data_inicio for r in recorrentes_ativas), default=data_limite)
+        # Apenas contar: os lotes compactos dispensam criar um objeto por projeção
+        total_transacoes_geradas = sum(len(lote) for lote in engine.lotes(inicio, data_limite, ate_data_fim=True))
         
         # Construir mensagem personalizada
         if recorrentes_com_data_fim > 0 and recorrentes_com_data_fim < len(recorrentes_ativas):
@@ -3475,6 +3095,10 @@ def limpar_todas_transacoes():
         db.session.commit()
         # Depois apaga todas as transações
         Transacao.query.delete()
+        # O DELETE em massa não passa pelos eventos que mantêm o resumo mensal
+        # nem pelos que invalidam os relatórios em cache
+        ResumoMensal.query.delete()
+        Usuario.query.update({Usuario.dados_versao: Usuario.dados_versao + 1})
         db.session.commit()
         # Depois apaga todas as recorrências
         TransacaoRecorrente.query.delete()
@@ -3508,6 +3132,45 @@ def admin():
                           total_recorrentes=total_recorrentes,
                           usuarios=usuarios)
 
+@app.route('/admin/rastreio-recorrencias', methods=['GET', 'POST'])
+@login_required
+def admin_rastreio_recorrencias():
+    """
+    Contadores do rastreio da geração de recorrências (apenas para admins).
+    
+    GET devolve a configuração, os totais por recorrência e as execuções recentes.
+    POST aceita JSON com `ativo` (bool), `taxa` (0 a 1) e `limpar` (bool).
+    
+    Tudo se refere só ao worker que atendeu a requisição (`pid` na resposta):
+    cada worker tem suas amostras e sua configuração.
+    """
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
+    if request.method == 'POST':
+        dados = request.get_json(silent=True) or {}
+        try:
+            rastreio.configurar(dados.get('ativo', rastreio.ativo), dados.get('taxa'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Taxa inválida'}), 400
+        if dados.get('limpar'):
+            rastreio.limpar()
+    
+    return jsonify(dict(rastreio.resumo(), success=True,
+                        aviso=f'Amostras apenas do worker {os.getpid()}; cada worker mantém as suas'))
+
+@app.route('/admin/precalculo-relatorios')
+@login_required
+def admin_precalculo_relatorios():
+    """
+    Situação do pré-cálculo dos relatórios (apenas para admins): usuários aguardando
+    a janela de espera, cálculo em andamento, execuções recentes e uso do cache.
+    """
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
+    return jsonify(dict(precalculo_relatorios.situacao(), cache=cache_relatorios.resumo(), success=True))
+
 # === ROTAS DE ADMINISTRAÇÃO DE CATEGORIAS PADRÃO ===
 
 @app.route('/admin/adicionar-categorias-padrao/<int:user_id>')
@@ -3787,6 +3450,8 @@ def excluir_tema(tema_id):
 def contas():
     """Lista todas as contas do usuário atual"""
     contas = Conta.query.filter_by(user_id=current_user.id).all()
+    # Saldos de todas as contas em uma única consulta, sem carregar as transações
+    Conta.carregar_saldos(contas)
     return render_template('contas.html', contas=contas)
 
 @app.route('/nova-conta', methods=['GET', 'POST'])
@@ -3892,6 +3557,41 @@ def saldo_conta_api(conta_id):
         'total_despesas': conta.total_despesas
     })
 
+# Período máximo (em dias) da série de saldos diários de uma conta
+MAX_DIAS_SALDOS = 731
+
+@app.route('/api/conta/<int:conta_id>/saldos-diarios')
+@login_required
+def saldos_diarios_conta_api(conta_id):
+    """
+    API com o saldo da conta ao fim de cada dia de um período.
+
+    Query params:
+      - inicio, fim (AAAA-MM-DD): período, inclusive; padrão: os últimos 30 dias
+    """
+    conta = Conta.query.filter_by(id=conta_id, user_id=current_user.id).first_or_404()
+    hoje = date.today()
+    try:
+        fim = datetime.strptime(request.args['fim'], '%Y-%m-%d').date() if request.args.get('fim') else hoje
+        inicio = (datetime.strptime(request.args['inicio'], '%Y-%m-%d').date()
+                  if request.args.get('inicio') else fim - timedelta(days=29))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Datas inválidas: use o formato AAAA-MM-DD'}), 400
+    if inicio > fim:
+        return jsonify({'success': False, 'message': 'A data inicial deve ser anterior à final'}), 400
+    if (fim - inicio).days >= MAX_DIAS_SALDOS:
+        return jsonify({'success': False, 'message': f'Período máximo de {MAX_DIAS_SALDOS} dias'}), 400
+
+    saldos = conta.saldos_diarios(inicio, fim)
+    return jsonify({
+        'conta_id': conta.id,
+        'nome': conta.nome,
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'datas': [dia.isoformat() for dia, _ in saldos],
+        'saldos': [saldo for _, saldo in saldos]
+    })
+
 @app.route('/api/categoria/nova', methods=['POST'])
 @login_required
 def nova_categoria_api():
@@ -3,7 +3,8 @@ Modelo de Conta para gerenciamento financeiro
 """
 from datetime import datetime
 from app import db
-from app.models.enums import TipoConta, TipoTransacao
+from app.models.enums import TipoConta
+import saldos_contas
 
 class Conta(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,19 +29,42 @@ class Conta(db.Model):
     @property
     def saldo_atual(self):
         """Calcula o saldo atual da conta"""
-        total_receitas = sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.RECEITA)
-        total_despesas = sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.DESPESA)
-        return self.saldo_inicial + total_receitas - total_despesas
+        return self.saldo_inicial + self.total_receitas - self.total_despesas
     
     @property
     def total_receitas(self):
         """Total de receitas da conta"""
-        return sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.RECEITA)
+        return self._totais()[0]
     
     @property
     def total_despesas(self):
         """Total de despesas da conta"""
-        return sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.DESPESA)
+        return self._totais()[1]
+    
+    @property
+    def total_transacoes(self):
+        """Número de transações da conta"""
+        return self._totais()[2]
+    
+    def _totais(self):
+        from app.models.transaction import ResumoMensal
+        return saldos_contas.obter(db.session, ResumoMensal, self)
+    
+    @staticmethod
+    def carregar_saldos(contas):
+        """Calcula os totais de várias contas em uma única consulta (ver saldos_contas)"""
+        from app.models.transaction import ResumoMensal
+        return saldos_contas.carregar(ResumoMensal, contas)
+    
+    def saldo_em(self, data):
+        """Saldo da conta ao fim do dia `data` (ver saldos_contas)"""
+        from app.models.transaction import ResumoMensal, Transacao
+        return saldos_contas.saldo_em(db.session, ResumoMensal, Transacao, self, data)
+    
+    def saldos_diarios(self, inicio, fim):
+        """Lista de (dia, saldo) de cada dia do período, inclusive (ver saldos_contas)"""
+        from app.models.transaction import ResumoMensal, Transacao
+        return saldos_contas.serie_diaria(db.session, ResumoMensal, Transacao, self, inicio, fim)
     
     @classmethod
     def get_contas_ativas(cls, user_id):
@@ -60,5 +84,5 @@ class Conta(db.Model):
             'total_despesas': self.total_despesas,
             'cor': self.cor,
             'ativa': self.ativa,
-            'transacoes_count': len(self.transacoes)
+            'transacoes_count': self.total_transacoes
         }
@@ -3,6 +3,7 @@ Modelo de categorias para classificação de transações
 """
 from app import db
 from sqlalchemy import func
+import hierarquia_categorias
 
 class Categoria(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -43,15 +44,24 @@ class Categoria(db.Model):
         return len(self.subcategorias) > 0
     
     def get_all_subcategorias(self, include_self=True):
-        """Retorna todas as subcategorias recursivamente"""
-        result = []
-        if include_self:
-            result.append(self)
-        
-        for subcategoria in self.subcategorias:
-            result.extend(subcategoria.get_all_subcategorias(include_self=True))
-        
-        return result
+        """Retorna todas as subcategorias (em qualquer nível) em uma única consulta"""
+        query = Categoria.query.join(
+            CategoriaHierarquia, CategoriaHierarquia.descendente_id == Categoria.id
+        ).filter(CategoriaHierarquia.ancestral_id == self.id)
+        if not include_self:
+            query = query.filter(CategoriaHierarquia.profundidade > 0)
+        return query.order_by(CategoriaHierarquia.profundidade, Categoria.nome).all()
+    
+    @staticmethod
+    def ids_com_descendentes(categoria_id, include_self=True):
+        """
+        Subconsulta com os IDs da categoria e de todas as suas subcategorias, para
+        filtros como Transacao.categoria_id.in_(Categoria.ids_com_descendentes(id))
+        """
+        query = db.select(CategoriaHierarquia.descendente_id).where(CategoriaHierarquia.ancestral_id == categoria_id)
+        if not include_self:
+            query = query.where(CategoriaHierarquia.profundidade > 0)
+        return query
     
     @classmethod
     def get_categorias_raiz(cls, user_id):
@@ -107,3 +117,16 @@ class Categoria(db.Model):
             'nome_completo': self.nome_completo,
             'subcategorias': [sub.to_dict_hierarquico() for sub in self.subcategorias]
         }
+
+
+class CategoriaHierarquia(db.Model):
+    """Tabela de fechamento da hierarquia de categorias: um par (ancestral, descendente) por linha"""
+    __tablename__ = 'categoria_hierarquia'
+    
+    ancestral_id = db.Column(db.Integer, db.ForeignKey('categoria.id'), primary_key=True)
+    descendente_id = db.Column(db.Integer, db.ForeignKey('categoria.id'), primary_key=True, index=True)
+    profundidade = db.Column(db.Integer, nullable=False)  # 0 = a própria categoria
+
+
+# Mantida em dia a cada inclusão, mudança de pai ou exclusão de categoria
+hierarquia_categorias.registrar(Categoria, CategoriaHierarquia.__table__)
@@ -5,13 +5,25 @@ from datetime import datetime
 from app import db
 from app.models.enums import TipoTransacao
 from app.models.tag import transacao_tags
+from app.models.account import Conta
+import resumo_mensal
+import normalizacao_descricao
+import saldos_contas
 
 class Transacao(db.Model):
+    __table_args__ = (
+        db.Index('ix_transacao_user_ano_mes', 'user_id', 'ano_mes'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     descricao = db.Column(db.String(200), nullable=False)
+    # Descrição sem sufixo de parcela, em minúsculas; chave de agrupamento dos relatórios
+    descricao_normalizada = db.Column(db.String(200), index=True)
     valor = db.Column(db.Float, nullable=False)
     tipo = db.Column(db.Enum(TipoTransacao), nullable=False)
     data_transacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Mês de data_transacao (AAAAMM), gravado junto com ela; filtros e agrupamentos por mês/ano
+    ano_mes = db.Column(db.Integer)
     data_criacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     # Chaves estrangeiras
@@ -82,3 +94,29 @@ class Transacao(db.Model):
             'tags': self.tags_nomes,
             'tags_string': self.tags_string
         }
+
+
+class ResumoMensal(db.Model):
+    """Soma e quantidade das transações por usuário, conta, categoria, mês e tipo (ver resumo_mensal)"""
+    __tablename__ = 'resumo_mensal'
+    __table_args__ = (
+        db.Index('ix_resumo_mensal_user_ano_mes', 'user_id', 'ano_mes'),
+    )
+    
+    # Tabela derivada de transacao: sem chaves estrangeiras, reconstruível a qualquer momento
+    user_id = db.Column(db.Integer, primary_key=True)
+    conta_id = db.Column(db.Integer, primary_key=True)
+    categoria_id = db.Column(db.Integer, primary_key=True)
+    ano_mes = db.Column(db.Integer, primary_key=True)  # AAAAMM
+    tipo = db.Column(db.Enum(TipoTransacao), primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Mantido em dia a cada inclusão, alteração ou exclusão de transação
+resumo_mensal.registrar(Transacao, ResumoMensal.__table__)
+resumo_mensal.registrar_ano_mes(Transacao)
+# Totais das contas guardados na instância até a próxima escrita de transação da conta
+saldos_contas.registrar(Conta, Transacao)
+# Descrição normalizada calculada uma vez, na gravação
+normalizacao_descricao.registrar(Transacao)
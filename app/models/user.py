@@ -51,6 +51,9 @@ class Usuario(UserMixin, db.Model):
     failed_login_attempts = db.Column(db.Integer, default=0)
     locked_until = db.Column(db.DateTime)
     
+    # Incrementada a cada escrita de transação, recorrência, categoria ou conta (ver cache_relatorios)
+    dados_versao = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relacionamentos com as entidades do usuário
     transacoes = db.relationship('Transacao', backref='usuario', lazy=True, cascade='all, delete-orphan')
     categorias = db.relationship('Categoria', backref='usuario', lazy=True, cascade='all, delete-orphan')
@@ -99,6 +99,19 @@ class ContaService:
         resultado = db.session.query(db.func.sum(Conta.saldo)).filter(Conta.user_id == user_id).scalar()
         return resultado or 0
     
+    @staticmethod
+    def obter_saldos_diarios(conta_id, user_id, inicio, fim):
+        """
+        Saldo da conta ao fim de cada dia do período (inclusive), a partir do
+        saldo no início do mês de `inicio` e das transações desde então,
+        sem percorrer todo o histórico da conta.
+        Retorna uma lista de (dia, saldo), ou None se a conta não existir.
+        """
+        conta = ContaService.obter_conta_por_id(conta_id, user_id)
+        if not conta:
+            return None
+        return conta.saldos_diarios(inicio, fim)
+    
     @staticmethod
     def recalcular_saldo(conta_id, user_id):
         """
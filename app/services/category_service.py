@@ -2,7 +2,7 @@
 Criação de serviços para separar a lógica de negócios da camada de apresentação
 """
 from app import db
-from app.models.category import Categoria
+from app.models.category import Categoria, CategoriaHierarquia
 
 class CategoriaService:
     """
@@ -87,13 +87,9 @@ class CategoriaService:
             return False
         
         # Verifica se o novo pai seria um dos descendentes
-        pai_atual = Categoria.query.get(novo_pai_id)
-        while pai_atual:
-            if pai_atual.id == categoria.id:
-                return False
-            pai_atual = pai_atual.categoria_pai
-        
-        return True
+        return not CategoriaHierarquia.query.filter_by(
+            ancestral_id=categoria.id, descendente_id=novo_pai_id
+        ).first()
     
     @staticmethod
     def criar_categorias_padrao(user_id):
@@ -3,14 +3,14 @@ Serviço para gerenciamento do dashboard e relatórios
 """
 from datetime import datetime, date, timedelta
 from calendar import monthrange
-from dateutil.relativedelta import relativedelta
 from sqlalchemy import extract, func, and_, or_
 from app import db
-from app.models.transaction import Transacao
+from app.models.transaction import Transacao, ResumoMensal
 from app.models.category import Categoria
 from app.models.account import Conta
 from app.models.tag import Tag
 from app.models.enums import TipoTransacao
+import resumo_dashboard
 
 class DashboardService:
     """
@@ -55,20 +55,9 @@ class DashboardService:
         # Saldo total em todas as contas
         saldo_total = db.session.query(func.sum(Conta.saldo)).filter(Conta.user_id == user_id).scalar() or 0
         
-        # Total de receitas e despesas do mês
-        receitas_mes = db.session.query(func.sum(Transacao.valor)).filter(
-            Transacao.user_id == user_id,
-            Transacao.tipo == TipoTransacao.RECEITA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.data_transacao <= fim_mes
-        ).scalar() or 0
-        
-        despesas_mes = db.session.query(func.sum(Transacao.valor)).filter(
-            Transacao.user_id == user_id,
-            Transacao.tipo == TipoTransacao.DESPESA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.data_transacao <= fim_mes
-        ).scalar() or 0
+        # Total de receitas e despesas do mês (resumo mensal, uma única consulta)
+        totais = resumo_dashboard.totais(db.session, ResumoMensal, user_id, ano * 100 + mes)
+        receitas_mes, despesas_mes = totais['receitas_mes'], totais['despesas_mes']
         
         # Lista de contas com saldos
         contas = Conta.query.filter_by(user_id=user_id).all()
@@ -77,18 +66,17 @@ class DashboardService:
         categorias_despesas = db.session.query(
             Categoria.nome,
             Categoria.cor,
-            func.sum(Transacao.valor).label('total')
+            func.sum(ResumoMensal.total).label('total')
         ).join(
-            Transacao, Transacao.categoria_id == Categoria.id
+            ResumoMensal, ResumoMensal.categoria_id == Categoria.id
         ).filter(
-            Transacao.user_id == user_id,
-            Transacao.tipo == TipoTransacao.DESPESA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.data_transacao <= fim_mes
+            ResumoMensal.user_id == user_id,
+            ResumoMensal.tipo == TipoTransacao.DESPESA,
+            ResumoMensal.ano_mes == ano * 100 + mes
         ).group_by(
             Categoria.id
         ).order_by(
-            func.sum(Transacao.valor).desc()
+            func.sum(ResumoMensal.total).desc()
         ).limit(5).all()
         
         # Dados para gráfico de evolução diária
@@ -98,42 +86,14 @@ class DashboardService:
             if data <= hoje:  # Só considera até a data atual
                 dias_mes.append(data)
         
-        # Receitas diárias
-        receitas_diarias = db.session.query(
-            extract('day', Transacao.data_transacao).label('dia'),
-            func.sum(Transacao.valor).label('total')
-        ).filter(
-            Transacao.user_id == user_id,
-            Transacao.tipo == TipoTransacao.RECEITA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.data_transacao <= fim_mes
-        ).group_by(
-            'dia'
-        ).all()
-        
-        receitas_por_dia = {int(d.dia): float(d.total) for d in receitas_diarias}
-        
-        # Despesas diárias
-        despesas_diarias = db.session.query(
-            extract('day', Transacao.data_transacao).label('dia'),
-            func.sum(Transacao.valor).label('total')
-        ).filter(
-            Transacao.user_id == user_id,
-            Transacao.tipo == TipoTransacao.DESPESA,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.data_transacao <= fim_mes
-        ).group_by(
-            'dia'
-        ).all()
-        
-        despesas_por_dia = {int(d.dia): float(d.total) for d in despesas_diarias}
+        # Receitas e despesas diárias (uma única consulta agrupada por dia)
+        por_dia = resumo_dashboard.serie_diaria(db.session, Transacao, user_id, inicio_mes, fim_mes)
         
         # Monta dados do gráfico de evolução
         evolucao_diaria = []
         for dia in range(1, ultimo_dia.day + 1):
             if date(ano, mes, dia) <= hoje:  # Só considera até a data atual
-                receita_dia = receitas_por_dia.get(dia, 0)
-                despesa_dia = despesas_por_dia.get(dia, 0)
+                receita_dia, despesa_dia = por_dia.get(dia, (0, 0))
                 evolucao_diaria.append({
                     'dia': dia,
                     'receitas': receita_dia,
@@ -169,7 +129,8 @@ class DashboardService:
         
         Parâmetros:
         - user_id: ID do usuário
-        - meses: Número de meses para comparar (padrão: 6)
+        - meses: Número de meses para comparar (padrão: 6); pode cobrir vários anos,
+          com uma única consulta ao banco
         
         Retorna um dicionário com:
         - labels: Lista de rótulos dos meses (ex: "Jan/2023")
@@ -178,43 +139,16 @@ class DashboardService:
         - saldos: Lista com saldos mensais (receitas - despesas)
         """
         hoje = datetime.utcnow().date()
-        dados_meses = []
         
-        # Gera a lista de meses para análise, do mais antigo para o mais recente
-        for i in range(meses-1, -1, -1):
-            data_mes = hoje.replace(day=1) - relativedelta(months=i)
-            
-            # Primeiro e último dia do mês
-            primeiro_dia = date(data_mes.year, data_mes.month, 1)
-            ultimo_dia = date(data_mes.year, data_mes.month, monthrange(data_mes.year, data_mes.month)[1])
-            
-            # Converte para datetime
-            inicio_mes = datetime.combine(primeiro_dia, datetime.min.time())
-            fim_mes = datetime.combine(ultimo_dia, datetime.max.time())
-            
-            # Total de receitas do mês
-            receitas = db.session.query(func.sum(Transacao.valor)).filter(
-                Transacao.user_id == user_id,
-                Transacao.tipo == TipoTransacao.RECEITA,
-                Transacao.data_transacao >= inicio_mes,
-                Transacao.data_transacao <= fim_mes
-            ).scalar() or 0
-            
-            # Total de despesas do mês
-            despesas = db.session.query(func.sum(Transacao.valor)).filter(
-                Transacao.user_id == user_id,
-                Transacao.tipo == TipoTransacao.DESPESA,
-                Transacao.data_transacao >= inicio_mes,
-                Transacao.data_transacao <= fim_mes
-            ).scalar() or 0
-            
-            # Adiciona aos dados
-            dados_meses.append({
-                'mes': data_mes.strftime('%b/%Y'),
-                'receitas': float(receitas),
-                'despesas': float(despesas),
-                'saldo': float(receitas - despesas)
-            })
+        # Totais de todos os meses em uma única consulta ao resumo mensal, do mais
+        # antigo para o mais recente, com os meses sem lançamentos zerados
+        dados_meses = [{
+            'mes': data_mes.strftime('%b/%Y'),
+            'receitas': receitas,
+            'despesas': despesas,
+            'saldo': receitas - despesas
+        } for data_mes, receitas, despesas in resumo_dashboard.totais_mensais(
+            db.session, ResumoMensal, user_id, hoje, meses)]
         
         # Formata os dados para retorno
         return {
@@ -249,31 +183,23 @@ class DashboardService:
             ano = hoje.year
         if mes is None:
             mes = hoje.month
-            
-        primeiro_dia = date(ano, mes, 1)
-        ultimo_dia = date(ano, mes, monthrange(ano, mes)[1])
-        
-        # Converte para datetime
-        inicio_mes = datetime.combine(primeiro_dia, datetime.min.time())
-        fim_mes = datetime.combine(ultimo_dia, datetime.max.time())
         
-        # Total por categoria
+        # Total por categoria (resumo mensal)
         categorias = db.session.query(
             Categoria.id,
             Categoria.nome,
             Categoria.cor,
-            func.sum(Transacao.valor).label('total')
+            func.sum(ResumoMensal.total).label('total')
         ).join(
-            Transacao, Transacao.categoria_id == Categoria.id
+            ResumoMensal, ResumoMensal.categoria_id == Categoria.id
         ).filter(
-            Transacao.user_id == user_id,
-            Transacao.tipo == tipo,
-            Transacao.data_transacao >= inicio_mes,
-            Transacao.data_transacao <= fim_mes
+            ResumoMensal.user_id == user_id,
+            ResumoMensal.tipo == tipo,
+            ResumoMensal.ano_mes == ano * 100 + mes
         ).group_by(
             Categoria.id
         ).order_by(
-            func.sum(Transacao.valor).desc()
+            func.sum(ResumoMensal.total).desc()
         ).all()
         
         # Calcula o total geral
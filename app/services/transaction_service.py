@@ -93,12 +93,8 @@ class TransacaoService:
                 query = query.filter(Transacao.tipo == tipo)
             
             if 'categoria_id' in filtros and filtros['categoria_id']:
-                # Inclui subcategorias se uma categoria pai for selecionada
-                categoria_ids = [filtros['categoria_id']]
-                categoria = Categoria.query.get(filtros['categoria_id'])
-                if categoria and categoria.subcategorias:
-                    categoria_ids.extend([c.id for c in categoria.subcategorias])
-                query = query.filter(Transacao.categoria_id.in_(categoria_ids))
+                # Inclui as subcategorias (em qualquer nível) se uma categoria pai for selecionada
+                query = query.filter(Transacao.categoria_id.in_(Categoria.ids_com_descendentes(filtros['categoria_id'])))
             
             if 'conta_id' in filtros and filtros['conta_id']:
                 query = query.filter(Transacao.conta_id == filtros['conta_id'])
@@ -189,16 +185,14 @@ class TransacaoService:
         receitas = db.session.query(func.sum(Transacao.valor)).filter(
             Transacao.user_id == user_id,
             Transacao.tipo == TipoTransacao.RECEITA,
-            extract('year', Transacao.data_transacao) == ano,
-            extract('month', Transacao.data_transacao) == mes
+            Transacao.ano_mes == ano * 100 + mes
         ).scalar() or 0
         
         # Total de despesas
         despesas = db.session.query(func.sum(Transacao.valor)).filter(
             Transacao.user_id == user_id,
             Transacao.tipo == TipoTransacao.DESPESA,
-            extract('year', Transacao.data_transacao) == ano,
-            extract('month', Transacao.data_transacao) == mes
+            Transacao.ano_mes == ano * 100 + mes
         ).scalar() or 0
         
         # Transações por categoria (para gráficos)
@@ -211,8 +205,7 @@ class TransacaoService:
         ).filter(
             Transacao.user_id == user_id,
             Transacao.tipo == TipoTransacao.RECEITA,
-            extract('year', Transacao.data_transacao) == ano,
-            extract('month', Transacao.data_transacao) == mes
+            Transacao.ano_mes == ano * 100 + mes
         ).group_by(
             Categoria.nome, Categoria.cor
         ).all()
@@ -226,8 +219,7 @@ class TransacaoService:
         ).filter(
             Transacao.user_id == user_id,
             Transacao.tipo == TipoTransacao.DESPESA,
-            extract('year', Transacao.data_transacao) == ano,
-            extract('month', Transacao.data_transacao) == mes
+            Transacao.ano_mes == ano * 100 + mes
         ).group_by(
             Categoria.nome, Categoria.cor
         ).all()
@@ -239,8 +231,7 @@ class TransacaoService:
         ).filter(
             Transacao.user_id == user_id,
             Transacao.tipo == TipoTransacao.RECEITA,
-            extract('year', Transacao.data_transacao) == ano,
-            extract('month', Transacao.data_transacao) == mes
+            Transacao.ano_mes == ano * 100 + mes
         ).group_by(
             'dia'
         ).all()
@@ -251,8 +242,7 @@ class TransacaoService:
         ).filter(
             Transacao.user_id == user_id,
             Transacao.tipo == TipoTransacao.DESPESA,
-            extract('year', Transacao.data_transacao) == ano,
-            extract('month', Transacao.data_transacao) == mes
+            Transacao.ano_mes == ano * 100 + mes
         ).group_by(
             'dia'
         ).all()
@@ -0,0 +1,140 @@
+"""
+Cache, por processo, dos relatórios já calculados.
+
+Cada usuário tem uma versão dos dados (`usuario.dados_versao`) incrementada em
+toda escrita de transação, recorrência, categoria ou conta dele. A versão faz
+parte da chave do cache junto com os filtros do relatório, então uma escrita
+invalida de uma vez todos os relatórios do usuário e nenhuma entrada precisa
+ser apagada: as antigas deixam de ser consultadas e saem pela política LRU.
+
+A versão é incrementada uma única vez por flush (evento after_flush da
+sessão), com um UPDATE por flush para os usuários afetados. Escritas que não
+passam pelo ORM devem chamar `incrementar_versoes` na mesma transação.
+
+Funções registradas com `ao_confirmar_alteracoes` são chamadas depois do
+commit com os usuários cujos dados mudaram (ex: para pré-calcular os
+relatórios padrão deles, ver precalculo_relatorios).
+"""
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+_ALTERADOS = 'cache_relatorios.usuarios_alterados'
+_A_CONFIRMAR = 'cache_relatorios.usuarios_a_confirmar'
+
+_ouvintes = []
+
+
+def ao_confirmar_alteracoes(funcao):
+    """Registra `funcao(user_ids)`, chamada após o commit de escritas nos dados desses usuários"""
+    _ouvintes.append(funcao)
+    return funcao
+
+
+def incrementar_versoes(conn, tabela_usuario, user_ids, sessao=None):
+    """
+    Incrementa a versão dos dados desses usuários (um único UPDATE).
+
+    Args:
+        sessao: sessão da transação em curso; com ela, os ouvintes de
+            `ao_confirmar_alteracoes` são avisados após o commit
+    """
+    user_ids = sorted(u for u in set(user_ids) if u is not None)
+    if user_ids:
+        conn.execute(
+            tabela_usuario.update()
+            .where(tabela_usuario.c.id.in_(user_ids))
+            .values(dados_versao=func.coalesce(tabela_usuario.c.dados_versao, 0) + 1)
+        )
+        if sessao is not None:
+            sessao.info.setdefault(_A_CONFIRMAR, set()).update(user_ids)
+
+
+def registrar_versao(tabela_usuario, *modelos):
+    """
+    Incrementa `dados_versao` em `tabela_usuario` a cada inclusão, alteração ou
+    exclusão de instâncias de `modelos` (todos com a coluna user_id).
+    """
+
+    def _alterado(mapper, conn, alvo):
+        sessao = object_session(alvo)
+        if sessao is not None:
+            sessao.info.setdefault(_ALTERADOS, set()).add(alvo.user_id)
+
+    for modelo in modelos:
+        for evento in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(modelo, evento, _alterado)
+
+    @event.listens_for(Session, 'after_flush')
+    def _incrementar_versoes(sessao, contexto):
+        user_ids = sessao.info.pop(_ALTERADOS, None)
+        if user_ids:
+            incrementar_versoes(sessao.connection(), tabela_usuario, user_ids, sessao)
+
+    @event.listens_for(Session, 'after_commit')
+    def _avisar_ouvintes(sessao):
+        user_ids = sessao.info.pop(_A_CONFIRMAR, None)
+        if user_ids:
+            for ouvinte in _ouvintes:
+                ouvinte(user_ids)
+
+    @event.listens_for(Session, 'after_rollback')
+    def _descartar_alterados(sessao):
+        sessao.info.pop(_A_CONFIRMAR, None)
+
+
+class CacheRelatorios:
+    """
+    Cache LRU limitado dos dados calculados de relatórios, um por processo (worker).
+
+    Attributes:
+        tamanho (int): número máximo de entradas; 0 desliga o cache
+    """
+
+    def __init__(self, tamanho=64):
+        self.tamanho = tamanho
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self.acertos = 0
+        self.faltas = 0
+
+    def init_app(self, app):
+        """Lê CACHE_RELATORIOS_TAMANHO da configuração da aplicação"""
+        app.config.setdefault('CACHE_RELATORIOS_TAMANHO', 64)
+        self.tamanho = int(app.config['CACHE_RELATORIOS_TAMANHO'])
+        app.extensions['cache_relatorios'] = self
+
+    def obter(self, chave):
+        """Dados guardados para `chave`, ou None"""
+        with self._lock:
+            valor = self._entradas.get(chave)
+            if valor is None:
+                self.faltas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, chave, valor):
+        if self.tamanho <= 0:
+            return valor
+        with self._lock:
+            self._entradas[chave] = valor
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho:
+                self._entradas.popitem(last=False)
+        return valor
+
+    def resumo(self):
+        with self._lock:
+            return {'tamanho': self.tamanho, 'entradas': len(self._entradas),
+                    'acertos': self.acertos, 'faltas': self.faltas}
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+
+cache_relatorios = CacheRelatorios()
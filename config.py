@@ -45,6 +45,16 @@ class Config:
     TRANSACOES_PER_PAGE_DEFAULT = 20
     TRANSACOES_PER_PAGE_MAX = 100
     
+    # Rastreio amostrado da geração de recorrências (desligado por padrão)
+    RASTREIO_RECORRENCIAS = os.environ.get('RASTREIO_RECORRENCIAS', 'False').lower() in ['true', 'on', '1']
+    RASTREIO_RECORRENCIAS_TAXA = float(os.environ.get('RASTREIO_RECORRENCIAS_TAXA', '1.0'))
+    
+    # Relatórios calculados guardados em memória por worker (0 desliga o cache)
+    CACHE_RELATORIOS_TAMANHO = int(os.environ.get('CACHE_RELATORIOS_TAMANHO', '64'))
+    # Pré-cálculo do relatório padrão após escritas, depois de N segundos sem novas escritas
+    PRECALCULO_RELATORIOS = os.environ.get('PRECALCULO_RELATORIOS', 'True').lower() in ['true', 'on', '1']
+    PRECALCULO_RELATORIOS_ESPERA = float(os.environ.get('PRECALCULO_RELATORIOS_ESPERA', '5'))
+    
     # Configurações do Google OAuth
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID', None)
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', None)
@@ -0,0 +1,121 @@
+"""
+Exportação de relatórios e listas de transações em CSV e XLSX.
+
+As linhas são produzidas sob demanda (geradores) e o arquivo é enviado em
+partes: a consulta de transações é lida em lotes com `yield_per` (no
+PostgreSQL, por um cursor no servidor) e cada lote é escrito e enviado antes
+do próximo ser lido. Exportar vários anos de transações usa memória constante
+e o download do CSV começa imediatamente.
+
+O XLSX depende do openpyxl, que é opcional. A planilha é montada em modo
+write_only (as linhas vão para arquivos temporários, não para a memória), mas
+o formato só permite enviá-la depois de completa.
+"""
+import csv
+import io
+import tempfile
+
+from models import Transacao
+
+try:
+    from openpyxl import Workbook
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+# Transações lidas do banco por vez
+TAMANHO_LOTE = 1000
+# Linhas escritas por parte enviada do CSV
+LINHAS_POR_PARTE = 500
+TAMANHO_PARTE_XLSX = 64 * 1024
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+CABECALHO_TRANSACOES = ['Data', 'Descrição', 'Tipo', 'Categoria', 'Conta', 'Valor', 'Recorrente']
+
+
+def formatos_disponiveis():
+    """Formatos de exportação suportados neste ambiente"""
+    return [f for f in FORMATOS if f != 'xlsx' or HAS_OPENPYXL]
+
+
+def csv_em_partes(cabecalho, linhas):
+    """Gera o CSV em partes de LINHAS_POR_PARTE linhas (com BOM, para o Excel reconhecer UTF-8)"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('\ufeff')
+    escritor.writerow(cabecalho)
+    for n, linha in enumerate(linhas, 1):
+        escritor.writerow(linha)
+        if n % LINHAS_POR_PARTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_em_partes(cabecalho, linhas, titulo='Dados'):
+    """Gera o XLSX (openpyxl em modo write_only) e o devolve em partes"""
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet(titulo)
+    aba.append(cabecalho)
+    for linha in linhas:
+        aba.append(linha)
+    with tempfile.TemporaryFile() as arquivo:
+        planilha.save(arquivo)
+        arquivo.seek(0)
+        while True:
+            parte = arquivo.read(TAMANHO_PARTE_XLSX)
+            if not parte:
+                break
+            yield parte
+
+
+def exportar(formato, cabecalho, linhas, titulo='Dados'):
+    """
+    Conteúdo do arquivo exportado, em partes.
+
+    Returns:
+        (gerador das partes, mimetype, extensão do arquivo)
+
+    Raises:
+        ValueError: formato desconhecido ou indisponível (xlsx sem openpyxl)
+    """
+    if formato not in formatos_disponiveis():
+        raise ValueError(f'Formato de exportação indisponível: {formato}')
+    mimetype, extensao = FORMATOS[formato]
+    if formato == 'xlsx':
+        return xlsx_em_partes(cabecalho, linhas, titulo), mimetype, extensao
+    return csv_em_partes(cabecalho, linhas), mimetype, extensao
+
+
+def linhas_transacoes(query, nomes_categorias, nomes_contas):
+    """
+    Linhas de exportação das transações de `query` (Query de Transacao já filtrada),
+    lidas do banco em lotes de TAMANHO_LOTE, em ordem de data.
+
+    Args:
+        nomes_categorias (dict): id da categoria -> nome exibido
+        nomes_contas (dict): id da conta -> nome
+    """
+    colunas = query.with_entities(
+        Transacao.data_transacao, Transacao.descricao, Transacao.tipo, Transacao.categoria_id,
+        Transacao.conta_id, Transacao.valor, Transacao.recorrencia_id
+    ).order_by(Transacao.data_transacao, Transacao.id).yield_per(TAMANHO_LOTE)
+    for data, descricao, tipo, categoria_id, conta_id, valor, recorrencia_id in colunas:
+        yield (data.date(), descricao, tipo.value, nomes_categorias.get(categoria_id, ''),
+               nomes_contas.get(conta_id, ''), round(valor, 2), 'Sim' if recorrencia_id else 'Não')
+
+
+def linhas_relatorio(dados):
+    """Linhas de exportação do quadro do relatório (uma por descrição, valores por mês)"""
+    for g in dados['transacoes_linhas']:
+        yield ([g['descricao'], g['categoria_raiz'], g['subcategoria'], g['tipo'], 'Sim' if g['is_projetada'] else 'Não']
+               + [round(g['monthly'].get(m, 0), 2) for m in dados['meses']] + [round(g['total'], 2)])
+
+
+def cabecalho_relatorio(dados):
+    return ['Descrição', 'Categoria', 'Subcategoria', 'Tipo', 'Projetada'] + list(dados['meses']) + ['Total']
@@ -0,0 +1,103 @@
+"""
+Tabela de fechamento (closure table) da hierarquia de categorias.
+
+Para cada par (ancestral, descendente) da árvore de categorias, inclusive o par
+da categoria com ela mesma (profundidade 0), a tabela guarda uma linha com a
+distância entre os dois. "Categoria e todas as suas subcategorias" passa a ser
+uma única consulta indexada por ancestral_id, em vez de uma consulta por nó
+da árvore.
+
+A tabela é mantida pelos eventos do mapeador da Categoria (inclusão, troca de
+categoria pai e exclusão), então qualquer escrita feita pelo ORM a mantém em
+dia. Atualizações em massa (query.update) não disparam esses eventos; depois
+delas use `reconstruir`.
+"""
+from sqlalchemy import event, inspect, literal, select
+
+
+def calcular_pares(categorias):
+    """
+    Calcula o fechamento a partir dos pares (id, parent_id) de todas as categorias.
+
+    Yields:
+        (ancestral_id, descendente_id, profundidade)
+    """
+    pais = dict(categorias)
+    for categoria_id in pais:
+        atual, profundidade, vistos = categoria_id, 0, set()
+        while atual is not None and atual not in vistos:
+            yield atual, categoria_id, profundidade
+            vistos.add(atual)
+            atual = pais.get(atual)
+            profundidade += 1
+
+
+def inserir(conn, tabela, categoria_id, parent_id):
+    """Liga uma categoria nova a si mesma e a todos os ancestrais de `parent_id`"""
+    conn.execute(tabela.insert().values(ancestral_id=categoria_id, descendente_id=categoria_id, profundidade=0))
+    if parent_id is not None:
+        conn.execute(tabela.insert().from_select(
+            ['ancestral_id', 'descendente_id', 'profundidade'],
+            select(tabela.c.ancestral_id, literal(categoria_id), tabela.c.profundidade + 1)
+            .where(tabela.c.descendente_id == parent_id)
+        ))
+
+
+def mover(conn, tabela, categoria_id, novo_parent_id):
+    """Move a subárvore de `categoria_id` para baixo de `novo_parent_id` (ou para a raiz)"""
+    subarvore = select(tabela.c.descendente_id).where(tabela.c.ancestral_id == categoria_id)
+    # Desligar a subárvore dos ancestrais antigos, mantendo os vínculos internos
+    conn.execute(tabela.delete().where(
+        tabela.c.descendente_id.in_(subarvore),
+        tabela.c.ancestral_id.not_in(subarvore)
+    ))
+    if novo_parent_id is not None:
+        # Ligar cada ancestral do novo pai a cada nó da subárvore
+        acima = tabela.alias('acima')
+        abaixo = tabela.alias('abaixo')
+        conn.execute(tabela.insert().from_select(
+            ['ancestral_id', 'descendente_id', 'profundidade'],
+            select(acima.c.ancestral_id, abaixo.c.descendente_id, acima.c.profundidade + abaixo.c.profundidade + 1)
+            .select_from(acima.join(abaixo, abaixo.c.ancestral_id == categoria_id))
+            .where(acima.c.descendente_id == novo_parent_id)
+        ))
+
+
+def remover(conn, tabela, categoria_id):
+    """Remove todos os vínculos de uma categoria que será excluída"""
+    conn.execute(tabela.delete().where(
+        (tabela.c.ancestral_id == categoria_id) | (tabela.c.descendente_id == categoria_id)
+    ))
+
+
+def reconstruir(conn, tabela, categorias):
+    """Recria a tabela inteira a partir dos pares (id, parent_id) de todas as categorias"""
+    conn.execute(tabela.delete())
+    linhas = [{'ancestral_id': a, 'descendente_id': d, 'profundidade': p} for a, d, p in calcular_pares(categorias)]
+    if linhas:
+        conn.execute(tabela.insert(), linhas)
+    return len(linhas)
+
+
+def registrar(modelo, tabela):
+    """Mantém `tabela` em dia com as inclusões, mudanças de pai e exclusões de `modelo`"""
+
+    @event.listens_for(modelo, 'after_insert')
+    def _categoria_incluida(mapper, conn, categoria):
+        inserir(conn, tabela, categoria.id, categoria.parent_id)
+
+    @event.listens_for(modelo, 'after_update')
+    def _categoria_alterada(mapper, conn, categoria):
+        estado = inspect(categoria)
+        if not (estado.attrs.parent_id.history.has_changes() or estado.attrs.parent.history.has_changes()):
+            return
+        pai_atual = conn.execute(
+            select(tabela.c.ancestral_id)
+            .where(tabela.c.descendente_id == categoria.id, tabela.c.profundidade == 1)
+        ).scalar()
+        if pai_atual != categoria.parent_id:
+            mover(conn, tabela, categoria.id, categoria.parent_id)
+
+    @event.listens_for(modelo, 'before_delete')
+    def _categoria_excluida(mapper, conn, categoria):
+        remover(conn, tabela, categoria.id)
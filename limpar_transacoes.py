@@ -4,7 +4,7 @@ Script para apagar todas as transações do sistema
 """
 
 from app import app, db
-from models import Transacao, TransacaoRecorrente
+from models import Transacao, TransacaoRecorrente, ResumoMensal, Usuario
 
 def limpar_transacoes():
     with app.app_context():
@@ -31,6 +31,8 @@ def limpar_transacoes():
             # Deletar todas as transações normais
             if total_transacoes > 0:
                 Transacao.query.delete()
+                ResumoMensal.query.delete()
+                Usuario.query.update({Usuario.dados_versao: Usuario.dados_versao + 1})
                 db.session.commit()
                 print('✅ Transações normais removidas')
             
@@ -33,7 +33,7 @@ with app.app_context():
     print('\n==== SOMAS POR CATEGORIA (TOTAL ANUAL) ====')
     categorias = Categoria.query.all()
     for c in categorias:
-        total = Transacao.query.filter(Transacao.categoria_id == c.id, func.strftime('%Y', Transacao.data_transacao) == str(YEAR)).with_entities(func.sum(Transacao.valor)).scalar() or 0
+        total = Transacao.query.filter(Transacao.categoria_id == c.id, Transacao.ano_mes.between(YEAR * 100 + 1, YEAR * 100 + 12)).with_entities(func.sum(Transacao.valor)).scalar() or 0
         if float(total) != 0:
             print(f"Categoria {c.id} - {c.nome_completo}: {float(total):.2f}")
 
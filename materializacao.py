@@ -0,0 +1,146 @@
+"""
+Fila de materialização de transações recorrentes.
+
+Gerar as transações reais de uma recorrência grava no banco (uma linha por
+ocorrência vencida), então isso não deve acontecer dentro de uma requisição de
+leitura. As recorrências a materializar são enfileiradas quando uma recorrência
+é criada, editada ou reativada e, para que ocorrências que vencem sem nenhuma
+edição também sejam gravadas, na primeira requisição do dia de cada usuário
+(`enfileirar_do_dia`). Uma única thread de trabalho processa a fila com seu
+próprio contexto de aplicação.
+
+Uma recorrência aparece no máximo uma vez na fila: enfileirar de novo um ID que
+ainda não foi processado não tem efeito. Com a configuração
+MATERIALIZACAO_SINCRONA (ou com TESTING) o processamento é feito na hora, na
+própria chamada a `enfileirar`.
+"""
+import queue
+import threading
+from datetime import date
+from models import db, TransacaoRecorrente, StatusRecorrencia
+
+
+class FilaMaterializacao:
+    """Fila em processo, sem duplicatas, de recorrências a materializar"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._fila = queue.Queue()
+        self._pendentes = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._dia = None
+        self._atendidos = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('MATERIALIZACAO_SINCRONA', False)
+        app.extensions['materializacao'] = self
+
+    @property
+    def sincrona(self):
+        return self.app.config.get('MATERIALIZACAO_SINCRONA') or self.app.testing
+
+    def enfileirar(self, recorrencia_id):
+        """
+        Agenda a materialização de uma recorrência.
+
+        Returns:
+            True se a recorrência entrou na fila (ou foi processada, no modo síncrono),
+            False se ela já estava aguardando processamento
+        """
+        if self.sincrona:
+            self.processar(recorrencia_id)
+            return True
+
+        with self._lock:
+            if recorrencia_id in self._pendentes:
+                return False
+            self._pendentes.add(recorrencia_id)
+            self._iniciar_thread()
+        self._fila.put(recorrencia_id)
+        return True
+
+    def enfileirar_varias(self, recorrencia_ids):
+        """Agenda várias recorrências; retorna quantas entraram na fila"""
+        return sum(1 for recorrencia_id in recorrencia_ids if self.enfileirar(recorrencia_id))
+
+    def enfileirar_do_dia(self, user_id, hoje=None):
+        """
+        Agenda as recorrências ativas do usuário na primeira chamada do dia para
+        ele; as chamadas seguintes no mesmo dia não fazem nada. O controle é por
+        processo: com vários workers, cada um agenda no máximo uma vez por dia, e
+        reprocessar uma recorrência já em dia não grava nada.
+
+        Returns:
+            Número de recorrências que entraram na fila
+        """
+        hoje = hoje or date.today()
+        with self._lock:
+            if self._dia != hoje:
+                self._dia = hoje
+                self._atendidos.clear()
+            if user_id in self._atendidos:
+                return 0
+            self._atendidos.add(user_id)
+        recorrencia_ids = db.session.execute(
+            db.select(TransacaoRecorrente.id).filter_by(user_id=user_id, status=StatusRecorrencia.ATIVA)
+        ).scalars().all()
+        return self.enfileirar_varias(recorrencia_ids)
+
+    def pendentes(self):
+        """Número de recorrências aguardando processamento"""
+        with self._lock:
+            return len(self._pendentes)
+
+    def aguardar(self):
+        """Bloqueia até que todas as recorrências enfileiradas tenham sido processadas"""
+        self._fila.join()
+
+    def processar(self, recorrencia_id):
+        """
+        Materializa as ocorrências vencidas de uma recorrência, em um contexto de
+        aplicação (e sessão) próprio.
+
+        Returns:
+            Número de transações gravadas
+        """
+        with self.app.app_context():
+            try:
+                recorrente = db.session.get(TransacaoRecorrente, recorrencia_id)
+                if recorrente is None:
+                    return 0
+                # Só as ocorrências até o fim do mês atual são gravadas; o restante é
+                # sempre projetado, então a iteração para na primeira projeção
+                gravadas = 0
+                for transacao in recorrente.iterar_transacoes_pendentes(meses_futuros=1):
+                    if getattr(transacao, 'is_projetada', False):
+                        break
+                    gravadas += 1
+                return gravadas
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _iniciar_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._trabalhar, name='materializacao', daemon=True)
+            self._thread.start()
+
+    def _trabalhar(self):
+        while True:
+            recorrencia_id = self._fila.get()
+            # Liberar o ID antes de processar: uma escrita que chegue durante o
+            # processamento volta a enfileirar a recorrência
+            with self._lock:
+                self._pendentes.discard(recorrencia_id)
+            try:
+                geradas = self.processar(recorrencia_id)
+                if geradas:
+                    self.app.logger.info('Recorrencia %s: %s transacao(oes) materializada(s)', recorrencia_id, geradas)
+            except Exception:
+                self.app.logger.exception('Erro ao materializar recorrencia %s', recorrencia_id)
+            finally:
+                self._fila.task_done()
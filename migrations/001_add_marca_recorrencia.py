@@ -0,0 +1,76 @@
+"""
+Migration: add the materialization watermark to TransacaoRecorrente.
+
+Adds `ultimo_indice_gerado` (INTEGER) and `ultima_data_gerada` (DATETIME/TIMESTAMP)
+to transacao_recorrente and backfills them from the transactions already
+generated by each recurrence: MAX(data_transacao) and the index of the period
+(month, for monthly-based schedules) that contains it. Rows written by the old
+code walked from the previous row and drifted at month ends (31/01 -> 28/02 ->
+28/03 -> 28/04); indexing by period keeps 28/04 as April's occurrence instead
+of mapping it back to 31/03, which would make the next run insert 30/04.
+
+Run with: python migrations/run_migration.py migrations/001_add_marca_recorrencia.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, bindparam, func, select, text
+from models import db, TipoRecorrencia
+import agenda_recorrencia
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'transacao_recorrente' not in meta.tables:
+        print('Table transacao_recorrente not found; nothing to do')
+        return
+
+    recorrente = meta.tables['transacao_recorrente']
+    tipo_data = 'DATETIME' if engine.dialect.name == 'sqlite' else 'TIMESTAMP'
+
+    with engine.begin() as conn:
+        if 'ultimo_indice_gerado' not in recorrente.c:
+            conn.execute(text('ALTER TABLE transacao_recorrente ADD COLUMN ultimo_indice_gerado INTEGER'))
+            print('Column ultimo_indice_gerado added to transacao_recorrente')
+        if 'ultima_data_gerada' not in recorrente.c:
+            conn.execute(text(f'ALTER TABLE transacao_recorrente ADD COLUMN ultima_data_gerada {tipo_data}'))
+            print('Column ultima_data_gerada added to transacao_recorrente')
+
+    backfill()
+
+
+def backfill():
+    """Fill the watermark of every recurrence from its generated transactions"""
+    # Core only: the ORM models already carry columns that later migrations add
+    # (e.g. usuario.dados_versao, bumped by the report cache on every flush)
+    meta = MetaData()
+    meta.reflect(bind=db.engine, only=['transacao', 'transacao_recorrente'])
+    transacao = meta.tables['transacao']
+    recorrente = meta.tables['transacao_recorrente']
+
+    ultima = func.max(transacao.c.data_transacao).label('ultima_data')
+    ultimas = select(transacao.c.recorrencia_id, ultima).where(
+        transacao.c.recorrencia_id.isnot(None)
+    ).group_by(transacao.c.recorrencia_id).subquery()
+
+    with db.engine.begin() as conn:
+        linhas = conn.execute(
+            select(recorrente.c.id, recorrente.c.tipo_recorrencia, recorrente.c.data_inicio, ultimas.c.ultima_data)
+            .join(ultimas, ultimas.c.recorrencia_id == recorrente.c.id)
+        ).all()
+        if linhas:
+            # The reflected Enum column yields the member name (e.g. 'MENSAL')
+            conn.execute(
+                recorrente.update()
+                .where(recorrente.c.id == bindparam('r'))
+                .values(ultima_data_gerada=bindparam('d'), ultimo_indice_gerado=bindparam('i')),
+                [{'r': recorrencia_id, 'd': ultima_data,
+                  'i': agenda_recorrencia.indice_do_periodo(TipoRecorrencia[tipo], data_inicio, ultima_data)}
+                 for recorrencia_id, tipo, data_inicio, ultima_data in linhas]
+            )
+    print(f'Watermark backfilled for {len(linhas)} recurrence(s)')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
@@ -0,0 +1,49 @@
+"""
+Migration: unique index on transacao (recorrencia_id, data_transacao).
+
+Guarantees that a recurrence materializes each occurrence at most once, so the
+bulk INSERT ... ON CONFLICT DO NOTHING (Postgres) / INSERT OR IGNORE (SQLite)
+used for generation and consolidation is idempotent under concurrent workers.
+
+Existing duplicates must be resolved before the index can be created; this
+script lists them and aborts instead of deleting user data.
+
+Run with: python migrations/run_migration.py migrations/002_unique_transacao_recorrencia_data.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, text
+from models import db
+
+INDEX_NAME = 'ix_transacao_recorrencia_data'
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'transacao' not in meta.tables:
+        print('Table transacao not found; nothing to do')
+        return
+
+    if any(index.name == INDEX_NAME for index in meta.tables['transacao'].indexes):
+        print(f'Index {INDEX_NAME} already exists')
+        return
+
+    with engine.begin() as conn:
+        duplicadas = conn.execute(text(
+            'SELECT recorrencia_id, data_transacao, COUNT(*) AS total FROM transacao '
+            'WHERE recorrencia_id IS NOT NULL '
+            'GROUP BY recorrencia_id, data_transacao HAVING COUNT(*) > 1'
+        )).all()
+        if duplicadas:
+            for recorrencia_id, data_transacao, total in duplicadas:
+                print(f'Duplicate: recorrencia_id={recorrencia_id} data_transacao={data_transacao} ({total} rows)')
+            raise RuntimeError(f'{len(duplicadas)} duplicated occurrence(s) found; remove the extra rows and run again')
+
+        conn.execute(text(f'CREATE UNIQUE INDEX {INDEX_NAME} ON transacao (recorrencia_id, data_transacao)'))
+    print(f'Index {INDEX_NAME} created on transacao')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
@@ -0,0 +1,42 @@
+"""
+Migration: closure table for the category hierarchy.
+
+Creates `categoria_hierarquia` (ancestral_id, descendente_id, profundidade),
+with one row per (ancestor, descendant) pair of the category tree, including
+each category paired with itself at depth 0, and fills it from the current
+categoria.parent_id values. From then on the table is kept in sync by the
+Categoria mapper events (see hierarquia_categorias.py).
+
+Running it again rebuilds the table from scratch, which also repairs it after
+bulk updates that bypass the ORM.
+
+Run with: python migrations/run_migration.py migrations/003_categoria_hierarquia.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, select
+from models import db, CategoriaHierarquia
+import hierarquia_categorias
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'categoria' not in meta.tables:
+        print('Table categoria not found; nothing to do')
+        return
+
+    if 'categoria_hierarquia' not in meta.tables:
+        CategoriaHierarquia.__table__.create(bind=engine)
+        print('Table categoria_hierarquia created')
+
+    categoria = meta.tables['categoria']
+    with engine.begin() as conn:
+        pares = conn.execute(select(categoria.c.id, categoria.c.parent_id)).all()
+        total = hierarquia_categorias.reconstruir(conn, CategoriaHierarquia.__table__, pares)
+    print(f'Closure rebuilt for {len(pares)} category(ies): {total} row(s)')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
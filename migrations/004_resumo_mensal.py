@@ -0,0 +1,42 @@
+"""
+Migration: monthly rollup of transactions.
+
+Creates `resumo_mensal` with one row per (user_id, conta_id, categoria_id,
+ano_mes, tipo) holding the sum (`total`) and count (`quantidade`) of the
+matching transactions, and fills it from the current `transacao` rows with a
+single INSERT ... SELECT ... GROUP BY. From then on the table is kept in sync
+by the Transacao mapper events and by the bulk materialization of recurrences
+(see resumo_mensal.py).
+
+Running it again rebuilds the table from scratch, which also repairs it after
+bulk writes that bypass the ORM.
+
+Run with: python migrations/run_migration.py migrations/004_resumo_mensal.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData
+from models import db, ResumoMensal
+import resumo_mensal
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'transacao' not in meta.tables:
+        print('Table transacao not found; nothing to do')
+        return
+
+    if 'resumo_mensal' not in meta.tables:
+        # checkfirst: on PostgreSQL the tipotransacao enum type already exists
+        ResumoMensal.__table__.create(bind=engine, checkfirst=True)
+        print('Table resumo_mensal created')
+
+    with engine.begin() as conn:
+        total = resumo_mensal.reconstruir(conn, ResumoMensal.__table__, meta.tables['transacao'])
+    print(f'Monthly rollup rebuilt: {total} row(s)')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
@@ -0,0 +1,60 @@
+"""
+Migration: persisted normalized description on Transacao.
+
+Adds `descricao_normalizada` (VARCHAR(200)) to transacao with an index and
+backfills it: the description without the "Parcela X/Y" suffix, whitespace
+collapsed and lowercased (see normalizacao_descricao.py). New rows get it on
+write; the report groups by it in SQL.
+
+The backfill normalizes each distinct description once and updates all rows
+sharing it in a single executemany. Running the migration again only fills
+rows still missing the value.
+
+Run with: python migrations/run_migration.py migrations/005_descricao_normalizada.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, bindparam, select, text
+from models import db
+from normalizacao_descricao import normalizar_descricao
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'transacao' not in meta.tables:
+        print('Table transacao not found; nothing to do')
+        return
+
+    with engine.begin() as conn:
+        if 'descricao_normalizada' not in meta.tables['transacao'].c:
+            conn.execute(text('ALTER TABLE transacao ADD COLUMN descricao_normalizada VARCHAR(200)'))
+            print('Column descricao_normalizada added to transacao')
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_transacao_descricao_normalizada ON transacao (descricao_normalizada)'))
+
+    backfill()
+
+
+def backfill():
+    """Fill descricao_normalizada for every distinct description still missing it"""
+    meta = MetaData()
+    meta.reflect(bind=db.engine, only=['transacao'])
+    transacao = meta.tables['transacao']
+
+    with db.engine.begin() as conn:
+        descricoes = conn.execute(
+            select(transacao.c.descricao).where(transacao.c.descricao_normalizada.is_(None)).distinct()
+        ).scalars().all()
+        if descricoes:
+            conn.execute(
+                transacao.update()
+                .where(transacao.c.descricao == bindparam('d'), transacao.c.descricao_normalizada.is_(None))
+                .values(descricao_normalizada=bindparam('n')),
+                [{'d': d, 'n': normalizar_descricao(d)} for d in descricoes]
+            )
+    print(f'descricao_normalizada backfilled for {len(descricoes)} distinct description(s)')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
@@ -0,0 +1,34 @@
+"""
+Migration: per-user data version for the report cache.
+
+Adds `dados_versao` (INTEGER NOT NULL DEFAULT 0) to usuario. The version is
+bumped on every write to the user's transactions, recurrences, categories and
+accounts and is part of the report cache key (see cache_relatorios.py).
+
+Run with: python migrations/run_migration.py migrations/006_usuario_dados_versao.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, text
+from models import db
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'usuario' not in meta.tables:
+        print('Table usuario not found; nothing to do')
+        return
+
+    if 'dados_versao' in meta.tables['usuario'].c:
+        print('Column dados_versao already exists; nothing to do')
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE usuario ADD COLUMN dados_versao INTEGER NOT NULL DEFAULT 0'))
+    print('Column dados_versao added to usuario')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
@@ -0,0 +1,54 @@
+"""
+Migration: stored month bucket on Transacao.
+
+Adds `ano_mes` (INTEGER, YYYYMM of data_transacao) to transacao with an index
+on (user_id, ano_mes) and backfills it with a single UPDATE. New rows get it
+on write (see resumo_mensal.registrar_ano_mes); month/year filters and
+groupings compare this column instead of wrapping data_transacao in
+dialect-specific date functions, so they can use the index.
+
+Running the migration again only fills rows still missing the value.
+
+Run with: python migrations/run_migration.py migrations/007_transacao_ano_mes.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, text
+from models import db
+from resumo_mensal import ano_mes_sql
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine)
+
+    if 'transacao' not in meta.tables:
+        print('Table transacao not found; nothing to do')
+        return
+
+    with engine.begin() as conn:
+        if 'ano_mes' not in meta.tables['transacao'].c:
+            conn.execute(text('ALTER TABLE transacao ADD COLUMN ano_mes INTEGER'))
+            print('Column ano_mes added to transacao')
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_transacao_user_ano_mes ON transacao (user_id, ano_mes)'))
+
+    backfill()
+
+
+def backfill():
+    """Fill ano_mes for every row still missing it"""
+    meta = MetaData()
+    meta.reflect(bind=db.engine, only=['transacao'])
+    transacao = meta.tables['transacao']
+
+    with db.engine.begin() as conn:
+        atualizadas = conn.execute(
+            transacao.update()
+            .where(transacao.c.ano_mes.is_(None))
+            .values(ano_mes=ano_mes_sql(transacao.c.data_transacao))
+        ).rowcount
+    print(f'ano_mes backfilled for {atualizadas} transaction(s)')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
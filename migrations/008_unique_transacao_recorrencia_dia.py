@@ -0,0 +1,48 @@
+"""
+Migration: unique index on transacao (recorrencia_id, date(data_transacao)).
+
+Replaces the index from 002, which compared the full DateTime: generated rows
+keep the time of the recurrence's data_inicio while consolidated projections
+used to be stored at midnight, so the same occurrence could be stored twice on
+the same day. The index now compares only the day.
+
+Existing same-day duplicates must be resolved before the index can be
+recreated; this script lists them and aborts instead of deleting user data.
+Running the migration again just recreates the index.
+
+Run with: python migrations/run_migration.py migrations/008_unique_transacao_recorrencia_dia.py
+Back up the DB first; the project does not use Alembic here.
+"""
+from sqlalchemy import MetaData, text
+from models import db
+
+INDEX_NAME = 'ix_transacao_recorrencia_data'
+
+
+def upgrade():
+    engine = db.engine
+    meta = MetaData()
+    meta.reflect(bind=engine, only=lambda nome, _: nome == 'transacao')
+
+    if 'transacao' not in meta.tables:
+        print('Table transacao not found; nothing to do')
+        return
+
+    with engine.begin() as conn:
+        duplicadas = conn.execute(text(
+            'SELECT recorrencia_id, date(data_transacao) AS dia, COUNT(*) AS total FROM transacao '
+            'WHERE recorrencia_id IS NOT NULL '
+            'GROUP BY recorrencia_id, date(data_transacao) HAVING COUNT(*) > 1'
+        )).all()
+        if duplicadas:
+            for recorrencia_id, dia, total in duplicadas:
+                print(f'Duplicate: recorrencia_id={recorrencia_id} day={dia} ({total} rows)')
+            raise RuntimeError(f'{len(duplicadas)} duplicated occurrence(s) found; remove the extra rows and run again')
+
+        conn.execute(text(f'DROP INDEX IF EXISTS {INDEX_NAME}'))
+        conn.execute(text(f'CREATE UNIQUE INDEX {INDEX_NAME} ON transacao (recorrencia_id, date(data_transacao))'))
+    print(f'Index {INDEX_NAME} recreated on transacao (recorrencia_id, date(data_transacao))')
+
+
+if __name__ == '__main__':
+    print('This is a helper script. Use migrations/run_migration.py or run upgrade() inside your application context.')
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Generic runner for the migrations in this folder, without importing the full application.
+
+Usage (from the project root or container where the app code lives):
+    python migrations/run_migration.py migrations/001_add_marca_recorrencia.py
+
+Creates a minimal Flask app, initializes the SQLAlchemy `db` from `models`,
+and executes the `upgrade()` function of the given migration file.
+"""
+import importlib.util
+import os
+import sys
+from flask import Flask
+
+# Ensure working directory is project root and importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+from models import db
+
+if len(sys.argv) != 2:
+    print(__doc__)
+    sys.exit(1)
+
+# Load the migration module
+spec = importlib.util.spec_from_file_location('mig', os.path.abspath(sys.argv[1]))
+mig = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mig)
+
+# Create a minimal Flask app and configure it
+app = Flask(__name__)
+try:
+    app.config.from_object('config.Config')
+except Exception:
+    print('Warning: failed to load config.Config; continuing with Flask defaults')
+
+# Initialize extensions
+db.init_app(app)
+
+with app.app_context():
+    print(f'Running migration {sys.argv[1]}: upgrade()')
+    mig.upgrade()
+    print('Migration upgrade() finished')
@@ -2,6 +2,14 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from enum import Enum
+from array import array
+import agenda_recorrencia
+import hierarquia_categorias
+import resumo_mensal
+import normalizacao_descricao
+import cache_relatorios
+import saldos_contas
+from rastreio_recorrencia import rastreio
 
 db = SQLAlchemy()
 
@@ -162,19 +170,35 @@ class Conta(db.Model):
     @property
     def saldo_atual(self):
         """Calcula o saldo atual da conta"""
-        total_receitas = sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.RECEITA)
-        total_despesas = sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.DESPESA)
-        return self.saldo_inicial + total_receitas - total_despesas
+        return self.saldo_inicial + self.total_receitas - self.total_despesas
     
     @property
     def total_receitas(self):
         """Total de receitas da conta"""
-        return sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.RECEITA)
+        return saldos_contas.obter(db.session, ResumoMensal, self)[0]
     
     @property
     def total_despesas(self):
         """Total de despesas da conta"""
-        return sum(t.valor for t in self.transacoes if t.tipo == TipoTransacao.DESPESA)
+        return saldos_contas.obter(db.session, ResumoMensal, self)[1]
+    
+    @property
+    def total_transacoes(self):
+        """Número de transações da conta"""
+        return saldos_contas.obter(db.session, ResumoMensal, self)[2]
+    
+    @staticmethod
+    def carregar_saldos(contas):
+        """Calcula os totais de várias contas em uma única consulta (ver saldos_contas)"""
+        return saldos_contas.carregar(ResumoMensal, contas)
+    
+    def saldo_em(self, data):
+        """Saldo da conta ao fim do dia `data` (ver saldos_contas)"""
+        return saldos_contas.saldo_em(db.session, ResumoMensal, Transacao, self, data)
+    
+    def saldos_diarios(self, inicio, fim):
+        """Lista de (dia, saldo) de cada dia do período, inclusive (ver saldos_contas)"""
+        return saldos_contas.serie_diaria(db.session, ResumoMensal, Transacao, self, inicio, fim)
     
     @classmethod
     def get_contas_ativas(cls):
@@ -193,7 +217,7 @@ class Conta(db.Model):
             'total_despesas': self.total_despesas,
             'cor': self.cor,
             'ativa': self.ativa,
-            'transacoes_count': len(self.transacoes)
+            'transacoes_count': self.total_transacoes
         }
 
 class Categoria(db.Model):
@@ -235,15 +259,24 @@ class Categoria(db.Model):
         return len(self.subcategorias) > 0
     
     def get_all_subcategorias(self, include_self=True):
-        """Retorna todas as subcategorias recursivamente"""
-        result = []
-        if include_self:
-            result.append(self)
-        
-        for subcategoria in self.subcategorias:
-            result.extend(subcategoria.get_all_subcategorias(include_self=True))
-        
-        return result
+        """Retorna todas as subcategorias (em qualquer nível) em uma única consulta"""
+        query = Categoria.query.join(
+            CategoriaHierarquia, CategoriaHierarquia.descendente_id == Categoria.id
+        ).filter(CategoriaHierarquia.ancestral_id == self.id)
+        if not include_self:
+            query = query.filter(CategoriaHierarquia.profundidade > 0)
+        return query.order_by(CategoriaHierarquia.profundidade, Categoria.nome).all()
+    
+    @staticmethod
+    def ids_com_descendentes(categoria_id, include_self=True):
+        """
+        Subconsulta com os IDs da categoria e de todas as suas subcategorias, para
+        filtros como Transacao.categoria_id.in_(Categoria.ids_com_descendentes(id))
+        """
+        query = db.select(CategoriaHierarquia.descendente_id).where(CategoriaHierarquia.ancestral_id == categoria_id)
+        if not include_self:
+            query = query.where(CategoriaHierarquia.profundidade > 0)
+        return query
     
     @classmethod
     def get_categorias_raiz(cls):
@@ -299,6 +332,17 @@ class Categoria(db.Model):
             'subcategorias': [sub.to_dict_hierarquico() for sub in self.subcategorias]
         }
 
+class CategoriaHierarquia(db.Model):
+    """Tabela de fechamento da hierarquia de categorias: um par (ancestral, descendente) por linha"""
+    __tablename__ = 'categoria_hierarquia'
+    
+    ancestral_id = db.Column(db.Integer, db.ForeignKey('categoria.id'), primary_key=True)
+    descendente_id = db.Column(db.Integer, db.ForeignKey('categoria.id'), primary_key=True, index=True)
+    profundidade = db.Column(db.Integer, nullable=False)  # 0 = a própria categoria
+
+# Mantida em dia a cada inclusão, mudança de pai ou exclusão de categoria
+hierarquia_categorias.registrar(Categoria, CategoriaHierarquia.__table__)
+
 class TransacaoRecorrente(db.Model):
     """Modelo para gerenciar transações recorrentes"""
     id = db.Column(db.Integer, primary_key=True)
@@ -318,6 +362,10 @@ class TransacaoRecorrente(db.Model):
     # Controle de parcelas (para transações parceladas)
     total_parcelas = db.Column(db.Integer, nullable=True)  # Null = contínua (sem fim)
     parcelas_geradas = db.Column(db.Integer, default=0)
+    # Marca d'água da materialização: última ocorrência gravada no banco (índice no
+    # calendário da recorrência e data). Null = nenhuma transação gerada ainda
+    ultimo_indice_gerado = db.Column(db.Integer, nullable=True)
+    ultima_data_gerada = db.Column(db.DateTime, nullable=True)
     # Forma de pagamento padrão para a recorrência (opcional)
     forma_pagamento_id = db.Column(db.Integer, db.ForeignKey('forma_pagamento.id'), nullable=True)
     forma_pagamento = db.relationship('FormaPagamento', foreign_keys=[forma_pagamento_id], backref='recorrentes')
@@ -377,19 +425,162 @@ class TransacaoRecorrente(db.Model):
         else:
             return data_base
     
+    def calcular_ocorrencias(self, inicio, fim, indice_minimo=0, limite=None):
+        """Calcula em forma fechada as ocorrências da recorrência dentro de [inicio, fim]
+
+        Respeita data_fim e total_parcelas. Retorna um agenda_recorrencia.Ocorrencias,
+        que itera pares (indice, data); o índice 0 corresponde a data_inicio.
+        """
+        return agenda_recorrencia.calcular_ocorrencias(
+            self.tipo_recorrencia, self.data_inicio, inicio, fim,
+            data_fim=self.data_fim,
+            total_parcelas=self.total_parcelas,
+            indice_minimo=indice_minimo,
+            limite=limite
+        )
+    
+    def indice_apos(self, data):
+        """Índice da primeira ocorrência posterior ao período de `data` (ver agenda_recorrencia.indice_do_periodo)"""
+        return agenda_recorrencia.indice_do_periodo(self.tipo_recorrencia, self.data_inicio, data) + 1
+    
+    @property
+    def proximo_indice(self):
+        """Índice da próxima ocorrência a materializar (após a marca d'água)"""
+        if self.ultimo_indice_gerado is None:
+            return 0
+        return self.ultimo_indice_gerado + 1
+    
+    def registrar_transacao(self, data, indice=None, quantidade=1):
+        """
+        Atualiza a marca d'água e o contador de parcelas após gravar `quantidade`
+        transações desta recorrência, a mais recente em `data`. Deve ser chamado na
+        mesma sessão/commit da inserção das transações.
+        """
+        self.parcelas_geradas = (self.parcelas_geradas or 0) + quantidade
+        if self.ultima_data_gerada is None or data > self.ultima_data_gerada:
+            if indice is None:
+                indice = agenda_recorrencia.indice_do_periodo(self.tipo_recorrencia, self.data_inicio, data)
+            self.ultima_data_gerada = data
+            self.ultimo_indice_gerado = indice
+        
+        # Verificar se finalizou as parcelas
+        if self.is_parcelada and self.parcelas_geradas >= self.total_parcelas:
+            self.status = StatusRecorrencia.FINALIZADA
+    
+    def remover_transacao(self, transacao):
+        """
+        Atualiza a marca d'água e o contador de parcelas ao excluir uma transação
+        desta recorrência. Deve ser chamado depois de `db.session.delete(transacao)`.
+        """
+        self.parcelas_geradas = max((self.parcelas_geradas or 0) - 1, 0)
+        if self.ultima_data_gerada is not None and transacao.data_transacao >= self.ultima_data_gerada:
+            self.recalcular_marca()
+    
+    def recalcular_marca(self):
+        """Recalcula a marca d'água a partir das transações gravadas (uma consulta agregada)"""
+        ultima_data = db.session.query(db.func.max(Transacao.data_transacao)).filter(
+            Transacao.recorrencia_id == self.id
+        ).scalar()
+        self.ultima_data_gerada = ultima_data
+        self.ultimo_indice_gerado = None
+        if ultima_data is not None:
+            # Pelo período: a última linha pode ter o dia recuado pelo cálculo antigo
+            self.ultimo_indice_gerado = agenda_recorrencia.indice_do_periodo(
+                self.tipo_recorrencia, self.data_inicio, ultima_data)
+    
+    def indice_de(self, data):
+        """Índice da ocorrência no dia de `data` (ou da última anterior, se o dia estiver fora do calendário)"""
+        fim_do_dia = datetime.combine(data.date(), datetime.max.time())
+        return max(agenda_recorrencia.ultimo_indice(self.tipo_recorrencia, self.data_inicio, fim_do_dia), 0)
+    
+    def ocorrencia_do_dia(self, data):
+        """(indice, data) da ocorrência no dia de `data`, com o horário da recorrência; fora do calendário, mantém `data`"""
+        indice = self.indice_de(data)
+        ocorrencia = agenda_recorrencia.data_ocorrencia(self.tipo_recorrencia, self.data_inicio, indice)
+        return indice, (ocorrencia if ocorrencia.date() == data.date() else data)
+    
+    def descricao_ocorrencia(self, indice):
+        """Descrição da ocorrência `indice`, com o número da parcela quando parcelada"""
+        if self.is_parcelada:
+            return f"{self.descricao} - Parcela {indice + 1}/{self.total_parcelas}"
+        return self.descricao
+    
+    def materializar(self, ocorrencias):
+        """Grava em lote as ocorrências (indice, data) desta recorrência; ver materializar_em_lote"""
+        return TransacaoRecorrente.materializar_em_lote((self, indice, data) for indice, data in ocorrencias)
+    
+    @staticmethod
+    def materializar_em_lote(ocorrencias):
+        """
+        Grava ocorrências de recorrências como transações reais em uma única instrução
+        INSERT, ignorando as que já existem (índice único em recorrencia_id + dia
+        de data_transacao), e atualiza a marca d'água e o contador de parcelas de cada
+        recorrência. Seguro contra execuções concorrentes; não faz commit.
+        
+        Args:
+            ocorrencias: iterável de (recorrente, indice, data)
+            
+        Returns:
+            Lista de linhas (id, recorrencia_id, data_transacao) efetivamente inseridas
+        """
+        agora = datetime.utcnow()
+        recorrentes = {}
+        linhas = {}
+        for recorrente, indice, data in ocorrencias:
+            recorrentes[recorrente.id] = recorrente
+            descricao = recorrente.descricao_ocorrencia(indice)
+            linhas[(recorrente.id, data.date())] = (indice, {
+                'descricao': descricao,
+                'descricao_normalizada': normalizacao_descricao.normalizar_descricao(descricao),
+                'valor': recorrente.valor,
+                'tipo': recorrente.tipo,
+                'data_transacao': data,
+                'ano_mes': resumo_mensal.ano_mes(data),
+                'data_criacao': agora,
+                'categoria_id': recorrente.categoria_id,
+                'conta_id': recorrente.conta_id,
+                'forma_pagamento_id': recorrente.forma_pagamento_id,
+                'recorrencia_id': recorrente.id,
+                'user_id': recorrente.user_id
+            })
+        if not linhas:
+            return []
+        
+        stmt = _insert_ignorando_duplicatas(Transacao.__table__).values(
+            [valores for _, valores in linhas.values()]
+        ).returning(Transacao.id, Transacao.recorrencia_id, Transacao.data_transacao)
+        inseridas = db.session.execute(stmt).all()
+        
+        # O INSERT direto não dispara os eventos do mapeador: atualizar o resumo mensal aqui
+        deltas = {}
+        datas_por_recorrencia = {}
+        for linha in inseridas:
+            datas_por_recorrencia.setdefault(linha.recorrencia_id, []).append(linha.data_transacao)
+            r = recorrentes[linha.recorrencia_id]
+            resumo_mensal.somar(deltas, resumo_mensal.chave(r.user_id, r.conta_id, r.categoria_id, linha.data_transacao, r.tipo), r.valor)
+        resumo_mensal.aplicar(db.session.connection(), ResumoMensal.__table__, deltas)
+        cache_relatorios.incrementar_versoes(db.session.connection(), Usuario.__table__,
+                                             {recorrentes[linha.recorrencia_id].user_id for linha in inseridas},
+                                             db.session())
+        saldos_contas.invalidar(db.session(), Conta, {recorrentes[linha.recorrencia_id].conta_id for linha in inseridas})
+        for recorrencia_id, datas in datas_por_recorrencia.items():
+            recorrente = recorrentes[recorrencia_id]
+            ultima = max(datas)
+            # `linhas` é indexado pelo dia, como o índice único
+            indice = linhas[(recorrencia_id, ultima.date())][0]
+            recorrente.registrar_transacao(ultima, indice, quantidade=len(datas))
+            # A coleção carregada em memória não enxerga o INSERT direto na tabela
+            db.session.expire(recorrente, ['transacoes'])
+        return inseridas
+    
     def gerar_proxima_transacao(self):
         """Gera a próxima transação da recorrência"""
         if self.is_finalizada:
             return None
         
-        # Calcular data da próxima transação
-        if self.transacoes:
-            # Usar a data da última transação gerada
-            ultima_transacao = max(self.transacoes, key=lambda t: t.data_transacao)
-            proxima_data = self.calcular_proxima_data(ultima_transacao.data_transacao)
-        else:
-            # Primeira transação usa a data de início
-            proxima_data = self.data_inicio
+        # Próxima ocorrência do calendário após a marca d'água (índice 0 = data de início)
+        indice = self.proximo_indice
+        proxima_data = agenda_recorrencia.data_ocorrencia(self.tipo_recorrencia, self.data_inicio, indice)
         
         # Verificar se não passou do limite
         if self.data_fim and proxima_data > self.data_fim:
@@ -397,29 +588,15 @@ class TransacaoRecorrente(db.Model):
             db.session.commit()
             return None
         
-        # Criar nova transação
-        nova_transacao = Transacao(
-            descricao=f"{self.descricao}" + 
-                      (f" - Parcela {self.parcelas_geradas + 1}/{self.total_parcelas}" if self.is_parcelada else ""),
-            valor=self.valor,
-            tipo=self.tipo,
-            data_transacao=proxima_data,
-            categoria_id=self.categoria_id,
-            conta_id=self.conta_id,
-            forma_pagamento=self.forma_pagamento,
-            recorrencia_id=self.id,
-            user_id=self.user_id  # Adicionando o user_id
-        )
-        
-        db.session.add(nova_transacao)
-        self.parcelas_geradas += 1
-        
-        # Verificar se finalizou as parcelas
-        if self.is_parcelada and self.parcelas_geradas >= self.total_parcelas:
-            self.status = StatusRecorrencia.FINALIZADA
+        # Criar nova transação (ignorada se outra execução já gravou esta ocorrência)
+        inseridas = self.materializar([(indice, proxima_data)])
+        if not inseridas:
+            self.recalcular_marca()
+            db.session.commit()
+            return None
         
         db.session.commit()
-        return nova_transacao
+        return db.session.get(Transacao, inseridas[0].id)
     
     def gerar_transacoes_pendentes(self, meses_futuros=600, apenas_projetar=False):
         """
@@ -431,172 +608,152 @@ class TransacaoRecorrente(db.Model):
             apenas_projetar (bool): Se True, apenas projeta as transações futuras sem salvá-las no banco
             
         Returns:
-            Lista de transações geradas
+            Lista de transações geradas (ver iterar_transacoes_pendentes)
         """
-        transacoes_geradas = []
-        # Rastrear datas já processadas para evitar duplicação
-        datas_processadas = set()
-        hoje = datetime.utcnow()
-        
-        # Verificar se a recorrência já foi finalizada manualmente ou por parcelas
-        if self.status == StatusRecorrencia.FINALIZADA or \
-           (self.is_parcelada and self.parcelas_geradas >= self.total_parcelas):
-            print(f"Recorrência {self.id} já finalizada - Status: {self.status.value}, Parcelas: {self.parcelas_geradas}/{self.total_parcelas if self.total_parcelas else 'Indefinido'}")
-            return transacoes_geradas
-            
-        # Verificar explicitamente o status
-        if self.status != StatusRecorrencia.ATIVA:
-            print(f"AVISO: Recorrência {self.id} não está ativa. Status atual: {self.status.value}")
-            return transacoes_geradas
-        
-        # Definir data limite de geração - SEMPRE usar a data atual + meses_futuros
-        # independentemente de transações existentes
-        if self.data_fim:
-            # Se tem data_fim, gerar todas as transações até essa data
-            data_limite = self.data_fim
-        else:
-            # Caso contrário, gerar para os próximos X meses a partir de HOJE
-            # Isso é crítico: sempre usar a data atual como base, não a última transação
-            data_limite = hoje + relativedelta(months=meses_futuros)
-        
-        # Log de debug
-        print(f"Gerando transações para {self.descricao} (ID: {self.id})")
-        print(f"Data início: {self.data_inicio}, Data fim: {self.data_fim}")
-        print(f"Data limite de geração: {data_limite} (hoje + {meses_futuros} meses)")
-        print(f"Tipo de recorrência: {self.tipo_recorrencia.value}")
-        
-        # CRUCIAL: Determinar a próxima data a partir da qual devemos gerar transações
-        proxima_data = None
-        
-        # Adicionar todas as datas de transações existentes ao conjunto para evitar duplicação
-        for transacao in self.transacoes:
-            data_str = transacao.data_transacao.strftime('%Y-%m-%d')
-            datas_processadas.add(data_str)
-            print(f"Transação existente encontrada para data {data_str}")
-        
-        if self.transacoes:
-            try:
-                # Obter a última transação gerada
-                ultima_transacao = max(self.transacoes, key=lambda t: t.data_transacao)
-                proxima_data = self.calcular_proxima_data(ultima_transacao.data_transacao)
-                print(f"Última transação: {ultima_transacao.data_transacao}, Próxima data: {proxima_data}")
-            except Exception as e:
-                print(f"Erro ao calcular próxima data: {str(e)}")
-                proxima_data = self.data_inicio
-        else:
-            proxima_data = self.data_inicio
-            print(f"Primeira transação, usando data_inicio: {proxima_data}")
-
-        # Guard: se a recorrência for UNICA e já tiver transação, nada mais a gerar
-        if self.tipo_recorrencia == TipoRecorrencia.UNICA and self.transacoes:
-            print(f"Recorrência UNICA já gerada para {self.id}, nada a projetar")
-            return transacoes_geradas
+        return list(self.iterar_transacoes_pendentes(meses_futuros, apenas_projetar))
+    
+    def iterar_transacoes_pendentes(self, meses_futuros=600, apenas_projetar=False, inicio=None):
+        """
+        Versão preguiçosa de gerar_transacoes_pendentes: produz as transações
+        pendentes uma a uma, em ordem de data, calculando cada ocorrência só quando
+        ela é pedida. O chamador pode parar a iteração assim que passar do fim da
+        janela que lhe interessa.
         
-        # Loop de geração de transações
-        max_iteracoes = 1000  # Limitar o número de iterações como segurança
-        iteracoes = 0
+        As ocorrências vencidas (mês atual e anteriores) são gravadas todas de uma
+        vez na primeira iteração, inclusive as anteriores a `inicio`.
         
-        # Definir o limite para transações persistidas vs. projetadas
-        # Gravar apenas o mês atual e passado, projetar o futuro
-        final_mes_atual = (hoje.replace(day=1) + relativedelta(months=1) - timedelta(days=1)).date()
-        
-        # Continuamos enquanto:
-        # 1. A recorrência não estiver finalizada
-        # 2. Não atingirmos o limite máximo de iterações (segurança)
-        # 3. A data da próxima transação não exceder o limite
-        while not self.is_finalizada and iteracoes < max_iteracoes and proxima_data <= data_limite:
-            print(f"[DEBUG] iteração {iteracoes}: proxima_data={proxima_data}, data_limite={data_limite}, is_finalizada={self.is_finalizada}, max_iteracoes={max_iteracoes}")
-            iteracoes += 1
-
-            # Verificar se a data já foi processada (para evitar duplicatas)
-            data_str = proxima_data.strftime('%Y-%m-%d')
-            if data_str in datas_processadas:
-                print(f"Data {data_str} já processada, avançando para próxima")
-                proxima_data = self.calcular_proxima_data(proxima_data)
-                continue
+        Args:
+            meses_futuros (int): Quantos meses para frente gerar
+            apenas_projetar (bool): Se True, não grava nada; todas as ocorrências são projetadas
+            inicio (datetime): se informado, só produz transações a partir desta data
             
-            # Marcar a data como processada
-            datas_processadas.add(data_str)
+        Yields:
+            Transacao (gravadas) e TransacaoProjetada (projeções) em ordem de data
+        """
+        hoje = datetime.utcnow()
+        amostra = rastreio.iniciar(self.id, 'projecao' if apenas_projetar else 'geracao')
+        motivo = None
+        vencidas = ()
+        iteracoes = 0
+        try:
+            # Verificar se a recorrência já foi finalizada manualmente ou por parcelas
+            if self.status == StatusRecorrencia.FINALIZADA or \
+               (self.is_parcelada and self.parcelas_geradas >= self.total_parcelas):
+                motivo = 'finalizada'
+                return
+                
+            # Verificar explicitamente o status
+            if self.status != StatusRecorrencia.ATIVA:
+                motivo = 'inativa'
+                return
             
-            # NOVA LÓGICA: Determinar se é transação futura (após final do mês atual)
-            data_transacao_date = proxima_data.date() if isinstance(proxima_data, datetime) else proxima_data
+            # Definir data limite de geração - SEMPRE usar a data atual + meses_futuros
+            # independentemente de transações existentes
+            if self.data_fim:
+                # Se tem data_fim, gerar todas as transações até essa data
+                data_limite = self.data_fim
+            else:
+                # Caso contrário, gerar para os próximos X meses a partir de HOJE
+                # Isso é crítico: sempre usar a data atual como base, não a última transação
+                data_limite = hoje + relativedelta(months=meses_futuros)
             
+            # O calendário é indexado a partir de data_inicio: partir do primeiro índice
+            # posterior à marca d'água (0 quando ainda não há transações). Todas as
+            # ocorrências a partir dele ainda não foram gravadas.
+            indice_inicial = self.proximo_indice
 
-            # Verificar se já existe uma transação real para esta data (ignorando horário)
-            data_prox = proxima_data.date() if hasattr(proxima_data, 'date') else proxima_data
-            transacao_existente = next((t for t in self.transacoes
-                                        if t.recorrencia_id == self.id and t.data_transacao.date() == data_prox), None)
-            if transacao_existente:
-                print(f"Transação já existe para {proxima_data}, pulando")
-                proxima_data = self.calcular_proxima_data(proxima_data)
-                continue
-                
-            # Determinar se deve persistir (real) ou apenas projetar
-            is_projecao = data_transacao_date > final_mes_atual or apenas_projetar
-
-            if is_projecao:
-                # Criar transação virtual (não salva no banco)
-                print(f"Criando PROJEÇÃO para data {proxima_data} (não será salva no banco)")
-                numero_parcela = None
-                if self.is_parcelada:
-                    # Contar parcelas já persistidas antes de proxima_data
-                    total_existentes = len([
-                        t for t in self.transacoes
-                        if t.recorrencia_id == self.id and t.data_transacao < proxima_data
-                    ])
-                    # Contar também as parcelas projetadas já geradas nesta chamada
-                    total_projetadas_anteriores = len([
-                        t for t in transacoes_geradas
-                        if getattr(t, 'recorrencia_id', None) == self.id and getattr(t, 'is_projetada', False) and t.data_transacao < proxima_data
-                    ])
-                    numero_parcela = total_existentes + total_projetadas_anteriores + 1
-                    # Se já ultrapassamos o total de parcelas previstas, parar a geração
-                    if self.total_parcelas is not None and numero_parcela > self.total_parcelas:
-                        # Não criar mais projeções além do total definido
-                        print(f"Número da parcela ({numero_parcela}) excede total_parcelas ({self.total_parcelas}), encerrando geração de projeções")
-                        break
-                descricao_proj = self.descricao
-                if self.is_parcelada and numero_parcela is not None:
-                    descricao_proj += f" - Parcela {numero_parcela}/{self.total_parcelas}"
-                # Criar objeto leve (não-SQLAlchemy) para representar projeção
-                # Evita criar instâncias Transacao transitórias que se liguem a
-                # relações (categoria/conta) e gerem SAWarning durante queries.
-                from types import SimpleNamespace
-                projecao = SimpleNamespace(
-                    id=-(100000 + self.id*1000 + iteracoes),
-                    descricao=descricao_proj,
-                    valor=self.valor,
-                    tipo=self.tipo,
-                    data_transacao=proxima_data,
-                    categoria_id=self.categoria_id,
-                    forma_pagamento=getattr(self, 'forma_pagamento', None),
-                    conta_id=self.conta_id,
-                    recorrencia_id=self.id,
-                    user_id=self.user_id,
-                    is_projetada=True
-                )
-                print(f"Nova projeção criada: {projecao.descricao} - {projecao.data_transacao}")
-                transacoes_geradas.append(projecao)
-            else:
-                # Gerar transação real (persistida) para mês atual ou anterior
-                print(f"Gerando transação real para data {proxima_data}")
-                nova_transacao = self.gerar_proxima_transacao()
-                if nova_transacao:
-                    print(f"Nova transação gerada: {nova_transacao.descricao} - {nova_transacao.data_transacao}")
-                    transacoes_geradas.append(nova_transacao)
-                else:
-                    # Se não conseguiu gerar mais transações, a recorrência foi finalizada
-                    print("Não foi possível gerar mais transações. Recorrência finalizada.")
-                    break
+            # Guard: se a recorrência for UNICA e já tiver transação, nada mais a gerar
+            if self.tipo_recorrencia == TipoRecorrencia.UNICA and self.ultima_data_gerada is not None:
+                motivo = 'unica_gerada'
+                return
+            
+            # Limitar o número de ocorrências como segurança
+            max_iteracoes = 1000
             
-            # Avançar para a próxima data
-            proxima_data = self.calcular_proxima_data(proxima_data)
+            # Definir o limite para transações persistidas vs. projetadas
+            # Gravar apenas o mês atual e passado, projetar o futuro
+            final_mes_atual = (hoje.replace(day=1) + relativedelta(months=1) - timedelta(days=1)).date()
+            
+            # Gravar de uma vez as ocorrências do mês atual e anteriores (transações reais),
+            # em uma única instrução que ignora as que já existirem no banco
+            if not apenas_projetar:
+                vencidas = list(agenda_recorrencia.iterar_ocorrencias(
+                    self.tipo_recorrencia, self.data_inicio, self.data_inicio,
+                    fim=min(data_limite, datetime.combine(final_mes_atual, datetime.max.time())),
+                    data_fim=self.data_fim, total_parcelas=self.total_parcelas,
+                    indice_minimo=indice_inicial
+                ))
+                if vencidas:
+                    inseridas = self.materializar(vencidas)
+                    db.session.commit()
+                    if amostra:
+                        amostra.materializadas = len(inseridas)
+                        amostra.duplicadas = len(vencidas) - len(inseridas)
+                    if inseridas:
+                        reais = Transacao.query.filter(Transacao.id.in_([linha.id for linha in inseridas]))
+                        if inicio is not None:
+                            reais = reais.filter(Transacao.data_transacao >= inicio)
+                        yield from reais.order_by(Transacao.data_transacao)
+                    indice_inicial = vencidas[-1][0] + 1
+            
+            # Parar se a recorrência foi finalizada durante a geração
+            if self.is_finalizada:
+                motivo = 'finalizada'
+                return
+            
+            # Projeções (transações virtuais, não salvas no banco), calculadas sob demanda
+            # a partir do início da janela pedida
+            ocorrencias = agenda_recorrencia.iterar_ocorrencias(
+                self.tipo_recorrencia, self.data_inicio, inicio or self.data_inicio,
+                fim=data_limite, data_fim=self.data_fim, total_parcelas=self.total_parcelas,
+                indice_minimo=indice_inicial
+            )
+            for indice, proxima_data in ocorrencias:
+                if iteracoes >= max_iteracoes:
+                    motivo = 'limite_iteracoes'
+                    return
+                iteracoes += 1
+
+                # O número da parcela vem direto do índice da ocorrência (parcela = indice + 1);
+                # o calendário já não emite índices além de total_parcelas
+                yield self._criar_projecao(indice, proxima_data)
+        finally:
+            if amostra:
+                amostra.iteracoes = len(vencidas) + iteracoes
+                amostra.projetadas = iteracoes
+                amostra.finalizar(motivo)
+    
+    def projetar_intervalo(self, inicio, fim):
+        """
+        Projeta, sem salvar no banco, as ocorrências da recorrência dentro de [inicio, fim].
+        
+        Assim como gerar_transacoes_pendentes(apenas_projetar=True), só são projetadas
+        ocorrências posteriores à marca d'água (última transação já gerada), mas o
+        trabalho é proporcional à janela pedida e não ao horizonte total de projeção,
+        e nenhuma consulta ao banco é feita.
         
-        if iteracoes >= max_iteracoes:
-            print(f"ATENÇÃO: Limite máximo de iterações atingido para recorrência {self.id}")
+        Args:
+            inicio (datetime): início da janela (inclusivo)
+            fim (datetime): fim da janela (inclusivo)
+            
+        Returns:
+            ProjecoesRecorrencia, que itera as projeções (TransacaoProjetada) em ordem de data
+        """
+        if self.status != StatusRecorrencia.ATIVA or self.is_finalizada:
+            return ProjecoesRecorrencia.vazio(self)
+        if self.ultima_data_gerada is not None and self.tipo_recorrencia == TipoRecorrencia.UNICA:
+            return ProjecoesRecorrencia.vazio(self)
         
-        print(f"Total de transações geradas: {len(transacoes_geradas)}")
-        return transacoes_geradas
+        amostra = rastreio.iniciar(self.id, 'intervalo')
+        projecoes = ProjecoesRecorrencia(self, self.calcular_ocorrencias(inicio, fim, indice_minimo=self.proximo_indice))
+        if amostra:
+            amostra.iteracoes = amostra.projetadas = len(projecoes)
+            amostra.finalizar()
+        return projecoes
+    
+    def _criar_projecao(self, indice, data):
+        """Cria o objeto leve que representa a ocorrência `indice` sem persisti-la"""
+        return TransacaoProjetada(self, indice, data)
     
     def to_dict(self):
         return {
@@ -622,12 +779,137 @@ class TransacaoRecorrente(db.Model):
             'transacoes_count': len(self.transacoes)
         }
 
+class TransacaoProjetada:
+    """
+    Ocorrência projetada (não salva no banco) de uma transação recorrente.
+    
+    Guarda apenas a recorrência, o índice da ocorrência e a data; os demais campos
+    são lidos da recorrência. Tem a mesma interface de Transacao usada pelos
+    templates e relatórios (descricao, valor, tipo, data_transacao, categoria,
+    conta, tags...), com is_projetada=True e id negativo.
+    """
+    __slots__ = ('recorrencia', 'indice', 'data_transacao')
+    
+    is_projetada = True
+    is_recorrente = True
+    tags = ()
+    tags_nomes = ()
+    tags_string = ''
+    
+    def __init__(self, recorrencia, indice, data_transacao):
+        self.recorrencia = recorrencia
+        self.indice = indice
+        self.data_transacao = data_transacao
+    
+    def __repr__(self):
+        return f'<TransacaoProjetada {self.descricao}: R$ {self.valor} em {self.data_transacao:%Y-%m-%d}>'
+    
+    @property
+    def id(self):
+        # Negativo para nunca colidir com IDs reais
+        return -(self.recorrencia.id * 100000 + self.indice + 1)
+    
+    @property
+    def descricao(self):
+        return self.recorrencia.descricao_ocorrencia(self.indice)
+    
+    @property
+    def recorrencia_id(self):
+        return self.recorrencia.id
+    
+    @property
+    def valor(self):
+        return self.recorrencia.valor
+    
+    @property
+    def tipo(self):
+        return self.recorrencia.tipo
+    
+    @property
+    def categoria_id(self):
+        return self.recorrencia.categoria_id
+    
+    @property
+    def categoria(self):
+        return self.recorrencia.categoria
+    
+    @property
+    def conta_id(self):
+        return self.recorrencia.conta_id
+    
+    @property
+    def conta(self):
+        return self.recorrencia.conta
+    
+    @property
+    def forma_pagamento_id(self):
+        return self.recorrencia.forma_pagamento_id
+    
+    @property
+    def forma_pagamento(self):
+        return self.recorrencia.forma_pagamento
+    
+    @property
+    def user_id(self):
+        return self.recorrencia.user_id
+
+
+class ProjecoesRecorrencia:
+    """
+    Lote de projeções de uma recorrência em forma compacta: a recorrência e suas
+    ocorrências (agenda_recorrencia.Ocorrencias, com as datas em um array de
+    ordinais). Os objetos TransacaoProjetada só são criados ao iterar, então
+    projeções de vários anos ocupam poucos bytes por ocorrência até serem usadas.
+    """
+    __slots__ = ('recorrencia', 'ocorrencias')
+    
+    def __init__(self, recorrencia, ocorrencias):
+        self.recorrencia = recorrencia
+        self.ocorrencias = ocorrencias
+    
+    @classmethod
+    def vazio(cls, recorrencia):
+        return cls(recorrencia, agenda_recorrencia.Ocorrencias(0, array('l'), timedelta(0)))
+    
+    def __len__(self):
+        return len(self.ocorrencias)
+    
+    def __bool__(self):
+        return bool(self.ocorrencias)
+    
+    def __iter__(self):
+        recorrencia = self.recorrencia
+        for indice, data in self.ocorrencias:
+            yield TransacaoProjetada(recorrencia, indice, data)
+    
+    def datas(self):
+        """Datas das ocorrências projetadas"""
+        return self.ocorrencias.datas()
+    
+    def por_mes(self):
+        """Ocorrências agrupadas por mês: ((ano, mes), primeiro índice, quantidade)"""
+        return self.ocorrencias.por_mes()
+    
+    @property
+    def total(self):
+        """Soma dos valores projetados (todas as ocorrências têm o valor da recorrência)"""
+        return len(self.ocorrencias) * self.recorrencia.valor
+
+
 class Transacao(db.Model):
+    __table_args__ = (
+        db.Index('ix_transacao_user_ano_mes', 'user_id', 'ano_mes'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     descricao = db.Column(db.String(200), nullable=False)
+    # Descrição sem sufixo de parcela, em minúsculas; chave de agrupamento dos relatórios
+    descricao_normalizada = db.Column(db.String(200), index=True)
     valor = db.Column(db.Float, nullable=False)
     tipo = db.Column(db.Enum(TipoTransacao), nullable=False)
     data_transacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Mês de data_transacao (AAAAMM), gravado junto com ela; filtros e agrupamentos por mês/ano
+    ano_mes = db.Column(db.Integer)
     data_criacao = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
     # Chaves estrangeiras
@@ -704,6 +986,56 @@ class Transacao(db.Model):
             'tags_string': self.tags_string
         }
 
+
+# Uma recorrência grava no máximo uma transação por dia de ocorrência; o índice
+# compara só a data, já que a hora gravada pode variar (horário de data_inicio
+# na geração, meia-noite em linhas antigas ou consolidadas fora do calendário)
+db.Index('ix_transacao_recorrencia_data', Transacao.recorrencia_id, db.func.date(Transacao.data_transacao), unique=True)
+
+
+class ResumoMensal(db.Model):
+    """Soma e quantidade das transações por usuário, conta, categoria, mês e tipo (ver resumo_mensal)"""
+    __tablename__ = 'resumo_mensal'
+    __table_args__ = (
+        db.Index('ix_resumo_mensal_user_ano_mes', 'user_id', 'ano_mes'),
+    )
+    
+    # Tabela derivada de transacao: sem chaves estrangeiras, reconstruível a qualquer momento
+    user_id = db.Column(db.Integer, primary_key=True)
+    conta_id = db.Column(db.Integer, primary_key=True)
+    categoria_id = db.Column(db.Integer, primary_key=True)
+    ano_mes = db.Column(db.Integer, primary_key=True)  # AAAAMM
+    tipo = db.Column(db.Enum(TipoTransacao), primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    
+    @staticmethod
+    def reconstruir(user_id=None):
+        """Recalcula o resumo a partir das transações gravadas (não faz commit)"""
+        return resumo_mensal.reconstruir(db.session.connection(), ResumoMensal.__table__,
+                                         Transacao.__table__, user_id=user_id)
+
+# Mantido em dia a cada inclusão, alteração ou exclusão de transação
+resumo_mensal.registrar(Transacao, ResumoMensal.__table__)
+resumo_mensal.registrar_ano_mes(Transacao)
+# Totais das contas guardados na instância até a próxima escrita de transação da conta
+saldos_contas.registrar(Conta, Transacao)
+# Descrição normalizada calculada uma vez, na gravação
+normalizacao_descricao.registrar(Transacao)
+
+
+def _insert_ignorando_duplicatas(tabela):
+    """INSERT que descarta as linhas que violariam o índice único (recorrencia_id, date(data_transacao))"""
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        # Sem alvo: o índice é de expressão, e a chave primária nunca conflita (id gerado pelo banco)
+        return insert(tabela).on_conflict_do_nothing()
+    if dialeto == 'sqlite':
+        return db.insert(tabela).prefix_with('OR IGNORE')
+    # Outros bancos: sem cláusula equivalente; o índice único ainda impede duplicatas
+    return db.insert(tabela)
+
 # === MODELO DE USUÁRIO E AUTENTICAÇÃO ===
 
 from flask_login import UserMixin
@@ -752,6 +1084,9 @@ class Usuario(UserMixin, db.Model):
     failed_login_attempts = db.Column(db.Integer, default=0)
     locked_until = db.Column(db.DateTime)
     
+    # Incrementada a cada escrita de transação, recorrência, categoria ou conta (ver cache_relatorios)
+    dados_versao = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relacionamentos com as entidades do usuário
     transacoes = db.relationship('Transacao', backref='usuario', lazy=True, cascade='all, delete-orphan')
     categorias = db.relationship('Categoria', backref='usuario', lazy=True, cascade='all, delete-orphan')
@@ -932,6 +1267,9 @@ class Usuario(UserMixin, db.Model):
     def __repr__(self):
         return f'<Usuario {self.username}>'
 
+# Relatórios em cache ficam obsoletos a cada escrita nos dados do usuário
+cache_relatorios.registrar_versao(Usuario.__table__, Transacao, TransacaoRecorrente, Categoria, Conta)
+
 
 class Tema(db.Model):
     """Modelo para armazenar temas/paletas de cores do sistema"""
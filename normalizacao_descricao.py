@@ -0,0 +1,45 @@
+"""
+Normalização das descrições de transações para agrupamento nos relatórios.
+
+Parcelas de uma mesma compra ("Notebook - Parcela 1/8", "notebook parcela 2 de 8")
+devem cair na mesma linha do relatório. A forma normalizada (sem o sufixo de
+parcela, com espaços colapsados e em minúsculas) é calculada uma única vez, na
+gravação da transação, e guardada na coluna indexada `descricao_normalizada`;
+o relatório agrupa por ela diretamente no banco.
+"""
+import re
+from sqlalchemy import event, inspect
+
+# padrão principal: 'parcela X/Y' possivelmente precedido por '-' ou similar
+_PARCELA_X_Y = re.compile(r"\s*(?:[-–—])?\s*parcela\s*\d+\s*[\\/\-]\s*\d+", re.IGNORECASE)
+# padrão alternativo: 'parcela X de Y' ou 'parcela X of Y'
+_PARCELA_X_DE_Y = re.compile(r"\s*(?:[-–—])?\s*parcela\s*\d+\s*(?:de|of)\s*\d+", re.IGNORECASE)
+# termos isolados como 'parcela X' no final
+_PARCELA_X_FINAL = re.compile(r"\s*(?:[-–—])?\s*parcela\s*\d+\s*$", re.IGNORECASE)
+
+
+def limpar_descricao(descricao):
+    """Remove da descrição os sufixos de parcela (ex: ' - Parcela 1/8', 'Parcela 1 de 8')"""
+    limpa = _PARCELA_X_Y.sub('', descricao)
+    limpa = _PARCELA_X_DE_Y.sub('', limpa)
+    limpa = _PARCELA_X_FINAL.sub('', limpa)
+    # limpar espaços redundantes e traços finais
+    return limpa.strip().rstrip('-').strip()
+
+
+def normalizar_descricao(descricao):
+    """Chave de agrupamento da descrição: sem parcela, espaços colapsados e em minúsculas"""
+    return ' '.join(limpar_descricao((descricao or '').strip()).split()).lower()
+
+
+def registrar(modelo):
+    """Preenche `descricao_normalizada` de `modelo` (Transacao) a cada inclusão e alteração da descrição"""
+
+    @event.listens_for(modelo, 'before_insert')
+    def _transacao_incluida(mapper, conn, transacao):
+        transacao.descricao_normalizada = normalizar_descricao(transacao.descricao)
+
+    @event.listens_for(modelo, 'before_update')
+    def _transacao_alterada(mapper, conn, transacao):
+        if inspect(transacao).attrs.descricao.history.has_changes():
+            transacao.descricao_normalizada = normalizar_descricao(transacao.descricao)
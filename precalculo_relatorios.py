@@ -0,0 +1,168 @@
+"""
+Pré-cálculo, em segundo plano, dos relatórios padrão após escritas.
+
+A maior parte das visitas a /relatorios é do ano atual sem filtros, e a
+primeira visita depois de uma escrita pagaria o cálculo completo. Após o
+commit de uma escrita nos dados de um usuário (ver cache_relatorios), ele é
+agendado aqui; passada a janela de espera (PRECALCULO_RELATORIOS_ESPERA, em
+segundos) sem novas escritas, uma única thread de trabalho calcula, com seu
+próprio contexto de aplicação, o relatório padrão e os totais do dashboard e
+os guarda no cache. A leitura seguinte encontra o cache pronto.
+
+Escritas em sequência (ex: importação, edição de várias transações) apenas
+adiam o cálculo do usuário: cada agendamento reinicia a janela de espera.
+Desligado com PRECALCULO_RELATORIOS = False. Com PRECALCULO_RELATORIOS_SINCRONO
+(ou com TESTING) nenhuma thread é iniciada: os usuários agendados aguardam até
+que `executar_pendentes` os calcule na thread que a chamou.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from models import db, Usuario
+
+
+class PrecalculoRelatorios:
+    """Agenda, por usuário e com janela de espera, o pré-cálculo dos relatórios padrão"""
+
+    def __init__(self, app=None, calcular=None, max_eventos=50):
+        self.app = None
+        self.calcular = calcular
+        self._condicao = threading.Condition()
+        self._agendados = {}
+        self._em_andamento = None
+        self._thread = None
+        self._eventos = deque(maxlen=max_eventos)
+        self.concluidos = 0
+        self.erros = 0
+        if app is not None:
+            self.init_app(app, calcular)
+
+    def init_app(self, app, calcular=None):
+        """
+        Args:
+            calcular: função(usuario) que calcula e guarda no cache os dados padrão
+                do usuário; chamada dentro de um contexto de aplicação
+        """
+        self.app = app
+        if calcular is not None:
+            self.calcular = calcular
+        app.config.setdefault('PRECALCULO_RELATORIOS', True)
+        app.config.setdefault('PRECALCULO_RELATORIOS_ESPERA', 5.0)
+        app.config.setdefault('PRECALCULO_RELATORIOS_SINCRONO', False)
+        app.extensions['precalculo_relatorios'] = self
+
+    @property
+    def ativo(self):
+        return bool(self.app is not None and self.app.config.get('PRECALCULO_RELATORIOS'))
+
+    @property
+    def sincrono(self):
+        return bool(self.app.config.get('PRECALCULO_RELATORIOS_SINCRONO') or self.app.testing)
+
+    @property
+    def espera(self):
+        return float(self.app.config.get('PRECALCULO_RELATORIOS_ESPERA', 5.0))
+
+    def agendar(self, user_ids):
+        """Agenda (ou adia, se já agendado) o pré-cálculo desses usuários"""
+        if not self.ativo:
+            return
+        prazo = time.monotonic() + self.espera
+        with self._condicao:
+            for user_id in user_ids:
+                self._agendados[user_id] = prazo
+            if self.sincrono:
+                return
+            self._iniciar_thread()
+            self._condicao.notify()
+
+    def executar_pendentes(self):
+        """
+        Calcula agora, na thread atual e sem esperar os prazos, todos os usuários
+        agendados (modo síncrono).
+
+        Returns:
+            Número de usuários calculados
+        """
+        with self._condicao:
+            user_ids = sorted(self._agendados, key=self._agendados.get)
+            self._agendados.clear()
+        for user_id in user_ids:
+            self._executar(user_id)
+        return len(user_ids)
+
+    def processar(self, user_id):
+        """Calcula os dados padrão do usuário em um contexto de aplicação (e sessão) próprio"""
+        with self.app.app_context():
+            try:
+                usuario = db.session.get(Usuario, user_id)
+                if usuario is not None:
+                    self.calcular(usuario)
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def situacao(self):
+        """Agendamentos pendentes, cálculo em andamento e execuções recentes (para os administradores)"""
+        agora = time.monotonic()
+        with self._condicao:
+            return {
+                'ativo': self.ativo,
+                'sincrono': self.sincrono if self.app is not None else None,
+                'espera': self.espera if self.app is not None else None,
+                'pendentes': [{'user_id': user_id, 'em_segundos': round(max(prazo - agora, 0), 1)}
+                              for user_id, prazo in sorted(self._agendados.items(), key=lambda item: item[1])],
+                'em_andamento': self._em_andamento,
+                'concluidos': self.concluidos,
+                'erros': self.erros,
+                'recentes': list(self._eventos),
+            }
+
+    def _iniciar_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._trabalhar, name='precalculo_relatorios', daemon=True)
+            self._thread.start()
+
+    def _proximo(self):
+        """Espera até o prazo do próximo usuário agendado e o retira da agenda"""
+        with self._condicao:
+            while True:
+                agora = time.monotonic()
+                if self._agendados:
+                    user_id, prazo = min(self._agendados.items(), key=lambda item: item[1])
+                    if prazo <= agora:
+                        del self._agendados[user_id]
+                        return user_id
+                    self._condicao.wait(prazo - agora)
+                else:
+                    self._condicao.wait()
+
+    def _trabalhar(self):
+        while True:
+            self._executar(self._proximo())
+
+    def _executar(self, user_id):
+        """Calcula um usuário registrando duração, erro e contadores"""
+        with self._condicao:
+            self._em_andamento = user_id
+        inicio = time.perf_counter()
+        erro = None
+        try:
+            self.processar(user_id)
+        except Exception as e:
+            erro = str(e)
+            self.app.logger.exception('Erro ao pré-calcular relatorios do usuario %s', user_id)
+        with self._condicao:
+            self._em_andamento = None
+            if erro:
+                self.erros += 1
+            else:
+                self.concluidos += 1
+            self._eventos.append({
+                'user_id': user_id,
+                'concluido_em': datetime.now().isoformat(timespec='seconds'),
+                'duracao_ms': round((time.perf_counter() - inicio) * 1000, 1),
+                'erro': erro,
+            })
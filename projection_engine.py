@@ -0,0 +1,77 @@
+"""
+Motor de projeção em lote das transações recorrentes de um usuário
+"""
+import heapq
+from sqlalchemy.orm import joinedload
+from models import TransacaoRecorrente, StatusRecorrencia
+
+
+class ProjectionEngine:
+    """
+    Projeta todas as recorrências ativas de um usuário em uma única passada.
+
+    Carrega em uma consulta as recorrências ativas (com categoria, conta e forma
+    de pagamento); a última ocorrência já gravada vem da marca d'água de cada
+    recorrência. A partir daí cada janela pedida é projetada sem novas idas ao
+    banco, e as projeções de todas as recorrências são entregues como um único
+    fluxo ordenado por data.
+    """
+
+    def __init__(self, recorrentes):
+        self.recorrentes = {r.id: r for r in recorrentes}
+
+    @classmethod
+    def carregar(cls, user_id, conta_ids=None):
+        """
+        Carrega as recorrências ativas do usuário.
+
+        Args:
+            user_id (int): ID do usuário
+            conta_ids (list): se informado, considera apenas recorrências dessas contas
+        """
+        query = TransacaoRecorrente.query.options(
+            joinedload(TransacaoRecorrente.categoria),
+            joinedload(TransacaoRecorrente.conta),
+            joinedload(TransacaoRecorrente.forma_pagamento)
+        ).filter(
+            TransacaoRecorrente.user_id == user_id,
+            TransacaoRecorrente.status == StatusRecorrencia.ATIVA
+        )
+        if conta_ids is not None:
+            query = query.filter(TransacaoRecorrente.conta_id.in_(conta_ids))
+        return cls(query.all())
+
+    def __len__(self):
+        return len(self.recorrentes)
+
+    def lotes(self, inicio, fim, ate_data_fim=False):
+        """
+        Projeta as ocorrências de cada recorrência dentro de [inicio, fim] em forma compacta.
+
+        Args:
+            inicio (datetime): início da janela (inclusivo)
+            fim (datetime): fim da janela (inclusivo)
+            ate_data_fim (bool): se True, recorrências com data_fim são projetadas
+                até a própria data_fim, mesmo que ela ultrapasse `fim`
+
+        Returns:
+            Lista de ProjecoesRecorrencia, uma por recorrência
+        """
+        lotes = []
+        for recorrente in self.recorrentes.values():
+            fim_recorrente = fim
+            if ate_data_fim and recorrente.data_fim:
+                fim_recorrente = recorrente.data_fim
+            lotes.append(recorrente.projetar_intervalo(inicio, fim_recorrente))
+        return lotes
+
+    def projetar(self, inicio, fim, ate_data_fim=False):
+        """
+        Projeta as ocorrências de todas as recorrências dentro de [inicio, fim].
+
+        Args: os mesmos de `lotes`
+
+        Returns:
+            Iterador de projeções (TransacaoProjetada) em ordem de data
+        """
+        return heapq.merge(*self.lotes(inicio, fim, ate_data_fim), key=lambda p: p.data_transacao)
@@ -0,0 +1,142 @@
+"""
+Rastreio amostrado da geração e projeção de transações recorrentes.
+
+Substitui os print() de depuração do motor de recorrências: em vez de escrever
+no stdout a cada iteração, cada execução amostrada acumula contadores
+(iterações, projetadas, materializadas, duplicatas ignoradas, tempo) por
+recorrência, consultáveis pelos administradores.
+
+As amostras ficam na memória do processo: com vários workers (gunicorn), cada
+um tem seus próprios totais e sua própria configuração, e a consulta mostra só
+os do worker que a atendeu (identificado pelo `pid` no resumo).
+
+Desligado por padrão. Com o rastreio desligado (ou a execução fora da amostra)
+`iniciar` devolve None e o chamador não formata nem registra nada:
+
+    amostra = rastreio.iniciar(self.id, 'geracao')
+    ...
+    if amostra:
+        amostra.projetadas += 1
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Amostra:
+    """Contadores de uma execução rastreada (geração ou projeção) de uma recorrência"""
+
+    __slots__ = ('recorrencia_id', 'operacao', 'iteracoes', 'projetadas',
+                 'materializadas', 'duplicadas', 'inicio', '_rastreio')
+
+    def __init__(self, rastreio, recorrencia_id, operacao):
+        self._rastreio = rastreio
+        self.recorrencia_id = recorrencia_id
+        self.operacao = operacao
+        self.iteracoes = 0
+        self.projetadas = 0
+        self.materializadas = 0
+        self.duplicadas = 0
+        self.inicio = time.perf_counter()
+
+    def finalizar(self, motivo=None):
+        """Encerra a execução e acumula seus contadores nos totais da recorrência"""
+        self._rastreio._registrar(self, time.perf_counter() - self.inicio, motivo)
+
+
+class RastreioRecorrencias:
+    """
+    Coletor, por processo, das amostras de geração de recorrências.
+
+    Attributes:
+        ativo (bool): se False, nenhuma execução é rastreada
+        taxa (float): fração das execuções rastreadas (0 a 1) quando ativo
+    """
+
+    def __init__(self, ativo=False, taxa=1.0, max_eventos=200):
+        self.ativo = ativo
+        self.taxa = taxa
+        self._lock = threading.Lock()
+        self._totais = {}
+        self._eventos = deque(maxlen=max_eventos)
+
+    def init_app(self, app):
+        """Lê RASTREIO_RECORRENCIAS e RASTREIO_RECORRENCIAS_TAXA da configuração da aplicação"""
+        app.config.setdefault('RASTREIO_RECORRENCIAS', False)
+        app.config.setdefault('RASTREIO_RECORRENCIAS_TAXA', 1.0)
+        self.configurar(app.config['RASTREIO_RECORRENCIAS'], app.config['RASTREIO_RECORRENCIAS_TAXA'])
+        app.extensions['rastreio_recorrencias'] = self
+
+    def configurar(self, ativo, taxa=None):
+        if taxa is not None:
+            self.taxa = min(max(float(taxa), 0.0), 1.0)
+        self.ativo = bool(ativo)
+
+    def iniciar(self, recorrencia_id, operacao):
+        """
+        Começa a rastrear uma execução.
+
+        Returns:
+            Amostra, ou None se o rastreio estiver desligado ou a execução ficar fora da amostra
+        """
+        if not self.ativo:
+            return None
+        if self.taxa < 1.0 and random.random() >= self.taxa:
+            return None
+        return Amostra(self, recorrencia_id, operacao)
+
+    def _registrar(self, amostra, duracao, motivo):
+        with self._lock:
+            totais = self._totais.get(amostra.recorrencia_id)
+            if totais is None:
+                totais = self._totais[amostra.recorrencia_id] = {
+                    'execucoes': 0, 'iteracoes': 0, 'projetadas': 0,
+                    'materializadas': 0, 'duplicadas': 0, 'tempo_ms': 0.0,
+                }
+            totais['execucoes'] += 1
+            totais['iteracoes'] += amostra.iteracoes
+            totais['projetadas'] += amostra.projetadas
+            totais['materializadas'] += amostra.materializadas
+            totais['duplicadas'] += amostra.duplicadas
+            totais['tempo_ms'] += duracao * 1000
+            self._eventos.append({
+                'recorrencia_id': amostra.recorrencia_id,
+                'operacao': amostra.operacao,
+                'iteracoes': amostra.iteracoes,
+                'projetadas': amostra.projetadas,
+                'materializadas': amostra.materializadas,
+                'duplicadas': amostra.duplicadas,
+                'tempo_ms': round(duracao * 1000, 3),
+                'motivo': motivo,
+                'em': time.time(),
+            })
+        logger.debug('Recorrencia %s (%s): %s iteracao(oes), %s projetada(s), %s materializada(s), %s duplicada(s) em %.3f ms%s',
+                     amostra.recorrencia_id, amostra.operacao, amostra.iteracoes, amostra.projetadas,
+                     amostra.materializadas, amostra.duplicadas, duracao * 1000,
+                     f' ({motivo})' if motivo else '')
+
+    def resumo(self):
+        """Configuração, totais por recorrência e execuções recentes deste processo, prontos para JSON"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'escopo': 'processo',
+                'ativo': self.ativo,
+                'taxa': self.taxa,
+                'recorrencias': {recorrencia_id: dict(totais, tempo_ms=round(totais['tempo_ms'], 3))
+                                 for recorrencia_id, totais in self._totais.items()},
+                'eventos': list(self._eventos),
+            }
+
+    def limpar(self):
+        with self._lock:
+            self._totais.clear()
+            self._eventos.clear()
+
+
+rastreio = RastreioRecorrencias()
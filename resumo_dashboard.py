@@ -0,0 +1,109 @@
+"""
+Dados do dashboard em poucas consultas.
+
+Os totais de receitas e despesas (de todo o período, do mês e do mês em
+diante) saem de uma única consulta ao resumo mensal com somas condicionais
+(SUM(CASE ...)) por tipo e período, e a evolução diária do mês sai de uma
+única consulta às transações agrupada por dia, com receitas e despesas lado a
+lado. A comparação entre meses (totais_mensais) também é uma única consulta
+agrupada por mês, qualquer que seja o número de meses.
+
+As funções recebem a sessão e os modelos, então servem tanto ao app.py
+(models) quanto ao pacote app (DashboardService).
+"""
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import and_, case, extract, func
+
+from resumo_mensal import ano_mes
+
+
+def _soma(valor, condicao):
+    return func.coalesce(func.sum(case((condicao, valor), else_=0)), 0)
+
+
+def totais(sessao, resumo, user_id, mes):
+    """
+    Totais do dashboard do usuário em uma única consulta ao resumo mensal.
+
+    Args:
+        resumo: modelo ResumoMensal
+        mes (int): mês de referência no formato AAAAMM
+
+    Returns:
+        dict com receitas_total, despesas_total (todo o período), receitas_mes,
+        despesas_mes (só o mês) e receitas_desde_mes, despesas_desde_mes (o mês
+        e os lançamentos futuros)
+    """
+    tipos = resumo.tipo.type.enum_class
+    receita = resumo.tipo == tipos.RECEITA
+    despesa = resumo.tipo == tipos.DESPESA
+    no_mes = resumo.ano_mes == mes
+    desde_mes = resumo.ano_mes >= mes
+    linha = sessao.query(
+        _soma(resumo.total, receita),
+        _soma(resumo.total, despesa),
+        _soma(resumo.total, and_(receita, no_mes)),
+        _soma(resumo.total, and_(despesa, no_mes)),
+        _soma(resumo.total, and_(receita, desde_mes)),
+        _soma(resumo.total, and_(despesa, desde_mes)),
+    ).filter(resumo.user_id == user_id).one()
+    chaves = ('receitas_total', 'despesas_total', 'receitas_mes', 'despesas_mes',
+              'receitas_desde_mes', 'despesas_desde_mes')
+    return {chave: float(valor or 0) for chave, valor in zip(chaves, linha)}
+
+
+def serie_diaria(sessao, transacao, user_id, inicio, fim):
+    """
+    Receitas e despesas do usuário por dia do mês, em uma única consulta agrupada.
+
+    Args:
+        transacao: modelo Transacao
+        inicio, fim (datetime): período (inclusive)
+
+    Returns:
+        {dia do mês: (receitas, despesas)}, só com os dias que tiveram transações
+    """
+    tipos = transacao.tipo.type.enum_class
+    dia = extract('day', transacao.data_transacao)
+    linhas = sessao.query(
+        dia,
+        _soma(transacao.valor, transacao.tipo == tipos.RECEITA),
+        _soma(transacao.valor, transacao.tipo == tipos.DESPESA),
+    ).filter(
+        transacao.user_id == user_id,
+        transacao.data_transacao >= inicio,
+        transacao.data_transacao <= fim
+    ).group_by(dia).all()
+    return {int(d): (float(receitas), float(despesas)) for d, receitas, despesas in linhas}
+
+
+def totais_mensais(sessao, resumo, user_id, ultimo_mes, meses):
+    """
+    Receitas e despesas dos últimos `meses` meses até `ultimo_mes` (inclusive), em uma
+    única consulta ao resumo mensal agrupada por mês; meses sem lançamentos vêm zerados.
+
+    Args:
+        resumo: modelo ResumoMensal
+        ultimo_mes (date): qualquer dia do último mês da série
+        meses (int): quantidade de meses (pode cobrir vários anos)
+
+    Returns:
+        Lista de (primeiro dia do mês, receitas, despesas), do mês mais antigo ao mais recente
+    """
+    ultimo = ultimo_mes.replace(day=1)
+    primeiros_dias = [ultimo - relativedelta(months=i) for i in range(meses - 1, -1, -1)]
+    if not primeiros_dias:
+        return []
+
+    tipos = resumo.tipo.type.enum_class
+    linhas = sessao.query(
+        resumo.ano_mes,
+        _soma(resumo.total, resumo.tipo == tipos.RECEITA),
+        _soma(resumo.total, resumo.tipo == tipos.DESPESA),
+    ).filter(
+        resumo.user_id == user_id,
+        resumo.ano_mes >= ano_mes(primeiros_dias[0]),
+        resumo.ano_mes <= ano_mes(ultimo)
+    ).group_by(resumo.ano_mes).all()
+    por_mes = {mes: (float(receitas), float(despesas)) for mes, receitas, despesas in linhas}
+    return [(dia,) + por_mes.get(ano_mes(dia), (0.0, 0.0)) for dia in primeiros_dias]
@@ -0,0 +1,166 @@
+"""
+Resumo mensal das transações, mantido de forma incremental.
+
+A tabela de resumo guarda, para cada (user_id, conta_id, categoria_id, ano_mes,
+tipo), a soma dos valores e a quantidade de transações. Ela é atualizada na
+mesma transação de banco de cada inclusão, alteração ou exclusão de Transacao
+(eventos do mapeador), então dashboards e gráficos podem ler totais mensais
+sem varrer a tabela de transações: o custo passa a depender de meses x
+categorias, não do número de transações.
+
+Escritas que não passam pelo ORM (INSERT em lote, query.update/delete) devem
+chamar `aplicar` com os deltas correspondentes, ou `reconstruir` depois.
+"""
+from datetime import datetime
+
+from sqlalchemy import Integer, cast, event, extract, func, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+CHAVE = ('user_id', 'conta_id', 'categoria_id', 'ano_mes', 'tipo')
+
+
+def ano_mes(data):
+    """Mês de uma data no formato inteiro AAAAMM (ex: 202503)"""
+    return data.year * 100 + data.month
+
+
+def ano_mes_sql(data):
+    """Expressão SQL do mês AAAAMM de uma coluna de data, a mesma em SQLite e PostgreSQL"""
+    return cast(extract('year', data), Integer) * 100 + cast(extract('month', data), Integer)
+
+
+def chave(user_id, conta_id, categoria_id, data, tipo):
+    return (user_id, conta_id, categoria_id, ano_mes(data), tipo)
+
+
+def somar(deltas, chave_resumo, valor, quantidade=1):
+    """Acumula em `deltas` a variação de uma chave do resumo"""
+    total, n = deltas.get(chave_resumo, (0, 0))
+    deltas[chave_resumo] = (total + valor, n + quantidade)
+
+
+def aplicar(conn, tabela, deltas):
+    """
+    Soma os deltas {chave: (valor, quantidade)} às linhas do resumo, criando as que
+    faltarem e removendo as que ficarem sem transações.
+    """
+    linhas = [dict(zip(CHAVE, k), total=valor, quantidade=quantidade)
+              for k, (valor, quantidade) in deltas.items() if valor or quantidade]
+    if not linhas:
+        return
+
+    dialeto = {'postgresql': postgresql, 'sqlite': sqlite}.get(conn.dialect.name)
+    if dialeto is not None:
+        stmt = dialeto.insert(tabela)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[tabela.c[coluna] for coluna in CHAVE],
+            set_={'total': tabela.c.total + stmt.excluded.total,
+                  'quantidade': tabela.c.quantidade + stmt.excluded.quantidade}
+        )
+        conn.execute(stmt, linhas)
+    else:
+        for linha in linhas:
+            filtro = [tabela.c[coluna] == linha[coluna] for coluna in CHAVE]
+            atualizadas = conn.execute(tabela.update().where(*filtro).values(
+                total=tabela.c.total + linha['total'],
+                quantidade=tabela.c.quantidade + linha['quantidade']
+            )).rowcount
+            if not atualizadas:
+                conn.execute(tabela.insert().values(**linha))
+
+    if any(linha['quantidade'] < 0 for linha in linhas):
+        conn.execute(tabela.delete().where(tabela.c.quantidade <= 0))
+
+
+def reconstruir(conn, tabela, transacoes, user_id=None):
+    """
+    Recalcula o resumo a partir da tabela de transações (de todos os usuários ou
+    apenas de `user_id`).
+
+    Returns:
+        Número de linhas do resumo gravadas
+    """
+    apagar = tabela.delete()
+    if user_id is not None:
+        apagar = apagar.where(tabela.c.user_id == user_id)
+    conn.execute(apagar)
+
+    mes = ano_mes_sql(transacoes.c.data_transacao)
+    origem = select(
+        transacoes.c.user_id, transacoes.c.conta_id, transacoes.c.categoria_id, mes, transacoes.c.tipo,
+        func.sum(transacoes.c.valor), func.count()
+    ).group_by(transacoes.c.user_id, transacoes.c.conta_id, transacoes.c.categoria_id, mes, transacoes.c.tipo)
+    if user_id is not None:
+        origem = origem.where(transacoes.c.user_id == user_id)
+    return conn.execute(tabela.insert().from_select(list(CHAVE) + ['total', 'quantidade'], origem)).rowcount
+
+
+ATRIBUTOS = ('user_id', 'conta_id', 'categoria_id', 'data_transacao', 'tipo', 'valor')
+
+
+def _valor_anterior(estado, atributo):
+    historico = estado.attrs[atributo].history
+    return historico.deleted[0] if historico.deleted else getattr(estado.object, atributo)
+
+
+def _chave_da_transacao(transacao, anterior=False):
+    if anterior:
+        estado = inspect(transacao)
+        valores = [_valor_anterior(estado, a) for a in ATRIBUTOS]
+    else:
+        valores = [transacao.user_id, transacao.conta_id, transacao.categoria_id,
+                   transacao.data_transacao, transacao.tipo, transacao.valor]
+    *campos, valor = valores
+    return chave(*campos), valor
+
+
+def registrar(modelo, tabela):
+    """Mantém `tabela` em dia com as inclusões, alterações e exclusões de `modelo` (Transacao)"""
+
+    def _carregar_valor_anterior(transacao, valor, anterior, iniciador):
+        return valor
+
+    # Sem active_history, atribuir a um atributo expirado (ex: depois de um commit) não
+    # carrega o valor antigo, e a alteração não saberia de qual linha do resumo subtrair
+    for atributo in ATRIBUTOS:
+        event.listen(getattr(modelo, atributo), 'set', _carregar_valor_anterior, retval=True, active_history=True)
+
+    @event.listens_for(modelo, 'after_insert')
+    def _transacao_incluida(mapper, conn, transacao):
+        chave_nova, valor = _chave_da_transacao(transacao)
+        aplicar(conn, tabela, {chave_nova: (valor, 1)})
+
+    @event.listens_for(modelo, 'after_update')
+    def _transacao_alterada(mapper, conn, transacao):
+        chave_antiga, valor_antigo = _chave_da_transacao(transacao, anterior=True)
+        chave_nova, valor_novo = _chave_da_transacao(transacao)
+        if chave_antiga == chave_nova and valor_antigo == valor_novo:
+            return
+        deltas = {}
+        somar(deltas, chave_antiga, -valor_antigo, -1)
+        somar(deltas, chave_nova, valor_novo, 1)
+        aplicar(conn, tabela, deltas)
+
+    @event.listens_for(modelo, 'after_delete')
+    def _transacao_excluida(mapper, conn, transacao):
+        chave_antiga, valor = _chave_da_transacao(transacao, anterior=True)
+        aplicar(conn, tabela, {chave_antiga: (-valor, -1)})
+
+
+def registrar_ano_mes(modelo):
+    """
+    Grava em `ano_mes` de `modelo` (Transacao) o mês AAAAMM de data_transacao a cada
+    inclusão e mudança de data, para filtrar e agrupar por mês sem funções de data do banco.
+    """
+
+    @event.listens_for(modelo, 'before_insert')
+    def _transacao_incluida(mapper, conn, transacao):
+        if transacao.data_transacao is None:
+            # o mesmo padrão da coluna, aplicado aqui para já calcular o mês
+            transacao.data_transacao = datetime.utcnow()
+        transacao.ano_mes = ano_mes(transacao.data_transacao)
+
+    @event.listens_for(modelo, 'before_update')
+    def _transacao_alterada(mapper, conn, transacao):
+        if inspect(transacao).attrs.data_transacao.history.has_changes():
+            transacao.ano_mes = ano_mes(transacao.data_transacao)
@@ -0,0 +1,209 @@
+"""
+Saldos das contas calculados no banco, em lote.
+
+Receitas, despesas e quantidade de transações de várias contas saem de uma
+única consulta agrupada por conta sobre o resumo mensal (ver resumo_mensal),
+sem carregar as transações: o custo depende de meses x categorias de cada
+conta, não do número de transações.
+
+Os totais ficam guardados na própria instância da conta (ver `carregar`) até
+que uma transação da conta seja incluída, alterada ou excluída, ou a instância
+expire (commit, rollback, session.expire). Escritas que não passam pelo ORM
+devem chamar `invalidar` com as contas afetadas. Uma conta fora de qualquer
+sessão (desanexada) não recebe esses avisos: seus totais são consultados pela
+sessão informada, usando o id da conta, a cada acesso, sem ficar guardados.
+
+O saldo de uma conta em uma data (e a série de saldos diários de um período)
+parte de um ponto de controle mensal: o saldo no início do mês, que é o saldo
+inicial mais as somas dos meses anteriores no resumo mensal, já mantido a cada
+escrita. Daí basta somar as transações do próprio mês até a data, que o índice
+(user_id, ano_mes) de transacao limita a um único mês. Nenhum saldo acumulado é
+gravado: uma escrita retroativa ou a alteração do saldo inicial não exigem
+reescrever os saldos dos meses seguintes.
+
+As funções recebem os modelos, então servem tanto ao models quanto ao pacote app.
+"""
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Date, case, event, func, inspect
+from sqlalchemy.orm import object_session
+
+from resumo_mensal import ano_mes
+
+_ATRIBUTO = '_totais_conta'
+_VAZIO = (0.0, 0.0, 0)
+
+
+def totais(sessao, resumo, conta_ids):
+    """
+    Receitas, despesas e quantidade de transações por conta, em uma única consulta.
+
+    Args:
+        resumo: modelo ResumoMensal
+        conta_ids: ids das contas
+
+    Returns:
+        {conta_id: (receitas, despesas, quantidade)}, com todas as contas pedidas
+    """
+    conta_ids = sorted(set(conta_ids))
+    if not conta_ids:
+        return {}
+    tipos = resumo.tipo.type.enum_class
+    linhas = sessao.query(
+        resumo.conta_id,
+        func.coalesce(func.sum(case((resumo.tipo == tipos.RECEITA, resumo.total), else_=0)), 0),
+        func.coalesce(func.sum(case((resumo.tipo == tipos.DESPESA, resumo.total), else_=0)), 0),
+        func.coalesce(func.sum(resumo.quantidade), 0),
+    ).filter(resumo.conta_id.in_(conta_ids)).group_by(resumo.conta_id).all()
+    por_conta = dict.fromkeys(conta_ids, _VAZIO)
+    por_conta.update({conta_id: (float(receitas), float(despesas), int(quantidade))
+                      for conta_id, receitas, despesas, quantidade in linhas})
+    return por_conta
+
+
+def saldo_inicio_mes(sessao, resumo, conta, mes):
+    """
+    Ponto de controle: saldo da conta no início do mês, antes das transações do mês.
+
+    Args:
+        resumo: modelo ResumoMensal
+        mes (int): mês no formato AAAAMM
+    """
+    tipos = resumo.tipo.type.enum_class
+    variacao = sessao.query(
+        func.coalesce(func.sum(case((resumo.tipo == tipos.RECEITA, resumo.total),
+                                    (resumo.tipo == tipos.DESPESA, -resumo.total), else_=0)), 0)
+    ).filter(
+        resumo.user_id == conta.user_id,
+        resumo.conta_id == conta.id,
+        resumo.ano_mes < mes
+    ).scalar()
+    return (conta.saldo_inicial or 0.0) + float(variacao)
+
+
+def serie_diaria(sessao, resumo, transacao, conta, inicio, fim):
+    """
+    Saldo da conta ao fim de cada dia do período: o ponto de controle do mês de
+    `inicio` mais as transações, dia a dia, do primeiro dia desse mês até `fim`.
+    Duas consultas, qualquer que seja o tamanho do período ou do histórico.
+
+    Args:
+        resumo, transacao: modelos ResumoMensal e Transacao
+        inicio, fim (date): período (inclusive)
+
+    Returns:
+        Lista de (dia, saldo), um item por dia do período
+    """
+    if isinstance(inicio, datetime):
+        inicio = inicio.date()
+    if isinstance(fim, datetime):
+        fim = fim.date()
+    if fim < inicio:
+        return []
+
+    primeiro_dia = inicio.replace(day=1)
+    saldo = saldo_inicio_mes(sessao, resumo, conta, ano_mes(primeiro_dia))
+
+    tipos = transacao.tipo.type.enum_class
+    dia = func.date(transacao.data_transacao, type_=Date)
+    linhas = sessao.query(
+        dia,
+        func.sum(case((transacao.tipo == tipos.RECEITA, transacao.valor),
+                      (transacao.tipo == tipos.DESPESA, -transacao.valor), else_=0)),
+    ).filter(
+        transacao.user_id == conta.user_id,
+        transacao.conta_id == conta.id,
+        transacao.ano_mes.between(ano_mes(primeiro_dia), ano_mes(fim)),
+        transacao.data_transacao >= datetime.combine(primeiro_dia, time.min),
+        transacao.data_transacao < datetime.combine(fim + timedelta(days=1), time.min)
+    ).group_by(dia).all()
+    variacoes = {_como_data(d): float(v or 0) for d, v in linhas}
+
+    serie = []
+    atual = primeiro_dia
+    while atual <= fim:
+        saldo += variacoes.get(atual, 0.0)
+        if atual >= inicio:
+            serie.append((atual, round(saldo, 2)))
+        atual += timedelta(days=1)
+    return serie
+
+
+def saldo_em(sessao, resumo, transacao, conta, data):
+    """Saldo da conta ao fim do dia `data`"""
+    return serie_diaria(sessao, resumo, transacao, conta, data, data)[0][1]
+
+
+def _como_data(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def carregar(resumo, contas):
+    """
+    Calcula, em uma única consulta, os totais das contas que ainda não os têm
+    guardados e os guarda em cada instância. Contas desanexadas ficam de fora
+    (ver `obter`).
+
+    Returns:
+        As próprias contas
+    """
+    contas = list(contas)
+    pendentes = [conta for conta in contas if conta.__dict__.get(_ATRIBUTO) is None]
+    # Contas novas, ainda sem id, não têm transações gravadas
+    por_sessao = {}
+    for conta in pendentes:
+        if conta.id is None:
+            conta.__dict__[_ATRIBUTO] = _VAZIO
+        elif object_session(conta) is not None:
+            por_sessao.setdefault(object_session(conta), []).append(conta)
+    for sessao, grupo in por_sessao.items():
+        calculados = totais(sessao, resumo, [conta.id for conta in grupo])
+        for conta in grupo:
+            conta.__dict__[_ATRIBUTO] = calculados[conta.id]
+    return contas
+
+
+def obter(sessao, resumo, conta):
+    """(receitas, despesas, quantidade) da conta, calculados uma vez por instância (a cada acesso, se desanexada)"""
+    valor = conta.__dict__.get(_ATRIBUTO)
+    if valor is None:
+        if conta.id is not None and object_session(conta) is None:
+            return totais(sessao, resumo, [conta.id])[conta.id]
+        carregar(resumo, [conta])
+        valor = conta.__dict__[_ATRIBUTO]
+    return valor
+
+
+def invalidar(sessao, modelo_conta, conta_ids):
+    """Descarta os totais guardados dessas contas, se carregadas na sessão"""
+    for conta_id in set(conta_ids):
+        if conta_id is None:
+            continue
+        conta = sessao.identity_map.get(inspect(modelo_conta).identity_key_from_primary_key((conta_id,)))
+        if conta is not None:
+            conta.__dict__.pop(_ATRIBUTO, None)
+
+
+def registrar(modelo_conta, modelo_transacao):
+    """
+    Mantém válidos os totais guardados nas instâncias de `modelo_conta`:
+    descarta-os quando uma transação da conta muda e quando a instância expira.
+    """
+
+    def _transacao_alterada(mapper, conn, alvo):
+        sessao = object_session(alvo)
+        if sessao is None:
+            return
+        historico = inspect(alvo).attrs.conta_id.history
+        invalidar(sessao, modelo_conta, [alvo.conta_id, *historico.deleted])
+
+    for evento in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(modelo_transacao, evento, _transacao_alterada)
+
+    @event.listens_for(modelo_conta, 'expire')
+    def _conta_expirada(alvo, atributos):
+        alvo.__dict__.pop(_ATRIBUTO, None)
@@ -49,47 +49,28 @@ def init_scheduler(app):
         app.logger.error(f"❌ Erro ao inicializar o agendador de tarefas: {str(e)}")
 
 def gerar_todas_transacoes_recorrentes(app):
-    """Gera todas as transações pendentes de todas as recorrências ativas"""
+    """Enfileira todas as recorrências ativas para materialização das transações vencidas"""
     with app.app_context():
         try:
             from models import TransacaoRecorrente, StatusRecorrencia, db
             
-            # Usar 12 meses como padrão para o horizonte futuro
-            meses_futuros = 12
+            fila = app.extensions['materializacao']
             
-            app.logger.info(f"🔄 Iniciando geração automática de transações recorrentes (horizonte: {meses_futuros} meses)")
-            
-            # Buscar todas as recorrências ativas
-            recorrentes_ativas = TransacaoRecorrente.query.filter_by(
+            # Buscar apenas os IDs das recorrências ativas; a geração é feita pela fila
+            recorrentes_ids = [r.id for r in db.session.query(TransacaoRecorrente.id).filter_by(
                 status=StatusRecorrencia.ATIVA
-            ).all()
-            
-            total_recorrentes = len(recorrentes_ativas)
-            total_transacoes_geradas = 0
+            )]
             
-            app.logger.info(f"📊 Processando {total_recorrentes} transações recorrentes ativas")
+            total_recorrentes = len(recorrentes_ids)
+            app.logger.info(f"🔄 Enfileirando {total_recorrentes} transações recorrentes ativas para geração automática")
             
-            # Processar cada recorrência
-            for recorrente in recorrentes_ativas:
-                try:
-                    # No caso do scheduler (que gera automaticamente), não projetamos as transações, criamos direto
-                    transacoes_geradas = recorrente.gerar_transacoes_pendentes(meses_futuros=meses_futuros, apenas_projetar=False)
-                    total_transacoes_geradas += len(transacoes_geradas)
-                    
-                    if len(transacoes_geradas) > 0:
-                        if recorrente.data_fim:
-                            app.logger.info(f"✅ Recorrência #{recorrente.id} ({recorrente.descricao}): {len(transacoes_geradas)} transação(ões) gerada(s) até {recorrente.data_fim.strftime('%d/%m/%Y')}")
-                        else:
-                            app.logger.info(f"✅ Recorrência #{recorrente.id} ({recorrente.descricao}): {len(transacoes_geradas)} transação(ões) gerada(s) para os próximos {meses_futuros} meses")
-                except Exception as e:
-                    app.logger.error(f"❌ Erro ao processar recorrência #{recorrente.id}: {str(e)}")
+            total_enfileiradas = fila.enfileirar_varias(recorrentes_ids)
             
-            app.logger.info(f"✅ Geração automática concluída: {total_transacoes_geradas} transação(ões) gerada(s) no total")
+            app.logger.info(f"✅ {total_enfileiradas} recorrência(s) enfileirada(s) ({total_recorrentes - total_enfileiradas} já aguardavam processamento)")
             
             return {
                 'recorrentes_processadas': total_recorrentes,
-                'transacoes_geradas': total_transacoes_geradas,
-                'meses_futuros': meses_futuros
+                'recorrentes_enfileiradas': total_enfileiradas
             }
             
         except Exception as e:
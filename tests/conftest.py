@@ -0,0 +1,80 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from models import db, Usuario, Conta
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Aplicação mínima com o `db` de models em um SQLite temporário, tabelas criadas e contexto ativo"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'teste.db')
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture(scope='session')
+def modulo_app(tmp_path_factory):
+    """app.py carregado uma única vez na sessão de testes, com um banco SQLite temporário"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATABASE_URL', 'sqlite:///' + str(tmp_path_factory.mktemp('app_principal') / 'app.db'))
+        # config.Config lê DATABASE_URL na importação
+        mp.delitem(sys.modules, 'config', raising=False)
+        spec = importlib.util.spec_from_file_location('app_principal', os.path.join(RAIZ, 'app.py'))
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+    modulo.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return modulo
+
+
+@pytest.fixture
+def app_principal(modulo_app):
+    """
+    A aplicação de app.py, com as tabelas recriadas, o cache de relatórios vazio
+    e o contexto ativo. Para usá-la no lugar de `app` (e com `usuario`, `conta`
+    e `cliente`), o módulo de teste redefine a fixture `app` retornando esta.
+    """
+    app = modulo_app.app
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        modulo_app.cache_relatorios.limpar()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def usuario(app):
+    u = Usuario(username='teste', email='teste@example.com')
+    u.set_password('x')
+    u.email_verified = True
+    db.session.add(u)
+    db.session.commit()
+    return u
+
+
+@pytest.fixture
+def conta(usuario):
+    c = Conta(nome='Conta', user_id=usuario.id)
+    db.session.add(c)
+    db.session.commit()
+    return c
+
+
+@pytest.fixture
+def cliente(app, usuario):
+    """Cliente de teste com `usuario` logado"""
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = str(usuario.id)
+    return cliente
@@ -0,0 +1,71 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import agenda_recorrencia as agenda
+
+
+def test_mensal_ancorado_na_data_inicio():
+    # Datas no fim do mês não devem "escorregar" (31/01 -> 28/02 -> 31/03)
+    inicio = datetime(2025, 1, 31)
+    ocorrencias = agenda.calcular_ocorrencias('mensal', inicio, datetime(2025, 1, 1), datetime(2025, 4, 30))
+    assert ocorrencias.datas() == [datetime(2025, 1, 31), datetime(2025, 2, 28), datetime(2025, 3, 31), datetime(2025, 4, 30)]
+    assert ocorrencias.indice_inicial == 0
+
+
+def test_indice_do_periodo_tolera_datas_recuadas_pelo_calculo_antigo():
+    inicio = datetime(2025, 1, 31)
+    # Sequência antiga 31/01 -> 28/02 -> 28/03 -> 28/04: cada linha fica no índice do seu mês
+    assert [agenda.indice_do_periodo('mensal', inicio, datetime(2025, m, 28)) for m in (2, 3, 4)] == [1, 2, 3]
+    assert agenda.ultimo_indice('mensal', inicio, datetime(2025, 4, 28)) == 2
+    assert agenda.indice_do_periodo('trimestral', inicio, datetime(2025, 7, 30)) == 2
+    # Fora dos meses do calendário e com passo em dias, vale o último índice
+    assert agenda.indice_do_periodo('trimestral', inicio, datetime(2025, 5, 10)) == 1
+    assert agenda.indice_do_periodo('semanal', inicio, datetime(2025, 2, 13)) == 1
+    assert agenda.indice_do_periodo('mensal', inicio, datetime(2025, 1, 30)) == -1
+
+
+def test_janela_distante_calcula_indices_diretamente():
+    inicio = datetime(2000, 3, 10, 8, 30)
+    ocorrencias = agenda.calcular_ocorrencias('mensal', inicio, datetime(2030, 6, 1), datetime(2030, 8, 31))
+    assert [i for i, _ in ocorrencias] == [363, 364, 365]
+    assert ocorrencias.datas()[0] == datetime(2030, 6, 10, 8, 30)
+
+
+def test_semanal_e_quinzenal():
+    inicio = datetime(2025, 1, 1)
+    semanal = agenda.calcular_ocorrencias('semanal', inicio, datetime(2025, 1, 9), datetime(2025, 1, 31))
+    assert semanal.datas() == [datetime(2025, 1, 15), datetime(2025, 1, 22), datetime(2025, 1, 29)]
+    assert semanal.indice_inicial == 2
+    quinzenal = agenda.calcular_ocorrencias('quinzenal', inicio, datetime(2025, 1, 1), datetime(2025, 2, 1))
+    assert quinzenal.datas() == [datetime(2025, 1, 1), datetime(2025, 1, 16), datetime(2025, 1, 31)]
+
+
+def test_respeita_data_fim_total_parcelas_e_indice_minimo():
+    inicio = datetime(2025, 1, 5)
+    com_fim = agenda.calcular_ocorrencias('mensal', inicio, inicio, datetime(2026, 1, 1), data_fim=datetime(2025, 3, 5))
+    assert len(com_fim) == 3
+    parcelada = agenda.calcular_ocorrencias('trimestral', inicio, inicio, datetime(2030, 1, 1), total_parcelas=4)
+    assert parcelada.indice_final == 3
+    assert parcelada.datas()[-1] == datetime(2025, 10, 5)
+    apos = agenda.calcular_ocorrencias('anual', inicio, inicio, datetime(2030, 1, 1), indice_minimo=3)
+    assert apos.datas()[0] == datetime(2028, 1, 5)
+
+
+def test_unica_e_indice_da_data():
+    inicio = datetime(2025, 5, 20)
+    assert agenda.calcular_ocorrencias('unica', inicio, datetime(2025, 1, 1), datetime(2026, 1, 1)).datas() == [inicio]
+    assert len(agenda.calcular_ocorrencias('unica', inicio, datetime(2025, 6, 1), datetime(2026, 1, 1))) == 0
+    assert agenda.indice_da_data('semestral', inicio, datetime(2026, 5, 20)) == 2
+    assert agenda.indice_da_data('semestral', inicio, datetime(2026, 5, 21)) is None
+
+
+def test_iterar_ocorrencias_e_preguicoso_e_igual_ao_calculo_fechado():
+    inicio = datetime(2025, 1, 31)
+    infinito = agenda.iterar_ocorrencias('mensal', inicio, datetime(2025, 3, 1))
+    assert [next(infinito) for _ in range(3)] == [(2, datetime(2025, 3, 31)), (3, datetime(2025, 4, 30)), (4, datetime(2025, 5, 31))]
+    fechado = agenda.calcular_ocorrencias('quinzenal', inicio, inicio, datetime(2026, 1, 1), total_parcelas=10, indice_minimo=2)
+    assert list(agenda.iterar_ocorrencias('quinzenal', inicio, inicio, datetime(2026, 1, 1), total_parcelas=10, indice_minimo=2)) == list(fechado)
+    assert list(agenda.iterar_ocorrencias('unica', inicio, datetime(2025, 2, 1))) == []
@@ -0,0 +1,259 @@
+from datetime import datetime
+
+import pytest
+
+from models import db, Categoria, Transacao, TransacaoRecorrente, TipoTransacao, TipoRecorrencia
+from agregacao_relatorio import AgregacaoRelatorio
+from normalizacao_descricao import normalizar_descricao
+
+
+def test_agregacao_soma_reais_no_banco_e_projecoes_por_mes(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+    mercado = Categoria(nome='Mercado', user_id=usuario.id, parent_id=casa.id)
+    salario = Categoria(nome='Salario', user_id=usuario.id)
+    db.session.add_all([mercado, salario])
+    db.session.commit()
+
+    def transacao(descricao, valor, tipo, data, categoria):
+        return Transacao(descricao=descricao, valor=valor, tipo=tipo, data_transacao=data,
+                         conta_id=conta.id, categoria_id=categoria.id, user_id=usuario.id)
+
+    db.session.add_all([
+        # Duas compras na mesma categoria e mês contam as duas
+        transacao('Feira', 30, TipoTransacao.DESPESA, datetime(2030, 1, 5), mercado),
+        transacao('feira ', 20, TipoTransacao.DESPESA, datetime(2030, 1, 20), mercado),
+        transacao('Conserto', 100, TipoTransacao.DESPESA, datetime(2030, 2, 1), casa),
+        transacao('Bonus', 500, TipoTransacao.RECEITA, datetime(2030, 2, 10), salario),
+        transacao('Fora do periodo', 999, TipoTransacao.DESPESA, datetime(2030, 4, 1), casa),
+    ])
+    semanal = TransacaoRecorrente(descricao='Diarista', valor=50, tipo=TipoTransacao.DESPESA,
+                                  tipo_recorrencia=TipoRecorrencia.SEMANAL, data_inicio=datetime(2030, 1, 1),
+                                  categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id)
+    db.session.add(semanal)
+    db.session.commit()
+    # A primeira semana de janeiro já foi gravada; as seguintes são projetadas
+    db.session.add(transacao('Diarista', 50, TipoTransacao.DESPESA, datetime(2030, 1, 1), casa))
+    db.session.commit()
+    db.session.query(Transacao).filter_by(descricao='Diarista').update({'recorrencia_id': semanal.id})
+    semanal.ultimo_indice_gerado = 0
+    semanal.ultima_data_gerada = datetime(2030, 1, 1)
+    db.session.commit()
+
+    inicio, fim = datetime(2030, 1, 1), datetime(2030, 3, 31, 23, 59, 59)
+    query = Transacao.query.filter(Transacao.user_id == usuario.id, Transacao.data_transacao >= inicio,
+                                   Transacao.data_transacao <= fim)
+    agregado = AgregacaoRelatorio(inicio, fim)
+    agregado.adicionar_reais(query)
+    agregado.adicionar_projecoes([semanal.projetar_intervalo(inicio, fim)])
+
+    # Diarista às terças: 1 gravada + 4 projetadas em janeiro, 4 em fevereiro e 4 em março
+    assert agregado.rotulos == ['Jan 2030', 'Fev 2030', 'Mar 2030']
+    assert agregado.totais_mensais() == {
+        'Jan 2030': {'receita': 0, 'despesa': 300},
+        'Fev 2030': {'receita': 500, 'despesa': 300},
+        'Mar 2030': {'receita': 0, 'despesa': 200},
+    }
+    assert agregado.totais() == (500, 800, 5 + 12)
+
+    pais = {casa.id: None, mercado.id: casa.id, salario.id: None}
+    totais = agregado.totais_por_categoria(pais)
+    assert totais[casa.id][TipoTransacao.DESPESA] == 800
+    assert totais[mercado.id][TipoTransacao.DESPESA] == 50
+    assert agregado.matriz([casa.id], pais) == {casa.id: {'Jan 2030': 300, 'Fev 2030': 300, 'Mar 2030': 200}}
+
+    linhas = {(g['descricao'].strip().lower(), g['subcategoria']): g for g in agregado.linhas({c.id: c for c in (casa, mercado, salario)})}
+    assert linhas[('feira', 'Mercado')]['monthly'] == {'Jan 2030': -50, 'Fev 2030': 0, 'Mar 2030': 0}
+    diarista = linhas[('diarista', '')]
+    assert diarista['is_projetada'] and diarista['categoria_raiz'] == 'Casa'
+    assert diarista['monthly_real']['Jan 2030'] == -50
+    assert diarista['monthly_proj'] == {'Jan 2030': -200, 'Fev 2030': -200, 'Mar 2030': -200}
+
+
+def test_descricao_normalizada_gravada_e_usada_no_agrupamento(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+
+    def transacao(descricao, data):
+        return Transacao(descricao=descricao, valor=100, tipo=TipoTransacao.DESPESA, data_transacao=data,
+                         conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+
+    primeira = transacao('Notebook - Parcela 1/3', datetime(2030, 1, 5))
+    db.session.add_all([primeira, transacao('notebook  parcela 2 de 3', datetime(2030, 2, 5))])
+    db.session.commit()
+    assert primeira.descricao_normalizada == 'notebook'
+
+    primeira.descricao = 'Tablet Parcela 1'
+    db.session.commit()
+    assert primeira.descricao_normalizada == 'tablet'
+
+    # Parcelas gravadas em lote pela recorrência também chegam normalizadas
+    parcelada = TransacaoRecorrente(descricao='Notebook', valor=100, tipo=TipoTransacao.DESPESA,
+                                    tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=datetime(2030, 3, 5),
+                                    total_parcelas=3, categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id)
+    db.session.add(parcelada)
+    db.session.commit()
+    parcelada.materializar([(2, datetime(2030, 3, 5))])
+    db.session.commit()
+    assert {t.descricao_normalizada for t in Transacao.query.all()} == {'tablet', 'notebook'}
+
+    agregado = AgregacaoRelatorio(datetime(2030, 1, 1), datetime(2030, 3, 31))
+    agregado.adicionar_reais(Transacao.query.filter(Transacao.user_id == usuario.id))
+    linhas = {normalizar_descricao(g['descricao']): g for g in agregado.linhas({casa.id: casa})}
+    assert sorted(linhas) == ['notebook', 'tablet']
+    assert linhas['notebook']['monthly'] == {'Jan 2030': 0, 'Fev 2030': -100, 'Mar 2030': -100}
+
+
+def agrupar_como_antes(transacoes, inicio, fim, categorias):
+    """
+    Quadros do relatório como eram calculados em /relatorios antes da agregação
+    (laços sobre as transações reais e projetadas já carregadas), para comparação.
+    """
+    import re
+
+    meses_pt = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+    meses = []
+    atual = inicio.replace(day=1)
+    while atual <= fim:
+        meses.append(f"{meses_pt[atual.month - 1]} {atual.year}")
+        atual = atual.replace(year=atual.year + 1, month=1) if atual.month == 12 else atual.replace(month=atual.month + 1)
+
+    def chave(t):
+        if t.recorrencia_id:
+            return (t.data_transacao.year, t.data_transacao.month, t.recorrencia_id)
+        return (t.data_transacao.year, t.data_transacao.month, t.categoria_id, t.tipo)
+
+    unicas = {}
+    for t in transacoes:
+        if not getattr(t, 'is_projetada', False) or chave(t) not in unicas:
+            unicas[chave(t)] = t
+    transacoes = [t for t in unicas.values() if inicio <= t.data_transacao <= fim]
+
+    def rotulo(t):
+        return f"{meses_pt[t.data_transacao.month - 1]} {t.data_transacao.year}"
+
+    totais_mensais = {m: {'receita': 0, 'despesa': 0} for m in meses}
+    for t in transacoes:
+        totais_mensais[rotulo(t)]['receita' if t.tipo == TipoTransacao.RECEITA else 'despesa'] += t.valor
+    totais = (sum(t.valor for t in transacoes if t.tipo == TipoTransacao.RECEITA),
+              sum(t.valor for t in transacoes if t.tipo == TipoTransacao.DESPESA), len(transacoes))
+
+    por_id = {c.id: c for c in categorias}
+    descendentes = {c.id: {s.id for s in c.get_all_subcategorias(include_self=True)} for c in categorias}
+    por_categoria = {}
+    for categoria_id, ids in descendentes.items():
+        for tipo in (TipoTransacao.RECEITA, TipoTransacao.DESPESA):
+            total = sum(t.valor for t in transacoes if t.categoria_id in ids and t.tipo == tipo)
+            if total > 0:
+                por_categoria.setdefault(categoria_id, {})[tipo] = total
+    matriz = {}
+    for c in categorias:
+        if c.parent_id is None and c.id in por_categoria:
+            linha = {m: sum(t.valor for t in transacoes if t.categoria_id in descendentes[c.id] and rotulo(t) == m)
+                     for m in meses}
+            matriz[c.id] = {m: (v if v > 0 else 0) for m, v in linha.items()}
+
+    grupos = {}
+    for t in transacoes:
+        cat = por_id[t.categoria_id]
+        if cat.parent_id:
+            raiz = cat
+            while raiz.parent_id:
+                raiz = por_id[raiz.parent_id]
+            raiz_nome, sub_nome = raiz.nome, cat.nome
+        else:
+            raiz_nome, sub_nome = cat.nome, ''
+        bruta = (t.descricao or '').strip()
+        limpa = re.sub(r"(?i)\s*(?:[-–—])?\s*parcela\s*\d+\s*[\\/\-]\s*\d+", "", bruta)
+        limpa = re.sub(r"(?i)\s*(?:[-–—])?\s*parcela\s*\d+\s*(?:de|of)\s*\d+", "", limpa)
+        limpa = re.sub(r"(?i)\s*(?:[-–—])?\s*parcela\s*\d+\s*$", "", limpa).strip().rstrip('-').strip()
+        projetada = getattr(t, 'is_projetada', False)
+        g = grupos.setdefault((' '.join(limpa.split()).lower(), raiz_nome, sub_nome, t.tipo.value), {
+            'descricao': limpa or bruta, 'categoria_raiz': raiz_nome, 'subcategoria': sub_nome, 'tipo': t.tipo.value,
+            'monthly': dict.fromkeys(meses, 0), 'monthly_real': dict.fromkeys(meses, 0),
+            'monthly_proj': dict.fromkeys(meses, 0), 'total': 0, 'is_projetada': projetada,
+        })
+        valor = abs(t.valor) if t.tipo == TipoTransacao.RECEITA else -abs(t.valor)
+        g['monthly'][rotulo(t)] += valor
+        g['total'] += valor
+        g['monthly_proj' if projetada else 'monthly_real'][rotulo(t)] += valor
+        if projetada:
+            g['is_projetada'] = True
+        else:
+            g['descricao'] = bruta
+    linhas = sorted(grupos.values(), key=lambda g: (g['descricao'] or '').lower())
+
+    return {'totais_mensais': totais_mensais, 'totais': totais, 'por_categoria': por_categoria,
+            'matriz': matriz, 'linhas': linhas}
+
+
+def assert_quase_iguais(obtido, esperado):
+    """Compara estruturas aninhadas, com tolerância de ponto flutuante nos números"""
+    if isinstance(esperado, dict):
+        assert sorted(obtido, key=str) == sorted(esperado, key=str)
+        for chave in esperado:
+            assert_quase_iguais(obtido[chave], esperado[chave])
+    elif isinstance(esperado, (list, tuple)):
+        assert len(obtido) == len(esperado)
+        for a, b in zip(obtido, esperado):
+            assert_quase_iguais(a, b)
+    elif isinstance(esperado, (int, float)) and not isinstance(esperado, bool):
+        assert obtido == pytest.approx(esperado)
+    else:
+        assert obtido == esperado
+
+
+def test_agregacao_igual_ao_agrupamento_anterior(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    salario = Categoria(nome='Salario', user_id=usuario.id)
+    db.session.add_all([casa, salario])
+    db.session.commit()
+    mercado = Categoria(nome='Mercado', user_id=usuario.id, parent_id=casa.id)
+    db.session.add(mercado)
+    db.session.commit()
+    categorias = [casa, mercado, salario]
+
+    # Uma transação avulsa por mês, categoria e tipo: o agrupamento anterior descartava as demais
+    def transacao(descricao, valor, tipo, data, categoria):
+        return Transacao(descricao=descricao, valor=valor, tipo=tipo, data_transacao=data,
+                         conta_id=conta.id, categoria_id=categoria.id, user_id=usuario.id)
+
+    db.session.add_all([
+        transacao('Feira', 30.5, TipoTransacao.DESPESA, datetime(2030, 1, 5), mercado),
+        transacao('feira ', 42, TipoTransacao.DESPESA, datetime(2030, 3, 7), mercado),
+        transacao('Conserto', 100, TipoTransacao.DESPESA, datetime(2030, 2, 1), casa),
+        transacao('Salario', 3000, TipoTransacao.RECEITA, datetime(2030, 1, 5), salario),
+        transacao('Bonus', 500, TipoTransacao.RECEITA, datetime(2030, 2, 10), salario),
+        transacao('Fora do periodo', 999, TipoTransacao.DESPESA, datetime(2030, 4, 1), casa),
+    ])
+    tv = TransacaoRecorrente(descricao='TV', valor=200, tipo=TipoTransacao.DESPESA,
+                             tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=datetime(2030, 1, 10),
+                             total_parcelas=3, categoria_id=mercado.id, conta_id=conta.id, user_id=usuario.id)
+    luz = TransacaoRecorrente(descricao='Luz', valor=80, tipo=TipoTransacao.DESPESA,
+                              tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=datetime(2030, 1, 15),
+                              categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id)
+    db.session.add_all([tv, luz])
+    db.session.commit()
+    # Primeira parcela gravada; as outras e a Luz são projetadas
+    tv.materializar([(0, tv.data_inicio)])
+    db.session.commit()
+
+    inicio, fim = datetime(2030, 1, 1), datetime(2030, 3, 31, 23, 59, 59)
+    reais = Transacao.query.filter(Transacao.user_id == usuario.id).all()
+    lotes = [r.projetar_intervalo(inicio, fim) for r in (tv, luz)]
+    antes = agrupar_como_antes(reais + [p for lote in lotes for p in lote], inicio, fim, categorias)
+
+    agregado = AgregacaoRelatorio(inicio, fim)
+    agregado.adicionar_reais(Transacao.query.filter(Transacao.user_id == usuario.id, Transacao.data_transacao >= inicio,
+                                                    Transacao.data_transacao <= fim))
+    agregado.adicionar_projecoes(lotes)
+    pais = {c.id: c.parent_id for c in categorias}
+
+    assert len(antes['linhas']) == 6 and antes['totais'][2] == 11
+    assert_quase_iguais(agregado.totais_mensais(), antes['totais_mensais'])
+    assert_quase_iguais(agregado.totais(), antes['totais'])
+    assert_quase_iguais({c: t for c, t in agregado.totais_por_categoria(pais).items()}, antes['por_categoria'])
+    assert_quase_iguais(agregado.matriz(list(antes['matriz']), pais), antes['matriz'])
+    assert_quase_iguais(agregado.linhas({c.id: c for c in categorias}), antes['linhas'])
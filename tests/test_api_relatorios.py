@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pytest
+
+from models import db, Usuario, Conta, Categoria, Transacao, TipoTransacao
+
+
+@pytest.fixture
+def app(app_principal):
+    return app_principal
+
+
+@pytest.fixture
+def lancamentos(usuario, conta):
+    outra = Conta(nome='Carteira', user_id=usuario.id)
+    salario = Categoria(nome='Salario', user_id=usuario.id)
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    estranho = Usuario(username='outro', email='outro@example.com')
+    estranho.set_password('x')
+    db.session.add_all([outra, salario, casa, estranho])
+    db.session.commit()
+    alheia = Conta(nome='Alheia', user_id=estranho.id)
+    db.session.add(alheia)
+    db.session.commit()
+
+    def transacao(descricao, valor, tipo, mes, categoria, conta_id):
+        return Transacao(descricao=descricao, valor=valor, tipo=tipo, data_transacao=datetime(2030, mes, 5),
+                         categoria_id=categoria.id, conta_id=conta_id, user_id=usuario.id)
+
+    db.session.add_all([
+        transacao('Salario', 1000, TipoTransacao.RECEITA, 1, salario, conta.id),
+        transacao('Luz', 200, TipoTransacao.DESPESA, 2, casa, conta.id),
+        transacao('Mercado', 300, TipoTransacao.DESPESA, 3, casa, conta.id),
+        transacao('Cafe', 50, TipoTransacao.DESPESA, 1, casa, outra.id),
+    ])
+    db.session.commit()
+    return {'conta': conta.id, 'outra': outra.id, 'alheia': alheia.id}
+
+
+def consultar(modulo_app, cliente, usuario, **params):
+    """JSON de /api/relatorios e, para comparação, os dados de _dados_relatorio com os mesmos filtros"""
+    resposta = cliente.get('/api/relatorios', query_string=params)
+    assert resposta.status_code == 200 and resposta.mimetype == 'application/json'
+    dados = modulo_app._dados_relatorio(usuario, *modulo_app._filtros_relatorio(params))
+    return resposta.get_json(), dados
+
+
+def conferir_colunas(json, dados):
+    meses = dados['meses']
+    assert json['success'] and json['meses'] == meses
+    assert all(len(coluna) == len(meses) for coluna in json['mensal'].values())
+
+    linhas = dados['transacoes_linhas']
+    assert {nome: len(coluna) for nome, coluna in json['linhas'].items()} == dict.fromkeys(json['linhas'], len(linhas))
+    assert json['linhas']['descricao'] == [g['descricao'] for g in linhas]
+    assert json['linhas']['total'] == [round(float(g['total']), 2) for g in linhas]
+    assert all(len(valores) == len(meses) for valores in json['linhas']['real'] + json['linhas']['projetado'])
+
+    for grupo in ('categorias', 'subcategorias'):
+        assert len({len(coluna) for coluna in json[grupo].values()}) == 1
+    assert all(len(valores) == len(meses) for valores in json['categorias']['valores'])
+
+    assert json['totais'] == {
+        'receitas': round(dados['total_receitas'], 2),
+        'despesas': round(dados['total_despesas'], 2),
+        'saldo': round(dados['saldo_geral'], 2),
+        'transacoes': dados['total_transacoes'],
+    }
+
+
+def test_api_relatorios_colunar_sem_filtros(modulo_app, cliente, usuario, lancamentos):
+    json, dados = consultar(modulo_app, cliente, usuario, ano='2030')
+    conferir_colunas(json, dados)
+    assert (json['totais']['receitas'], json['totais']['despesas'], json['totais']['transacoes']) == (1000, 550, 4)
+    assert sorted(json['linhas']['descricao']) == ['Cafe', 'Luz', 'Mercado', 'Salario']
+
+
+def test_api_relatorios_colunar_por_conta_e_periodo(modulo_app, cliente, usuario, lancamentos):
+    json, dados = consultar(modulo_app, cliente, usuario, ano='2030', conta=str(lancamentos['conta']))
+    conferir_colunas(json, dados)
+    assert (json['totais']['despesas'], json['totais']['transacoes']) == (500, 3)
+    assert 'Cafe' not in json['linhas']['descricao']
+
+    json, dados = consultar(modulo_app, cliente, usuario, data_inicio='2030-02-01', data_fim='2030-03-31')
+    conferir_colunas(json, dados)
+    assert (json['totais']['receitas'], json['totais']['despesas']) == (0, 500)
+    assert sorted(json['linhas']['descricao']) == ['Luz', 'Mercado']
+
+    json, dados = consultar(modulo_app, cliente, usuario, conta=str(lancamentos['outra']),
+                            data_inicio='2030-01-01', data_fim='2030-01-31')
+    conferir_colunas(json, dados)
+    assert json['linhas']['descricao'] == ['Cafe'] and json['totais']['despesas'] == 50
+
+
+def test_api_relatorios_ignora_conta_invalida(modulo_app, cliente, usuario, lancamentos):
+    sem_filtro, _ = consultar(modulo_app, cliente, usuario, ano='2030')
+    # Conta de outro usuário ou id inválido: o filtro é descartado, nunca vaza dados alheios
+    for conta in (str(lancamentos['alheia']), 'abc', '999999'):
+        json, dados = consultar(modulo_app, cliente, usuario, ano='2030', conta=conta)
+        conferir_colunas(json, dados)
+        assert json == sem_filtro
@@ -0,0 +1,81 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from models import db, Usuario, Conta, Categoria, Transacao, TipoTransacao
+
+
+@pytest.fixture
+def app(app_principal):
+    return app_principal
+
+
+def test_saldos_diarios_atravessando_o_mes_batem_com_as_transacoes(cliente, usuario, conta):
+    conta.saldo_inicial = 500
+    outra = Conta(nome='Outra', user_id=usuario.id)
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add_all([outra, casa])
+    db.session.commit()
+    lancamentos = [
+        (conta.id, datetime(2029, 12, 20), 1000, TipoTransacao.RECEITA),
+        (conta.id, datetime(2030, 1, 30, 8, 0), 120, TipoTransacao.DESPESA),
+        (conta.id, datetime(2030, 1, 31, 23, 30), 80, TipoTransacao.DESPESA),
+        (conta.id, datetime(2030, 2, 1, 0, 0), 300, TipoTransacao.RECEITA),
+        (conta.id, datetime(2030, 2, 3, 12, 0), 45.5, TipoTransacao.DESPESA),
+        (outra.id, datetime(2030, 2, 1), 999, TipoTransacao.RECEITA),
+    ]
+    db.session.add_all([
+        Transacao(descricao='T', valor=valor, tipo=tipo, data_transacao=data,
+                  categoria_id=casa.id, conta_id=conta_id, user_id=usuario.id)
+        for conta_id, data, valor, tipo in lancamentos
+    ])
+    db.session.commit()
+
+    dados = cliente.get(f'/api/conta/{conta.id}/saldos-diarios?inicio=2030-01-29&fim=2030-02-04').get_json()
+
+    # Soma acumulada feita direto sobre as transações gravadas da conta
+    transacoes = Transacao.query.filter_by(conta_id=conta.id).all()
+    esperado = []
+    dia = date(2030, 1, 29)
+    while dia <= date(2030, 2, 4):
+        saldo = conta.saldo_inicial + sum(t.valor if t.tipo == TipoTransacao.RECEITA else -t.valor
+                                          for t in transacoes if t.data_transacao.date() <= dia)
+        esperado.append((dia.isoformat(), round(saldo, 2)))
+        dia += timedelta(days=1)
+
+    assert (dados['conta_id'], dados['inicio'], dados['fim']) == (conta.id, '2030-01-29', '2030-02-04')
+    assert list(zip(dados['datas'], dados['saldos'])) == esperado
+    assert dados['saldos'][:4] == [1500, 1380, 1300, 1600]
+
+
+def test_saldos_diarios_de_conta_alheia_nao_existem(cliente):
+    estranho = Usuario(username='outro', email='outro@example.com')
+    estranho.set_password('x')
+    db.session.add(estranho)
+    db.session.commit()
+    alheia = Conta(nome='Alheia', user_id=estranho.id)
+    db.session.add(alheia)
+    db.session.commit()
+
+    assert cliente.get(f'/api/conta/{alheia.id}/saldos-diarios').status_code == 404
+    assert cliente.get('/api/conta/999999/saldos-diarios').status_code == 404
+
+
+@pytest.mark.parametrize('consulta', [
+    'inicio=2030-02-30',
+    'inicio=30/01/2030',
+    'fim=amanha',
+    'inicio=2030-02-05&fim=2030-02-04',
+    'inicio=2020-01-01&fim=2030-01-01',
+])
+def test_saldos_diarios_rejeitam_datas_invalidas(cliente, conta, consulta):
+    resposta = cliente.get(f'/api/conta/{conta.id}/saldos-diarios?{consulta}')
+    assert resposta.status_code == 400
+    assert resposta.get_json()['success'] is False
+
+
+def test_saldos_diarios_padrao_sao_os_ultimos_30_dias(cliente, conta):
+    dados = cliente.get(f'/api/conta/{conta.id}/saldos-diarios').get_json()
+    assert dados['fim'] == date.today().isoformat()
+    assert len(dados['datas']) == len(dados['saldos']) == 30
+    assert set(dados['saldos']) == {conta.saldo_inicial}
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from models import db, Usuario, Conta, Categoria, Transacao, TransacaoRecorrente, TipoTransacao, TipoRecorrencia
+import cache_relatorios
+from cache_relatorios import CacheRelatorios
+
+
+def test_versao_dos_dados_muda_a_cada_escrita_do_usuario(usuario):
+    outro = Usuario(username='outro', email='outro@example.com')
+    outro.set_password('x')
+    db.session.add(outro)
+    db.session.commit()
+
+    def versoes():
+        return dict(db.session.execute(db.select(Usuario.id, Usuario.dados_versao)).all())
+
+    inicial = versoes()
+    conta = Conta(nome='Conta', user_id=usuario.id)
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add_all([conta, casa])
+    db.session.commit()
+    # Várias escritas no mesmo flush contam uma vez só
+    assert versoes() == {usuario.id: inicial[usuario.id] + 1, outro.id: inicial[outro.id]}
+
+    t = Transacao(descricao='Luz', valor=100, tipo=TipoTransacao.DESPESA, data_transacao=datetime(2030, 1, 5),
+                  conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+    db.session.add(t)
+    db.session.commit()
+    t.valor = 120
+    db.session.commit()
+    db.session.delete(t)
+    db.session.commit()
+    assert versoes()[usuario.id] == inicial[usuario.id] + 4
+
+    # Escritas no próprio cadastro do usuário não invalidam os relatórios
+    usuario.cidade = 'Recife'
+    db.session.commit()
+    assert versoes()[usuario.id] == inicial[usuario.id] + 4
+
+    # O INSERT em lote das recorrências também muda a versão
+    mensal = TransacaoRecorrente(descricao='Internet', valor=100, tipo=TipoTransacao.DESPESA,
+                                 tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=datetime(2030, 1, 10),
+                                 categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id)
+    db.session.add(mensal)
+    db.session.commit()
+    antes = versoes()[usuario.id]
+    mensal.materializar([(0, datetime(2030, 1, 10))])
+    db.session.commit()
+    assert versoes()[usuario.id] > antes
+    assert versoes()[outro.id] == inicial[outro.id]
+
+
+def test_cache_lru_limitado():
+    cache = CacheRelatorios(tamanho=2)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obter('a') == 1
+    cache.guardar('c', 3)  # 'b' é a entrada usada há mais tempo
+    assert cache.obter('b') is None
+    assert (cache.obter('a'), cache.obter('c')) == (1, 3)
+    assert cache.resumo() == {'tamanho': 2, 'entradas': 2, 'acertos': 3, 'faltas': 1}
+
+    desligado = CacheRelatorios(tamanho=0)
+    assert desligado.guardar('a', 1) == 1
+    assert desligado.obter('a') is None
+
+
+def test_ouvintes_avisados_apos_commit(usuario):
+    avisos = []
+    ouvinte = cache_relatorios.ao_confirmar_alteracoes(lambda user_ids: avisos.append(sorted(user_ids)))
+    try:
+        assert avisos == []
+
+        db.session.add(Conta(nome='Conta', user_id=usuario.id))
+        db.session.flush()
+        assert avisos == []  # só depois do commit
+        db.session.commit()
+        assert avisos == [[usuario.id]]
+
+        # Escritas desfeitas não avisam
+        db.session.add(Categoria(nome='Casa', user_id=usuario.id))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert avisos == [[usuario.id]]
+    finally:
+        cache_relatorios._ouvintes.remove(ouvinte)
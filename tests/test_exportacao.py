@@ -0,0 +1,41 @@
+import csv
+import io
+from datetime import datetime
+
+import pytest
+
+from models import db, Categoria, Transacao, TipoTransacao
+import exportacao
+
+
+def test_csv_das_transacoes_em_partes(usuario, conta, monkeypatch):
+    monkeypatch.setattr(exportacao, 'TAMANHO_LOTE', 7)
+    monkeypatch.setattr(exportacao, 'LINHAS_POR_PARTE', 10)
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+    db.session.add_all([
+        Transacao(descricao=f'Luz {i}', valor=100 + i, tipo=TipoTransacao.DESPESA,
+                  data_transacao=datetime(2030, 1, 1 + i), conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+        for i in range(25)
+    ])
+    db.session.commit()
+
+    query = Transacao.query.filter(Transacao.user_id == usuario.id)
+    linhas = exportacao.linhas_transacoes(query, {casa.id: 'Casa'}, {conta.id: 'Conta'})
+    partes, mimetype, extensao = exportacao.exportar('csv', exportacao.CABECALHO_TRANSACOES, linhas)
+    partes = list(partes)
+    assert (mimetype.split(';')[0], extensao) == ('text/csv', 'csv')
+    assert len(partes) == 3  # 25 linhas em partes de 10
+
+    lidas = list(csv.reader(io.StringIO(''.join(partes).lstrip('\ufeff'))))
+    assert lidas[0] == exportacao.CABECALHO_TRANSACOES
+    assert len(lidas) == 26
+    assert lidas[1] == ['2030-01-01', 'Luz 0', 'despesa', 'Casa', 'Conta', '100.0', 'Não']
+    assert [linha[1] for linha in lidas[1:]] == [f'Luz {i}' for i in range(25)]
+
+
+def test_formato_indisponivel():
+    with pytest.raises(ValueError):
+        exportacao.exportar('pdf', [], [])
+    assert ('xlsx' in exportacao.formatos_disponiveis()) == exportacao.HAS_OPENPYXL
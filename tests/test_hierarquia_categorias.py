@@ -0,0 +1,45 @@
+from models import db, Categoria, CategoriaHierarquia
+import hierarquia_categorias
+
+
+def fechamento():
+    return {(h.ancestral_id, h.descendente_id, h.profundidade) for h in CategoriaHierarquia.query.all()}
+
+
+def esperado():
+    return set(hierarquia_categorias.calcular_pares((c.id, c.parent_id) for c in Categoria.query.all()))
+
+
+def test_fechamento_acompanha_inclusao_movimentacao_e_exclusao(usuario):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    lazer = Categoria(nome='Lazer', user_id=usuario.id)
+    db.session.add_all([casa, lazer])
+    db.session.commit()
+    contas = Categoria(nome='Contas', user_id=usuario.id, parent_id=casa.id)
+    db.session.add(contas)
+    db.session.commit()
+    # Incluída pelo relacionamento, na mesma transação do pai
+    luz = Categoria(nome='Luz', user_id=usuario.id, parent=contas)
+    db.session.add(luz)
+    db.session.commit()
+    assert fechamento() == esperado()
+    assert [c.nome for c in casa.get_all_subcategorias()] == ['Casa', 'Contas', 'Luz']
+    assert [c.nome for c in casa.get_all_subcategorias(include_self=False)] == ['Contas', 'Luz']
+
+    # Mover a subárvore Contas > Luz para baixo de Lazer e depois para a raiz
+    contas.parent_id = lazer.id
+    db.session.commit()
+    assert fechamento() == esperado()
+    assert (lazer.id, luz.id, 2) in fechamento()
+    assert [c.nome for c in casa.get_all_subcategorias()] == ['Casa']
+
+    contas.parent_id = None
+    contas.nome = 'Contas da casa'
+    db.session.commit()
+    assert fechamento() == esperado()
+
+    db.session.delete(luz)
+    db.session.commit()
+    assert fechamento() == esperado()
+    ids = {row[0] for row in db.session.execute(Categoria.ids_com_descendentes(contas.id))}
+    assert ids == {contas.id}
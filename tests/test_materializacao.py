@@ -0,0 +1,201 @@
+import os
+from datetime import date, datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from models import db, Categoria, Transacao, TransacaoRecorrente, TipoTransacao, TipoRecorrencia
+from materializacao import FilaMaterializacao
+import agenda_recorrencia
+from rastreio_recorrencia import rastreio
+
+
+def criar_recorrente(conta, meses_atras):
+    cat = Categoria(nome='Moradia', user_id=conta.user_id)
+    db.session.add(cat)
+    db.session.commit()
+    inicio = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0) - relativedelta(months=meses_atras)
+    r = TransacaoRecorrente(descricao='Aluguel', valor=100, tipo=TipoTransacao.DESPESA,
+                            tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=inicio,
+                            categoria_id=cat.id, conta_id=conta.id, user_id=conta.user_id)
+    db.session.add(r)
+    db.session.commit()
+    return r.id
+
+
+def test_fila_deduplica_e_materializa_em_segundo_plano(app, conta):
+    fila = FilaMaterializacao(app)
+    recorrencia_id = criar_recorrente(conta, meses_atras=2)
+
+    # Sem thread de trabalho, a segunda chamada encontra o ID ainda pendente
+    fila._iniciar_thread = lambda: None
+    assert fila.enfileirar(recorrencia_id) is True
+    assert fila.enfileirar(recorrencia_id) is False
+    assert fila.pendentes() == 1
+
+    del fila._iniciar_thread
+    fila._iniciar_thread()
+    fila.aguardar()
+    assert fila.pendentes() == 0
+
+    # Dois meses passados mais o mês atual; meses futuros ficam só como projeção
+    assert Transacao.query.filter_by(recorrencia_id=recorrencia_id).count() == 3
+
+    # Reprocessar não duplica
+    fila.enfileirar(recorrencia_id)
+    fila.aguardar()
+    assert Transacao.query.filter_by(recorrencia_id=recorrencia_id).count() == 3
+
+
+def test_modo_sincrono_processa_na_chamada(app, conta):
+    app.config['MATERIALIZACAO_SINCRONA'] = True
+    fila = FilaMaterializacao(app)
+    recorrencia_id = criar_recorrente(conta, meses_atras=0)
+
+    assert fila.enfileirar(recorrencia_id) is True
+    assert fila.pendentes() == 0
+    assert Transacao.query.filter_by(recorrencia_id=recorrencia_id).count() == 1
+
+
+def test_ocorrencias_vencidas_sem_edicao_sao_gravadas_uma_vez_por_dia(app, conta):
+    fila = FilaMaterializacao(app)
+    app.config['MATERIALIZACAO_SINCRONA'] = True
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=2))
+    # Só a primeira ocorrência foi gravada na criação; as outras venceram depois, sem edição
+    recorrente.materializar([(0, recorrente.data_inicio)])
+    db.session.commit()
+    recorrencia_id, user_id = recorrente.id, conta.user_id
+
+    hoje = date.today()
+    assert fila.enfileirar_do_dia(user_id, hoje) == 1
+    assert Transacao.query.filter_by(recorrencia_id=recorrencia_id).count() == 3
+    assert fila.enfileirar_do_dia(user_id, hoje) == 0
+    assert fila.enfileirar_do_dia(user_id, hoje + timedelta(days=1)) == 1
+    assert Transacao.query.filter_by(recorrencia_id=recorrencia_id).count() == 3
+
+
+def test_marca_dagua_acompanha_geracao_e_exclusao(conta):
+    recorrencia_id = criar_recorrente(conta, meses_atras=2)
+    recorrente = db.session.get(TransacaoRecorrente, recorrencia_id)
+
+    recorrente.gerar_transacoes_pendentes(meses_futuros=1)
+    assert recorrente.ultimo_indice_gerado == 2
+    assert recorrente.parcelas_geradas == 3
+    ultima = Transacao.query.filter_by(recorrencia_id=recorrencia_id, data_transacao=recorrente.ultima_data_gerada).one()
+
+    # Excluir a última ocorrência gravada recua a marca para a anterior
+    db.session.delete(ultima)
+    recorrente.remover_transacao(ultima)
+    db.session.commit()
+    assert recorrente.ultimo_indice_gerado == 1
+    assert recorrente.parcelas_geradas == 2
+    assert [p.data_transacao for p in recorrente.projetar_intervalo(ultima.data_transacao, ultima.data_transacao)] == [ultima.data_transacao]
+
+
+def test_materializar_em_lote_ignora_ocorrencias_existentes(conta):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=3))
+    datas = [d for _, d in recorrente.calcular_ocorrencias(recorrente.data_inicio, recorrente.data_inicio + relativedelta(months=2))]
+
+    assert len(recorrente.materializar([(0, datas[0]), (1, datas[1])])) == 2
+    # Reenvio parcialmente sobreposto: só a ocorrência nova é gravada
+    inseridas = recorrente.materializar([(1, datas[1]), (2, datas[2])])
+    db.session.commit()
+    assert [linha.data_transacao for linha in inseridas] == [datas[2]]
+    assert Transacao.query.filter_by(recorrencia_id=recorrente.id).count() == 3
+    assert recorrente.parcelas_geradas == 3
+    assert recorrente.ultima_data_gerada == datas[2]
+
+
+def test_ocorrencia_do_mesmo_dia_em_outro_horario_nao_duplica(conta):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=1))
+    recorrente.data_inicio = recorrente.data_inicio.replace(hour=14, minute=30)
+    db.session.commit()
+    proxima = recorrente.data_inicio + relativedelta(months=1)
+
+    assert len(recorrente.materializar([(0, recorrente.data_inicio)])) == 1
+    # Consolidação de uma projeção informa só o dia (meia-noite)
+    meia_noite = recorrente.data_inicio.replace(hour=0, minute=0)
+    assert recorrente.materializar([(0, meia_noite)]) == []
+    assert recorrente.ocorrencia_do_dia(proxima.replace(hour=0, minute=0)) == (1, proxima)
+    db.session.commit()
+    assert Transacao.query.filter_by(recorrencia_id=recorrente.id).count() == 1
+
+
+def test_materializar_em_lote_grava_na_marca_o_indice_informado(conta, monkeypatch):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=3))
+    recorrente.data_inicio = recorrente.data_inicio.replace(day=15)
+    db.session.commit()
+    recalculos = []
+    original = agenda_recorrencia.indice_do_periodo
+    monkeypatch.setattr(agenda_recorrencia, 'indice_do_periodo', lambda *args: recalculos.append(args) or original(*args))
+
+    # Projeção consolidada fora do calendário (dia 10 do mês do índice 2): vale o índice informado
+    fora = (recorrente.data_inicio + relativedelta(months=2)).replace(day=10, hour=8)
+    recorrente.materializar([(0, recorrente.data_inicio), (1, fora)])
+    db.session.commit()
+    assert (recorrente.ultimo_indice_gerado, recorrente.ultima_data_gerada) == (1, fora)
+    assert recalculos == []
+
+
+def test_numero_da_parcela_vem_do_indice_da_ocorrencia(conta):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=1))
+    recorrente.total_parcelas = 48
+    db.session.commit()
+
+    geradas = recorrente.gerar_transacoes_pendentes(meses_futuros=120)
+    assert len(geradas) == 48
+    assert [t.descricao for t in geradas] == [f'Aluguel - Parcela {k}/48' for k in range(1, 49)]
+    assert [getattr(t, 'is_projetada', False) for t in geradas[:3]] == [False, False, True]
+
+
+def test_projecoes_compactas_compativeis_com_transacao(conta):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=0))
+    lote = recorrente.projetar_intervalo(recorrente.data_inicio, recorrente.data_inicio + relativedelta(months=11))
+    assert len(lote) == 12
+    assert lote.total == 1200
+
+    projecao = next(iter(lote))
+    assert not hasattr(projecao, '__dict__')
+    assert projecao.is_projetada and projecao.id < 0
+    assert (projecao.descricao, projecao.valor, projecao.tipo) == ('Aluguel', 100, TipoTransacao.DESPESA)
+    assert projecao.categoria.nome == 'Moradia' and projecao.conta_id == recorrente.conta_id
+    assert projecao.recorrencia_id == recorrente.id and list(projecao.tags) == []
+
+
+def test_iteracao_preguicosa_permite_parar_no_fim_da_janela(conta):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=0))
+    inicio = recorrente.data_inicio + relativedelta(months=6)
+
+    iterador = recorrente.iterar_transacoes_pendentes(apenas_projetar=True, inicio=inicio)
+    primeiras = [next(iterador) for _ in range(3)]
+    iterador.close()
+    assert [p.data_transacao for p in primeiras] == [inicio + relativedelta(months=k) for k in range(3)]
+    assert Transacao.query.filter_by(recorrencia_id=recorrente.id).count() == 0
+
+    # A versão em lista continua devolvendo todas as ocorrências, na mesma ordem
+    todas = recorrente.gerar_transacoes_pendentes(meses_futuros=12)
+    assert [t.data_transacao for t in todas] == sorted(t.data_transacao for t in todas)
+    assert getattr(todas[0], 'is_projetada', False) is False
+
+
+def test_rastreio_desligado_por_padrao_e_contadores_quando_ativo(conta):
+    recorrente = db.session.get(TransacaoRecorrente, criar_recorrente(conta, meses_atras=2))
+    assert rastreio.iniciar(recorrente.id, 'geracao') is None
+
+    rastreio.configurar(True, 1.0)
+    try:
+        # Duas ocorrências já gravadas e marca d'água desatualizada: só a do mês atual é nova
+        recorrente.materializar([(0, recorrente.data_inicio), (1, recorrente.data_inicio + relativedelta(months=1))])
+        db.session.commit()
+        recorrente.ultimo_indice_gerado = None
+        geradas = recorrente.gerar_transacoes_pendentes(meses_futuros=3)
+        resumo = rastreio.resumo()
+        totais = resumo['recorrencias'][recorrente.id]
+    finally:
+        rastreio.configurar(False)
+        rastreio.limpar()
+
+    projetadas = sum(1 for t in geradas if getattr(t, 'is_projetada', False))
+    assert (resumo['pid'], resumo['escopo']) == (os.getpid(), 'processo')
+    assert totais['execucoes'] == 1
+    assert (totais['materializadas'], totais['duplicadas']) == (1, 2)
+    assert totais['projetadas'] == projetadas and totais['iteracoes'] == 3 + projetadas
@@ -0,0 +1,101 @@
+import glob
+import importlib.util
+import os
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import MetaData, Table
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Usuario, Transacao, TransacaoRecorrente, ResumoMensal
+
+# O que as migrações 001 em diante acrescentam ao esquema
+COLUNAS_NOVAS = {
+    'transacao_recorrente': {'ultimo_indice_gerado', 'ultima_data_gerada'},
+    'transacao': {'descricao_normalizada', 'ano_mes'},
+    'usuario': {'dados_versao'},
+}
+TABELAS_NOVAS = {'categoria_hierarquia', 'resumo_mensal'}
+
+
+def migracoes():
+    pasta = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+    for caminho in sorted(glob.glob(os.path.join(pasta, '[0-9][0-9][0-9]_*.py'))):
+        if os.path.basename(caminho) >= '001':
+            spec = importlib.util.spec_from_file_location(os.path.basename(caminho)[:-3], caminho)
+            modulo = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(modulo)
+            yield modulo
+
+
+@pytest.fixture
+def banco_antigo(tmp_path):
+    """Banco com o esquema anterior às migrações 001+: modelos atuais sem o que elas acrescentam"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'antigo.db')
+    db.init_app(app)
+    with app.app_context():
+        meta = MetaData()
+        for tabela in db.metadata.sorted_tables:
+            if tabela.name not in TABELAS_NOVAS:
+                Table(tabela.name, meta, *[coluna._copy() for coluna in tabela.c
+                                           if coluna.name not in COLUNAS_NOVAS.get(tabela.name, ())])
+        meta.create_all(db.engine)
+        yield meta.tables
+        db.session.remove()
+
+
+def test_migracoes_em_ordem_sobre_o_esquema_antigo(banco_antigo):
+    t = banco_antigo
+    inicio = datetime(2030, 1, 10, 9, 30)
+    with db.engine.begin() as conn:
+        conn.execute(t['usuario'].insert().values(id=1, username='antigo', email='antigo@example.com',
+                                                  password_hash='x', is_active=True, is_admin=False))
+        conn.execute(t['conta'].insert().values(id=1, nome='Conta', user_id=1, tipo='CORRENTE', saldo_inicial=0,
+                                                ativa=True))
+        conn.execute(t['categoria'].insert().values(id=1, nome='Moradia', user_id=1))
+        conn.execute(t['transacao_recorrente'].insert().values(
+            id=1, descricao='Aluguel', valor=100, tipo='DESPESA', tipo_recorrencia='MENSAL', status='ATIVA',
+            data_inicio=inicio, categoria_id=1, conta_id=1, user_id=1))
+        conn.execute(t['transacao'].insert(), [
+            dict(descricao='Aluguel', valor=100, tipo='DESPESA', data_transacao=data, recorrencia_id=1,
+                 categoria_id=1, conta_id=1, user_id=1)
+            for data in (inicio, datetime(2030, 2, 10, 9, 30))
+        ])
+        # Recorrência de fim de mês gravada pelo cálculo antigo, que recuava o dia
+        conn.execute(t['transacao_recorrente'].insert().values(
+            id=2, descricao='Escola', valor=50, tipo='DESPESA', tipo_recorrencia='MENSAL', status='ATIVA',
+            data_inicio=datetime(2020, 1, 31), categoria_id=1, conta_id=1, user_id=1))
+        conn.execute(t['transacao'].insert(), [
+            dict(descricao='Escola', valor=50, tipo='DESPESA', data_transacao=data, recorrencia_id=2,
+                 categoria_id=1, conta_id=1, user_id=1)
+            for data in (datetime(2020, 1, 31), datetime(2020, 2, 29), datetime(2020, 3, 29), datetime(2020, 4, 29))
+        ])
+
+    for migracao in migracoes():
+        migracao.upgrade()
+
+    recorrente = db.session.get(TransacaoRecorrente, 1)
+    assert (recorrente.ultimo_indice_gerado, recorrente.ultima_data_gerada) == (1, datetime(2030, 2, 10, 9, 30))
+    assert db.session.get(Usuario, 1).dados_versao == 0
+    escola = db.session.get(TransacaoRecorrente, 2)
+    assert (escola.ultimo_indice_gerado, escola.ultima_data_gerada) == (3, datetime(2020, 4, 29))
+    # A próxima geração continua em maio, sem uma segunda cobrança em abril (30/04)
+    assert escola.gerar_proxima_transacao().data_transacao == datetime(2020, 5, 31)
+    assert [t.data_transacao.month for t in Transacao.query.filter_by(recorrencia_id=2)] == [1, 2, 3, 4, 5]
+    assert sorted((tr.ano_mes, tr.descricao_normalizada) for tr in Transacao.query.filter_by(recorrencia_id=1)) == [
+        (203001, 'aluguel'), (203002, 'aluguel')]
+    assert sorted((r.ano_mes, r.total) for r in ResumoMensal.query.filter(ResumoMensal.ano_mes >= 203001)) == [
+        (203001, 100), (203002, 100)]
+    # Índice único por dia: a mesma ocorrência em outro horário é recusada
+    with pytest.raises(IntegrityError), db.engine.begin() as conn:
+        conn.execute(t['transacao'].insert().values(
+            descricao='Aluguel', valor=100, tipo='DESPESA', data_transacao=datetime(2030, 2, 10),
+            recorrencia_id=1, categoria_id=1, conta_id=1, user_id=1))
+
+    # Esquema e modelos em acordo: a escrita pelo ORM (que incrementa dados_versao) funciona
+    versao = db.session.get(Usuario, 1).dados_versao
+    recorrente.valor = 120
+    db.session.commit()
+    assert db.session.get(Usuario, 1).dados_versao == versao + 1
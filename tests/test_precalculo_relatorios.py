@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+
+from models import db, Categoria, Transacao, TipoTransacao
+
+
+@pytest.fixture
+def app(app_principal):
+    return app_principal
+
+
+@pytest.fixture
+def precalculo(modulo_app, usuario, conta):
+    """Pré-cálculo de app.py (síncrono em TESTING), sem agendamentos anteriores ao teste"""
+    precalculo = modulo_app.precalculo_relatorios
+    assert precalculo.sincrono and precalculo._thread is None
+    precalculo.executar_pendentes()
+    return precalculo
+
+
+def test_varias_escritas_geram_um_pre_calculo_e_a_leitura_usa_o_cache(modulo_app, precalculo, cliente, usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+    for mes in (1, 2, 3):
+        db.session.add(Transacao(descricao='Luz', valor=100, tipo=TipoTransacao.DESPESA,
+                                 data_transacao=datetime(datetime.now().year, mes, 5),
+                                 categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id))
+        db.session.commit()
+
+    situacao = precalculo.situacao()
+    assert [p['user_id'] for p in situacao['pendentes']] == [usuario.id]
+    concluidos = precalculo.concluidos
+    assert precalculo.executar_pendentes() == 1
+    assert precalculo.concluidos == concluidos + 1 and precalculo.erros == 0
+    assert precalculo.situacao()['pendentes'] == []
+
+    cache = modulo_app.cache_relatorios
+    faltas, acertos = cache.faltas, cache.acertos
+    assert cliente.get('/relatorios').status_code == 200
+    assert cache.acertos > acertos and cache.faltas == faltas
+
+
+def test_situacao_do_pre_calculo_para_administradores(precalculo, cliente, usuario):
+    assert cliente.get('/admin/precalculo-relatorios').status_code == 403
+
+    usuario.is_admin = True
+    db.session.commit()
+    precalculo.executar_pendentes()
+
+    dados = cliente.get('/admin/precalculo-relatorios').get_json()
+    assert dados['success'] and dados['ativo'] and dados['sincrono']
+    assert dados['pendentes'] == [] and dados['em_andamento'] is None
+    assert dados['recentes'][-1]['user_id'] == usuario.id and dados['recentes'][-1]['erro'] is None
+    assert set(dados['cache']) == {'tamanho', 'entradas', 'acertos', 'faltas'}
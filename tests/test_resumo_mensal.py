@@ -0,0 +1,163 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db, Conta, Categoria, Transacao, TransacaoRecorrente, ResumoMensal, TipoTransacao, TipoRecorrencia
+import resumo_dashboard
+
+
+def resumo():
+    return {(r.conta_id, r.categoria_id, r.ano_mes, r.tipo): (round(r.total, 2), r.quantidade)
+            for r in ResumoMensal.query.all()}
+
+
+def esperado():
+    # Estado atual do resumo, recalculado do zero a partir da tabela de transações
+    atual = resumo()
+    ResumoMensal.reconstruir()
+    recalculado = resumo()
+    db.session.rollback()
+    assert resumo() == atual
+    return recalculado
+
+
+def test_resumo_acompanha_inclusao_alteracao_exclusao_e_materializacao(usuario, conta):
+    poupanca = Conta(nome='Poupanca', user_id=usuario.id)
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add_all([poupanca, casa])
+    db.session.commit()
+
+    def transacao(valor, data, tipo=TipoTransacao.DESPESA):
+        return Transacao(descricao='T', valor=valor, tipo=tipo, data_transacao=data,
+                         conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+
+    aluguel = transacao(1000, datetime(2030, 1, 5))
+    luz = transacao(200, datetime(2030, 1, 20))
+    salario = transacao(5000, datetime(2030, 1, 1), TipoTransacao.RECEITA)
+    db.session.add_all([aluguel, luz, salario])
+    db.session.commit()
+    assert resumo() == {
+        (conta.id, casa.id, 203001, TipoTransacao.DESPESA): (1200, 2),
+        (conta.id, casa.id, 203001, TipoTransacao.RECEITA): (5000, 1),
+    }
+
+    # Mudar valor, mês e conta tira a transação de uma linha e a soma em outra
+    luz.valor = 250
+    luz.data_transacao = datetime(2030, 2, 3)
+    luz.conta_id = poupanca.id
+    db.session.commit()
+    assert resumo()[(conta.id, casa.id, 203001, TipoTransacao.DESPESA)] == (1000, 1)
+    assert resumo()[(poupanca.id, casa.id, 203002, TipoTransacao.DESPESA)] == (250, 1)
+    assert resumo() == esperado()
+
+    # A linha que fica sem transações é removida
+    db.session.delete(salario)
+    db.session.commit()
+    assert (conta.id, casa.id, 203001, TipoTransacao.RECEITA) not in resumo()
+
+    # O INSERT em lote das recorrências também entra no resumo
+    mensal = TransacaoRecorrente(descricao='Internet', valor=100, tipo=TipoTransacao.DESPESA,
+                                 tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=datetime(2030, 1, 10),
+                                 categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id)
+    db.session.add(mensal)
+    db.session.commit()
+    mensal.materializar([(0, datetime(2030, 1, 10)), (1, datetime(2030, 2, 10))])
+    db.session.commit()
+    assert resumo()[(conta.id, casa.id, 203001, TipoTransacao.DESPESA)] == (1100, 2)
+    assert resumo()[(conta.id, casa.id, 203002, TipoTransacao.DESPESA)] == (100, 1)
+    assert resumo() == esperado()
+
+
+def test_totais_e_serie_diaria_do_dashboard(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+
+    def transacao(valor, data, tipo=TipoTransacao.DESPESA):
+        return Transacao(descricao='T', valor=valor, tipo=tipo, data_transacao=data,
+                         conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+
+    db.session.add_all([
+        transacao(1000, datetime(2030, 1, 5)),
+        transacao(5000, datetime(2030, 2, 1), TipoTransacao.RECEITA),
+        transacao(200, datetime(2030, 2, 1)),
+        transacao(50, datetime(2030, 2, 20)),
+        transacao(300, datetime(2030, 3, 10)),
+    ])
+    db.session.commit()
+    user_id = usuario.id
+
+    consultas = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: consultas.append(args[2]))
+    totais = resumo_dashboard.totais(db.session, ResumoMensal, user_id, 203002)
+    assert len(consultas) == 1
+    assert totais == {
+        'receitas_total': 5000, 'despesas_total': 1550,
+        'receitas_mes': 5000, 'despesas_mes': 250,
+        'receitas_desde_mes': 5000, 'despesas_desde_mes': 550,
+    }
+
+    serie = resumo_dashboard.serie_diaria(db.session, Transacao, user_id,
+                                          datetime(2030, 2, 1), datetime(2030, 2, 28, 23, 59, 59))
+    assert len(consultas) == 2
+    assert serie == {1: (5000, 200), 20: (0, 50)}
+
+
+def test_comparacao_mensal_em_uma_consulta(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+    # Um lançamento a cada 5 meses, de 2027 a 2030
+    db.session.add_all([
+        Transacao(descricao='T', valor=10 * i, tipo=TipoTransacao.DESPESA if i % 2 else TipoTransacao.RECEITA,
+                  data_transacao=datetime(2027 + i * 5 // 12, 1 + i * 5 % 12, 15),
+                  conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+        for i in range(1, 10)
+    ])
+    db.session.commit()
+    user_id = usuario.id
+
+    consultas = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: consultas.append(args[2]))
+    for meses in (6, 24, 48):
+        antes = len(consultas)
+        serie = resumo_dashboard.totais_mensais(db.session, ResumoMensal, user_id, datetime(2030, 12, 31), meses)
+        assert len(consultas) - antes == 1  # uma consulta, qualquer que seja o número de meses
+        assert len(serie) == meses
+        assert serie[-1][0] == datetime(2030, 12, 1)
+
+    # Meses sem lançamentos vêm zerados; os demais com os totais do mês
+    por_mes = {dia.year * 100 + dia.month: (receitas, despesas) for dia, receitas, despesas in serie}
+    assert len(por_mes) == 48
+    assert por_mes[202706] == (0, 10)
+    assert por_mes[202711] == (20, 0)
+    assert por_mes[202707] == (0, 0)
+    assert sum(r + d for r, d in por_mes.values()) == sum(10 * i for i in range(1, 10))
+
+
+def test_ano_mes_gravado_na_transacao(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add(casa)
+    db.session.commit()
+
+    luz = Transacao(descricao='Luz', valor=100, tipo=TipoTransacao.DESPESA, data_transacao=datetime(2030, 12, 31, 23),
+                    conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+    sem_data = Transacao(descricao='Agora', valor=1, tipo=TipoTransacao.DESPESA,
+                         conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id)
+    db.session.add_all([luz, sem_data])
+    db.session.commit()
+    assert luz.ano_mes == 203012
+    assert sem_data.ano_mes == sem_data.data_transacao.year * 100 + sem_data.data_transacao.month
+
+    luz.data_transacao = datetime(2031, 1, 2)
+    db.session.commit()
+    assert luz.ano_mes == 203101
+
+    mensal = TransacaoRecorrente(descricao='Internet', valor=100, tipo=TipoTransacao.DESPESA,
+                                 tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=datetime(2030, 1, 10),
+                                 categoria_id=casa.id, conta_id=conta.id, user_id=usuario.id)
+    db.session.add(mensal)
+    db.session.commit()
+    mensal.materializar([(0, datetime(2030, 1, 10)), (1, datetime(2030, 2, 10))])
+    db.session.commit()
+    assert sorted(t.ano_mes for t in Transacao.query.filter_by(recorrencia_id=mensal.id)) == [203001, 203002]
@@ -0,0 +1,32 @@
+import csv
+import io
+from datetime import datetime
+
+import pytest
+
+from models import db, Categoria, Transacao, TipoTransacao
+
+
+@pytest.fixture
+def app(app_principal):
+    return app_principal
+
+
+def _exportar(cliente, **params):
+    resposta = cliente.get('/transacoes/exportar', query_string=params)
+    assert resposta.status_code == 200
+    return list(csv.reader(io.StringIO(resposta.get_data(as_text=True).lstrip('\ufeff'))))[1:]
+
+
+def test_exportacao_ajusta_mes_fora_do_calendario(cliente, conta):
+    cat = Categoria(nome='Mercado', user_id=conta.user_id)
+    db.session.add(cat)
+    db.session.commit()
+    for dia in (datetime(2030, 1, 10), datetime(2030, 12, 10), datetime(2031, 1, 10)):
+        db.session.add(Transacao(descricao=f'Compra {dia:%m/%Y}', valor=10, tipo=TipoTransacao.DESPESA,
+                                 data_transacao=dia, categoria_id=cat.id, conta_id=conta.id, user_id=conta.user_id))
+    db.session.commit()
+
+    assert [l[1] for l in _exportar(cliente, ano=2030, mes_atual=13)] == ['Compra 12/2030']
+    assert [l[1] for l in _exportar(cliente, ano=2030, mes_atual=0)] == ['Compra 01/2030']
+    assert _exportar(cliente, ano=0, mes_atual=1) == []
@@ -0,0 +1,42 @@
+import os
+from datetime import datetime
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from models import db, Categoria, Transacao, TransacaoRecorrente, TipoTransacao, TipoRecorrencia
+
+
+@pytest.fixture
+def app(app_principal):
+    return app_principal
+
+
+def test_primeira_requisicao_do_dia_grava_ocorrencias_vencidas(modulo_app, cliente, conta):
+    cat = Categoria(nome='Moradia', user_id=conta.user_id)
+    db.session.add(cat)
+    db.session.commit()
+    inicio = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0) - relativedelta(months=2)
+    recorrente = TransacaoRecorrente(descricao='Aluguel', valor=100, tipo=TipoTransacao.DESPESA,
+                                     tipo_recorrencia=TipoRecorrencia.MENSAL, data_inicio=inicio,
+                                     categoria_id=cat.id, conta_id=conta.id, user_id=conta.user_id)
+    db.session.add(recorrente)
+    db.session.commit()
+    recorrente.materializar([(0, inicio)])
+    db.session.commit()
+    recorrencia_id = recorrente.id
+    modulo_app.materializacao._atendidos.clear()
+
+    # Nenhuma edição da recorrência: basta o usuário acessar o sistema
+    assert cliente.get('/transacoes').status_code == 200
+    db.session.expire_all()
+    assert Transacao.query.filter_by(recorrencia_id=recorrencia_id).count() == 3
+
+
+def test_rastreio_identifica_o_worker_das_amostras(cliente, usuario):
+    usuario.is_admin = True
+    db.session.commit()
+
+    dados = cliente.get('/admin/rastreio-recorrencias').get_json()
+    assert dados['success'] and dados['escopo'] == 'processo'
+    assert dados['pid'] == os.getpid() and str(os.getpid()) in dados['aviso']
@@ -0,0 +1,122 @@
+from datetime import date, datetime
+
+from sqlalchemy import event
+
+from models import db, Conta, Categoria, Transacao, TipoTransacao
+
+
+def test_saldos_das_contas_em_uma_consulta_e_invalidados_na_escrita(usuario, conta):
+    user_id = usuario.id
+    corrente = conta
+    corrente.saldo_inicial = 100
+    poupanca = Conta(nome='Poupanca', saldo_inicial=50, user_id=user_id)
+    vazia = Conta(nome='Vazia', saldo_inicial=10, user_id=user_id)
+    casa = Categoria(nome='Casa', user_id=user_id)
+    db.session.add_all([corrente, poupanca, vazia, casa])
+    db.session.commit()
+    ids = (corrente.id, poupanca.id, vazia.id, casa.id)
+
+    def transacao(conta_id, valor, tipo=TipoTransacao.DESPESA, mes=1):
+        return Transacao(descricao='T', valor=valor, tipo=tipo, data_transacao=datetime(2030, mes, 5),
+                         conta_id=conta_id, categoria_id=ids[3], user_id=user_id)
+
+    db.session.add_all([
+        transacao(ids[0], 1000, TipoTransacao.RECEITA),
+        transacao(ids[0], 300, mes=2),
+        transacao(ids[0], 200, mes=3),
+        transacao(ids[1], 40),
+    ])
+    db.session.commit()
+    db.session.expunge_all()
+
+    contas = Conta.query.filter_by(user_id=user_id).order_by(Conta.id).all()
+    consultas = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: consultas.append(args[2]))
+    Conta.carregar_saldos(contas)
+    dados = [conta.to_dict() for conta in contas]
+    assert len(consultas) == 1
+    assert [(d['saldo_atual'], d['total_receitas'], d['total_despesas'], d['transacoes_count']) for d in dados] == [
+        (600, 1000, 500, 3),
+        (10, 0, 40, 1),
+        (10, 0, 0, 0),
+    ]
+
+    # Uma escrita na conta descarta os totais guardados nela
+    corrente = contas[0]
+    nova = transacao(corrente.id, 50, TipoTransacao.RECEITA)
+    db.session.add(nova)
+    db.session.flush()
+    assert corrente.saldo_atual == 650
+    nova.conta_id = ids[1]
+    db.session.flush()
+    assert (corrente.saldo_atual, contas[1].saldo_atual) == (600, 60)
+    db.session.rollback()
+    assert (contas[0].saldo_atual, contas[1].saldo_atual) == (600, 10)
+
+
+def test_saldos_diarios_partem_do_ponto_de_controle_mensal(usuario, conta):
+    conta.saldo_inicial = 1000
+    outra = Conta(nome='Outra', user_id=usuario.id)
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    db.session.add_all([outra, casa])
+    db.session.commit()
+
+    lancamentos = [
+        (conta.id, datetime(2029, 11, 3), 500, TipoTransacao.RECEITA),
+        (conta.id, datetime(2029, 12, 31, 22, 0), 100, TipoTransacao.DESPESA),
+        (conta.id, datetime(2030, 1, 2, 9, 30), 40, TipoTransacao.DESPESA),
+        (conta.id, datetime(2030, 1, 2, 18, 0), 10, TipoTransacao.DESPESA),
+        (conta.id, datetime(2030, 2, 1), 300, TipoTransacao.RECEITA),
+        (outra.id, datetime(2030, 1, 2), 999, TipoTransacao.RECEITA),
+    ]
+    db.session.add_all([
+        Transacao(descricao='T', valor=valor, tipo=tipo, data_transacao=data,
+                  conta_id=conta_id, categoria_id=casa.id, user_id=usuario.id)
+        for conta_id, data, valor, tipo in lancamentos
+    ])
+    db.session.commit()
+
+    def esperado(dia):
+        saldo = 1000
+        for conta_id, data, valor, tipo in lancamentos:
+            if conta_id == conta.id and data.date() <= dia:
+                saldo += valor if tipo == TipoTransacao.RECEITA else -valor
+        return saldo
+
+    db.session.refresh(conta)
+    consultas = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: consultas.append(args[2]))
+    serie = conta.saldos_diarios(date(2029, 12, 30), date(2030, 2, 2))
+    assert len(consultas) == 2
+    assert len(serie) == 35
+    assert serie == [(dia, esperado(dia)) for dia, _ in serie]
+    assert serie[0] == (date(2029, 12, 30), 1500)
+    assert dict(serie)[date(2030, 1, 2)] == 1350
+    assert conta.saldo_em(date(2030, 2, 1)) == 1650
+
+    # Uma escrita retroativa entra no ponto de controle dos meses seguintes
+    db.session.add(Transacao(descricao='T', valor=25, tipo=TipoTransacao.DESPESA, data_transacao=datetime(2029, 10, 1),
+                             conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id))
+    db.session.commit()
+    assert conta.saldo_em(date(2030, 1, 2)) == 1325
+    assert conta.saldos_diarios(date(2030, 2, 2), date(2030, 2, 1)) == []
+
+
+def test_conta_desanexada_consulta_os_totais_pelo_id(usuario, conta):
+    casa = Categoria(nome='Casa', user_id=usuario.id)
+    conta.saldo_inicial = 100
+    db.session.add(casa)
+    db.session.commit()
+    db.session.add(Transacao(descricao='T', valor=30, tipo=TipoTransacao.DESPESA, data_transacao=datetime(2030, 1, 5),
+                             conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id))
+    db.session.commit()
+    db.session.refresh(conta)
+    db.session.expunge(conta)
+
+    # Sem sessão, nada avisaria a instância de uma escrita: os totais não ficam guardados nela
+    assert (conta.saldo_atual, conta.total_despesas, conta.total_transacoes) == (70, 30, 1)
+    db.session.add(Transacao(descricao='T', valor=20, tipo=TipoTransacao.DESPESA, data_transacao=datetime(2030, 1, 6),
+                             conta_id=conta.id, categoria_id=casa.id, user_id=usuario.id))
+    db.session.commit()
+    assert Conta.carregar_saldos([conta]) == [conta]
+    assert (conta.saldo_atual, conta.total_transacoes) == (50, 2)